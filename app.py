@@ -1,13 +1,38 @@
 from fastapi import FastAPI, UploadFile, File, Request
-from fastapi.responses import FileResponse, JSONResponse, HTMLResponse
+from fastapi.responses import JSONResponse, HTMLResponse, StreamingResponse, Response, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.background import BackgroundTask
 import os
-import shutil
+import time
 import uuid
-import json
-from browser_pdf_generator import BrowserPDFGenerator, load_json_data, generate_pdf_with_playwright, generate_pdf_with_playwright_async
+import asyncio
+from typing import Optional
+from assets import AssetRegistry
+from browser_pdf_generator import BrowserPDFGenerator, TEMPLATE_MAP, TEMPLATE_WATCH_INTERVAL
+from browser_pool import BrowserPool, READY_MODE, READY_MODES
+from output_store import OutputStore, RETAIN_OUTPUTS
+from pdf_cache import PDFCache, CACHE_ENABLED, make_cache_key, etag_matches
+from segments import StaticPageCache
+from large_report import LargeReportRenderer, LARGE_REPORT_BUDGET_SECONDS
+from sections import SectionRenderer
+from optimize import PDFOptimizer, OPTIMIZE_MODES
+from engines import BrowserEngine, LiteEngine, ENGINES, default_engine, engine_for, select_engine
+from render_options import DEFAULT_RENDER_OPTIONS, RenderOptions
+from renderer import RendererClient, RENDERER_SOCKET, render_document
+from shared_stats import SharedStats, STATS_DB
+from warmup import Warmup, READY_MAX_QUEUE_DEPTH
+from payload import (MAX_BODY_BYTES, MAX_BATCH_BODY_BYTES, PayloadError, PayloadTooLarge, check_size,
+                     parse_payload, parse_render_options, read_body, validate_payload)
+from metrics import MetricsRegistry, TimingMiddleware, render_prometheus, server_timing, log_timings
+from scheduler import (RenderScheduler, REQUEST_DEADLINE_MS, default_max_inflight, SchedulerOverloaded, DeadlineExceeded,
+                       ClientDisconnected, deadline_from_ms, run_until_disconnected)
+from jobs import Job, JobQueue, QueueFullError, validate_webhook_url, DONE, FAILED
+from batch import (BATCH_CONCURRENCY, parse_batch_items, item_filename, run_batch,
+                   stream_zip, stream_multipart, multipart_boundary)
 
 app = FastAPI(title="Proposal PDF Generator")
+metrics = MetricsRegistry()
+app.add_middleware(TimingMiddleware, registry=metrics)
 
 app.add_middleware(
     CORSMiddleware,
@@ -17,18 +42,319 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-UPLOAD_DIR = "uploads"
-OUTPUT_DIR = "outputs"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+# PDFs are streamed back in chunks; Content-Length can be dropped to force chunked transfer
+STREAM_CHUNK_SIZE = 64 * 1024
+SEND_CONTENT_LENGTH = os.environ.get("PDF_SEND_CONTENT_LENGTH", "true").lower() in ("1", "true", "yes")
+# Base URL used for links sent to webhook callbacks
+PUBLIC_BASE_URL = os.environ.get("PDF_PUBLIC_BASE_URL", "http://localhost:8000").rstrip("/")
 
-generator = BrowserPDFGenerator()
+assets = AssetRegistry()
+generator = BrowserPDFGenerator(assets=assets)
+browser_pool = BrowserPool(assets=assets)
+output_store = OutputStore()
+pdf_cache = PDFCache()
+# More concurrent renders than pooled pages would only queue inside the pool
+render_scheduler = RenderScheduler(min(default_max_inflight(), browser_pool.size * browser_pool.pages_per_browser))
+static_pages = StaticPageCache(generator, browser_pool, assets)
+# Chunks and sections rendered next to the request's own render take scheduler slots of their own
+large_reports = LargeReportRenderer(generator, browser_pool, static_pages, scheduler=render_scheduler)
+sections = SectionRenderer(generator, browser_pool, static_pages, scheduler=render_scheduler)
+optimizer = PDFOptimizer()
+# With a renderer service, browsers live there and are shared by all API workers
+renderer_client = RendererClient(RENDERER_SOCKET) if RENDERER_SOCKET else None
+# Lite renders run in this process and need no browser, with or without a renderer service
+engines = {
+    "browser": BrowserEngine(generator, browser_pool, static_pages, large_reports, sections, renderer_client),
+    "lite": LiteEngine(generator, assets),
+}
+shared_stats = SharedStats() if STATS_DB else None
+
+async def render_job(job):
+    """Render a queued job through the PDF cache."""
+    timings = {}
+    pdf_bytes, _ = await get_report_pdf(job.template, job.data, job.ready_mode, timings, optimize=job.optimize,
+                                        options=job.options, engine=job.engine)
+    metrics.observe_timings(timings)
+    return pdf_bytes
+
+job_queue = JobQueue(render_job)
+request_stats = {"client_disconnects": 0}
+template_watcher = None
+warmup = Warmup()
+warmup_task = None
+started_at = time.time()
+
+async def prewarm_render(template, data):
+    """Throwaway render used to warm up the render path, outside the scheduler and cache."""
+    template_name, engine = TEMPLATE_MAP[template], default_engine(engines, template)
+    if engine != "browser":
+        return await engines[engine].render(template_name, data, READY_MODE, {})
+    if renderer_client is not None:
+        return await renderer_client.render(template_name, data, READY_MODE)
+    return await render_document(generator, browser_pool, static_pages, template_name, data, READY_MODE, {},
+                                 large_reports, sections=sections)
+
+@app.on_event("startup")
+async def start_browser_pool():
+    global template_watcher, warmup_task
+    # Assets are decoded and downscaled once, off the event loop
+    await asyncio.to_thread(assets.load)
+    # Compile templates before the first request instead of during it
+    await asyncio.to_thread(generator.precompile)
+    if TEMPLATE_WATCH_INTERVAL > 0:
+        template_watcher = asyncio.create_task(generator.watch(TEMPLATE_WATCH_INTERVAL))
+    if renderer_client is not None:
+        print(f"Rendering through the renderer service at {RENDERER_SOCKET}")
+    elif uses_browser():
+        await browser_pool.start()
+    else:
+        # Requests for the browser engine still start the pool on their first render
+        print("Every template renders with the lite engine; the browser pool starts on demand")
+    if shared_stats is not None:
+        shared_stats.start(f"api-{os.getpid()}", worker_snapshot)
+    if RETAIN_OUTPUTS:
+        output_store.start_cleanup()
+    job_queue.start(pdf_url_for=lambda job: f"{PUBLIC_BASE_URL}/jobs/{job.id}/pdf")
+    # Requests are served while the templates are prewarmed; /readyz reports ready once they are
+    warmup_task = asyncio.create_task(warmup.run(prewarm_render, TEMPLATE_MAP))
+
+@app.on_event("shutdown")
+async def stop_browser_pool():
+    if template_watcher is not None:
+        template_watcher.cancel()
+    if warmup_task is not None:
+        warmup_task.cancel()
+    await job_queue.stop()
+    if shared_stats is not None:
+        await shared_stats.stop()
+    await output_store.stop_cleanup()
+    await browser_pool.stop()
+
+def renders_in_chunks(data, options, engine="browser"):
+    """Whether a report is rendered in large-report mode."""
+    return engine == "browser" and options.merge_safe and large_reports.applies(data)
+
+def renders_by_section(template, data, options, engine="browser"):
+    """Whether a report is assembled from cached sections."""
+    return (engine == "browser" and options.merge_safe and not large_reports.applies(data)
+            and sections.applies(TEMPLATE_MAP[template], data))
+
+def uses_browser():
+    """Whether any template renders with the browser by default; lite-only deployments need no browser to be ready."""
+    return any(default_engine(engines, template) == "browser" for template in TEMPLATE_MAP)
+
+def resolve_engine(template, engine, options):
+    """Name of the engine that renders a report: the requested one, the template's or PDF_ENGINE's.
+
+    Requests the engine can't render go to the browser and count as a
+    fallback of that engine. Raises ValueError for unknown engines.
+    """
+    if engine and engine not in ENGINES:
+        raise ValueError(f"Invalid engine. Must be one of: {', '.join(ENGINES)}")
+    wanted = engines[engine_for(template, engine or None)]
+    selected = select_engine(engines, template, engine or None, options)
+    if selected is not wanted:
+        # Counted here, once per request the browser takes over
+        wanted.stats["fallbacks"] += 1
+    return selected.name
+
+async def render_report(template, data, ready_mode, timings, deadline=None, options=DEFAULT_RENDER_OPTIONS,
+                        render_info=None, engine="browser"):
+    """Render the template for the given data straight to PDF bytes.
+
+    Every render goes through the global scheduler; ``deadline`` (event-loop
+    time) bounds both the wait for a slot and the render itself. Large
+    reports get at most PDF_LARGE_REPORT_BUDGET_SECONDS, or the deadline if
+    it is sooner.
+    """
+    if renders_in_chunks(data, options, engine):
+        budget = deadline_from_ms(LARGE_REPORT_BUDGET_SECONDS * 1000)
+        deadline = min(filter(None, (deadline, budget)), default=None)
+    queued = time.perf_counter()
+    async with render_scheduler.slot(deadline):
+        timings["queue_wait"] = time.perf_counter() - queued
+        render = engines[engine].render(TEMPLATE_MAP[template], data, ready_mode, timings, options, render_info,
+                                        deadline)
+        if deadline is None:
+            return await render
+        try:
+            return await asyncio.wait_for(render, max(0, deadline - asyncio.get_running_loop().time()))
+        except asyncio.TimeoutError:
+            render_scheduler.stats["deadline_exceeded"] += 1
+            raise DeadlineExceeded("Deadline exceeded while rendering")
+
+def iter_chunks(data, chunk_size=STREAM_CHUNK_SIZE):
+    """Yield a bytes object in chunks without copying it."""
+    view = memoryview(data)
+    for start in range(0, len(view), chunk_size):
+        yield view[start:start + chunk_size]
+
+def pdf_response(pdf_bytes, template, timings, headers=None):
+    """Stream the PDF back, persisting a copy in the background if retention is enabled."""
+    output_filename = f"{template}_report_output.pdf"
+    headers = {
+        **(headers or {}),
+        "Content-Disposition": f'attachment; filename="{output_filename}"',
+        "X-Ready-Wait-Ms": f"{timings.get('ready_wait', 0) * 1000:.0f}",
+        "X-Template-Render-Ms": f"{timings.get('template_render', 0) * 1000:.1f}",
+    }
+    if timings:
+        headers["Server-Timing"] = server_timing(timings)
+    if SEND_CONTENT_LENGTH:
+        headers["Content-Length"] = str(len(pdf_bytes))
+    background = None
+    if RETAIN_OUTPUTS:
+        background = BackgroundTask(output_store.save, f"output_{uuid.uuid4().hex}.pdf", pdf_bytes)
+    return StreamingResponse(iter_chunks(pdf_bytes), media_type="application/pdf",
+                             headers=headers, background=background)
+
+def report_cache_key(template, data, optimize="none", options=DEFAULT_RENDER_OPTIONS, engine="browser"):
+    """Cache key covering the template, template/asset versions, the data, render options, optimize mode and engine."""
+    template_name = TEMPLATE_MAP[template]
+    template_version = generator.template_digest(template_name) + assets.digest + engines[engine].version
+    if static_pages.enabled and options.merge_safe and engine == "browser":
+        template_version += ":segmented"
+    if renders_in_chunks(data, options, engine):
+        template_version += large_reports.version
+    elif renders_by_section(template, data, options, engine):
+        template_version += sections.version
+    template_version += options.version + optimizer.version(optimize)
+    return make_cache_key(template_name, template_version, data, data.get("blur_funds", False))
+
+def extract_options(data):
+    """Pop the render options from a JSON payload and validate them.
+
+    Returns ``(template, ready_mode, optimize, render_options, engine)`` and leaves
+    ``blur_funds`` in the data for template use. Raises ValueError for invalid
+    options; ``render_options`` has already been validated with the payload.
+    """
+    template = str(data.pop("template", "invest4edu")).lower()
+    blur_funds = data.pop("blur_funds", False)
+    ready_mode = data.pop("ready_mode", READY_MODE)
+    optimize = data.pop("optimize", optimizer.mode)
+    options = RenderOptions.model_validate(data.pop("render_options", None) or {})
+    engine = str(data.pop("engine", None) or "").lower()
+    if template not in TEMPLATE_MAP:
+        raise ValueError("Invalid template. Must be 'invest4edu' or 'investvalue'")
+    if ready_mode not in READY_MODES:
+        raise ValueError(f"Invalid ready_mode. Must be one of: {', '.join(READY_MODES)}")
+    if optimize not in OPTIMIZE_MODES:
+        raise ValueError(f"Invalid optimize. Must be one of: {', '.join(OPTIMIZE_MODES)}")
+    engine = resolve_engine(template, engine, options)
+    # Add blur_funds back to the data for template use
+    data["blur_funds"] = blur_funds
+    return template, ready_mode, optimize, options, engine
+
+async def get_report_pdf(template, data, ready_mode, timings, cache_key=None, deadline=None, optimize="none",
+                         render_info=None, options=DEFAULT_RENDER_OPTIONS, engine="browser"):
+    """Return ``(pdf_bytes, cache_status)``, using the PDF cache when enabled.
+
+    Fresh renders are optimized before they are cached. ``render_info``
+    receives their size before and after optimization (``original_size`` and
+    ``optimized_size``) and, for reports assembled from sections, how many
+    sections were reused (``sections_reused`` and ``sections_rendered``).
+    """
+    async def render():
+        pdf_bytes = await render_report(template, data, ready_mode, timings, deadline, options, render_info, engine)
+        # Optimizing is CPU work in a thread; it doesn't need a render slot
+        optimized, original_size = await optimizer.optimize(pdf_bytes, optimize, timings)
+        if render_info is not None and optimized and optimize != "none":
+            render_info.update(original_size=original_size, optimized_size=len(optimized))
+        return optimized
+
+    if not CACHE_ENABLED:
+        return await render(), "disabled"
+    if cache_key is None:
+        cache_key = report_cache_key(template, data, optimize, options, engine)
+    return await pdf_cache.get_or_render(cache_key, render)
+
+def json_body(example):
+    """OpenAPI request body for endpoints that read and validate the JSON themselves."""
+    return {"requestBody": {"required": True, "content": {"application/json": {"example": example}}}}
+
+def payload_error_response(e):
+    """413 for oversized bodies, 422 with field errors for invalid data, 400 otherwise."""
+    if isinstance(e, PayloadTooLarge):
+        return JSONResponse({"error": str(e)}, status_code=413)
+    if e.errors:
+        return JSONResponse({"error": str(e), "fields": e.errors}, status_code=422)
+    return JSONResponse({"error": str(e)}, status_code=400)
+
+def request_elapsed(request):
+    """Seconds since the request arrived, as recorded by TimingMiddleware."""
+    return time.perf_counter() - getattr(request.state, "request_start", time.perf_counter())
+
+async def generate_report_response(request, template, data, ready_mode, deadline_ms=None, timings=None,
+                                   optimize="none", options=DEFAULT_RENDER_OPTIONS, engine="browser"):
+    """Serve a report from the PDF cache, rendering it on a miss.
+
+    The render is cancelled if the client disconnects before it finishes.
+    ``timings`` may already hold the parse and validate stages. Without a
+    ``deadline_ms`` from the client, reports get PDF_REQUEST_DEADLINE_MS, or
+    PDF_LARGE_REPORT_BUDGET_SECONDS in large-report mode.
+    """
+    timings = {} if timings is None else timings
+    if deadline_ms is None:
+        deadline_ms = (LARGE_REPORT_BUDGET_SECONDS * 1000 if renders_in_chunks(data, options, engine)
+                       else REQUEST_DEADLINE_MS)
+    headers = {}
+    render_info = {}
+    cache_status = None
+    try:
+        cache_key = None
+        if CACHE_ENABLED:
+            cache_key = report_cache_key(template, data, optimize, options, engine)
+            etag = f'"{cache_key}"'
+            headers["ETag"] = etag
+            if etag_matches(request.headers.get("if-none-match"), etag):
+                pdf_cache.stats["not_modified"] += 1
+                return Response(status_code=304, headers=headers)
+        pdf_bytes, cache_status = await run_until_disconnected(
+            request.is_disconnected,
+            get_report_pdf(template, data, ready_mode, timings, cache_key, deadline_from_ms(deadline_ms), optimize, render_info,
+                           options, engine))
+        if CACHE_ENABLED:
+            headers["X-Cache"] = "MISS" if cache_status in ("miss", "shared") else "HIT"
+        headers["X-PDF-Engine"] = engine
+        if optimize != "none":
+            headers["X-PDF-Optimize"] = optimize
+        if "optimized_size" in render_info:
+            headers["X-PDF-Original-Size"] = str(render_info["original_size"])
+            headers["X-PDF-Optimized-Size"] = str(render_info["optimized_size"])
+        if "sections_reused" in render_info:
+            headers["X-Sections-Reused"] = str(render_info["sections_reused"])
+            headers["X-Sections-Rendered"] = str(render_info["sections_rendered"])
+        if not pdf_bytes:
+            return JSONResponse({"error": "PDF generation failed."}, status_code=500)
+    except SchedulerOverloaded as e:
+        return JSONResponse({"error": str(e)}, status_code=503, headers={"Retry-After": str(e.retry_after)})
+    except DeadlineExceeded as e:
+        return JSONResponse({"error": str(e)}, status_code=504)
+    except ClientDisconnected:
+        request_stats["client_disconnects"] += 1
+        print("Client disconnected, render cancelled")
+        # Nobody is listening; 499 follows the nginx convention for logs
+        return Response(status_code=499)
+    except Exception as e:
+        print(f"Error during PDF generation: {str(e)}")
+        return JSONResponse({"error": f"PDF generation error: {str(e)}"}, status_code=500)
+    finally:
+        metrics.observe_timings(timings)
+        log_timings("pdf_request", timings, template=template, cache=cache_status)
+
+    return pdf_response(pdf_bytes, template, timings, headers)
 
 @app.post("/generate-pdf/")
 async def generate_pdf_from_json(
+    request: Request,
     data_file: UploadFile = File(...),
     template: str = "invest4edu",  # Default to invest4edu for backward compatibility
-    blur_funds: bool = False  # Default to not blur the funds
+    blur_funds: bool = False,  # Default to not blur the funds
+    ready_mode: str = READY_MODE,
+    deadline_ms: Optional[int] = None,
+    optimize: str = optimizer.mode,
+    render_options: str = "",
+    engine: str = ""
 ):
     """
     Accept a JSON file and generate a PDF using the specified template.
@@ -37,70 +363,65 @@ async def generate_pdf_from_json(
     - data_file: JSON file containing the data for the report
     - template: Template to use ('invest4edu' or 'investvalue')
     - blur_funds: Whether to blur fund names in the generated PDF
+    - ready_mode: How to detect that the page finished rendering ('load', 'networkidle', 'assets' or 'flag')
+    - deadline_ms: Time budget for queueing and rendering; 504 is returned when it runs out. Defaults to
+      PDF_REQUEST_DEADLINE_MS, or PDF_LARGE_REPORT_BUDGET_SECONDS for large reports
+    - optimize: PDF post-processing ('none', 'fast' or 'small'); see optimize.py
+    - render_options: Page and browser options as a JSON object (see render_options.RenderOptions)
+    - engine: Render backend ('browser' or 'lite'); defaults to the template's engine (see engines.py)
     
     Returns:
-    - Generated PDF file
+    - Generated PDF file; optimized PDFs report their size before and after in
+      X-PDF-Original-Size and X-PDF-Optimized-Size, and X-PDF-Engine names the engine used
     """
+    # The multipart upload was received and parsed before the handler runs
+    timings = {"parse": request_elapsed(request)}
+    start = time.perf_counter()
     # Validate template parameter
     template = template.lower()
-    if template not in ["invest4edu", "investvalue"]:
+    if template not in TEMPLATE_MAP:
         return JSONResponse({"error": "Invalid template. Must be 'invest4edu' or 'investvalue'"}, status_code=400)
-    
-    # Save the uploaded JSON
-    json_filename = f"input_{uuid.uuid4().hex}.json"
-    json_path = os.path.join(UPLOAD_DIR, json_filename)
-    with open(json_path, "wb") as buffer:
-        shutil.copyfileobj(data_file.file, buffer)
-
-    # Load data and check
-    data = load_json_data(json_path)
-    if not data:
-        return JSONResponse({"error": "Invalid JSON data."}, status_code=400)
-        
-    # Add blur_funds parameter to the data for template use
-    data["blur_funds"] = blur_funds
-
-    # Generate HTML using the specific template
-    html_filename = f"report_{uuid.uuid4().hex}.html"
-    html_path = os.path.join(OUTPUT_DIR, html_filename)
-    
-    # Set template files based on the selected template
-    template_map = {
-        "invest4edu": "invest4edu_report.html",
-        "investvalue": "investvalue_report.html"
-    }
-    template_name = template_map[template]
-    
-    generator.generate_html(template_name, data, html_path)
+    if ready_mode not in READY_MODES:
+        return JSONResponse({"error": f"Invalid ready_mode. Must be one of: {', '.join(READY_MODES)}"}, status_code=400)
+    if optimize not in OPTIMIZE_MODES:
+        return JSONResponse({"error": f"Invalid optimize. Must be one of: {', '.join(OPTIMIZE_MODES)}"}, status_code=400)
+    # Reject oversized uploads before reading them
+    if data_file.size is not None and data_file.size > MAX_BODY_BYTES:
+        return payload_error_response(PayloadTooLarge(data_file.size, MAX_BODY_BYTES))
 
-    # Generate PDF from HTML
-    pdf_filename = f"output_{uuid.uuid4().hex}.pdf"
-    pdf_path = os.path.join(OUTPUT_DIR, pdf_filename)
-    
+    # Parse and validate the uploaded JSON straight from memory
     try:
-        pdf_success = await generate_pdf_with_playwright_async(html_path, pdf_path)
-        if not pdf_success or not os.path.exists(pdf_path):
-            return JSONResponse({"error": "PDF generation failed."}, status_code=500)
-    except Exception as e:
-        print(f"Error during PDF generation: {str(e)}")
-        return JSONResponse({"error": f"PDF generation error: {str(e)}"}, status_code=500)
+        options = parse_render_options(render_options)
+        data = parse_payload(await data_file.read())
+    except (PayloadTooLarge, PayloadError) as e:
+        return payload_error_response(e)
+    try:
+        engine = resolve_engine(template, engine.lower(), options)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    timings["validate"] = time.perf_counter() - start
 
-    output_filename = f"{template}_report_output.pdf"
-    return FileResponse(pdf_path, media_type="application/pdf", filename=output_filename)
+    # Add blur_funds parameter to the data for template use
+    data["blur_funds"] = blur_funds
 
-from fastapi import Body
+    return await generate_report_response(request, template, data, ready_mode, deadline_ms, timings, optimize, options,
+                                          engine)
 
-@app.post("/generate-pdf-json/")
+@app.post("/generate-pdf-json/", openapi_extra=json_body({
+    "clientname": "Akhilesh Gupta",
+    "report_title": "Investment Report",
+    "logo_url": "",
+    "investment_products": {"target": "1.00Cr"},
+    "template": "invest4edu",  # or "investvalue"
+    "blur_funds": False,  # Whether to blur fund names
+    "optimize": "none",  # or "fast" / "small"
+    "engine": "browser",  # or "lite"
+    "render_options": {"format": "A4", "margin": {"top": "20mm", "bottom": "20mm"}, "scale": 1.0}
+    # ... (rest of your sample_data.json structure)
+}))
 async def generate_pdf_from_json_body(
-    data: dict = Body(..., example={
-        "clientname": "Akhilesh Gupta",
-        "report_title": "Investment Report",
-        "logo_url": "",
-        "investment_products": {"target": "1.00Cr"},
-        "template": "invest4edu",  # or "investvalue"
-        "blur_funds": False  # Whether to blur fund names
-        # ... (rest of your sample_data.json structure)
-    })
+    request: Request,
+    deadline_ms: Optional[int] = None
 ):
     """
     Accept JSON data in the request body and generate a PDF using the specified template.
@@ -108,54 +429,328 @@ async def generate_pdf_from_json_body(
     Parameters in JSON body:
     - template: (optional) Template to use ('invest4edu' or 'investvalue'). Defaults to 'invest4edu'.
     - blur_funds: (optional) Whether to blur fund names in the generated PDF. Defaults to False.
-    - Other fields: Data to populate the template
+    - ready_mode: (optional) How to detect that the page finished rendering ('load', 'networkidle', 'assets' or 'flag').
+    - optimize: (optional) PDF post-processing ('none', 'fast' or 'small'). Defaults to PDF_OPTIMIZE.
+    - engine: (optional) Render backend ('browser' or 'lite'). Defaults to the template's engine, see engines.py.
+    - render_options: (optional) Page format, margins, scale, header/footer templates, page ranges,
+      tagged/outline PDF, viewport, device scale factor and locale (see render_options.RenderOptions).
+    - Other fields: Data to populate the template, validated against payload.ProposalPayload
+    
+    Query parameters:
+    - deadline_ms: Time budget for queueing and rendering; 504 is returned when it runs out. Defaults to
+      PDF_REQUEST_DEADLINE_MS, or PDF_LARGE_REPORT_BUDGET_SECONDS for large reports
     
     Returns:
-    - Generated PDF file
+    - Generated PDF file, 413 for oversized bodies or 422 with field errors for invalid data
     """
+    try:
+        raw = await read_body(request)
+        timings = {"parse": request_elapsed(request)}
+        start = time.perf_counter()
+        data = parse_payload(raw)
+    except (PayloadTooLarge, PayloadError) as e:
+        return payload_error_response(e)
     # Extract template and blur_funds parameters from data or use defaults
-    template = data.pop("template", "invest4edu").lower()
-    blur_funds = data.pop("blur_funds", False)
-    
-    if template not in ["invest4edu", "investvalue"]:
-        return JSONResponse({"error": "Invalid template. Must be 'invest4edu' or 'investvalue'"}, status_code=400)
-        
-    # Add blur_funds back to the data for template use
-    data["blur_funds"] = blur_funds
+    try:
+        template, ready_mode, optimize, options, engine = extract_options(data)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    timings["validate"] = time.perf_counter() - start
+
+    return await generate_report_response(request, template, data, ready_mode, deadline_ms, timings, optimize, options,
+                                          engine)
+
+@app.post("/generate-pdf-batch/")
+async def generate_pdf_batch(
+    request: Request,
+    concurrency: int = BATCH_CONCURRENCY,
+    format: str = "zip"
+):
+    """
+    Generate PDFs for many clients in one request.
     
-    # Save JSON to a temp file for compatibility
-    json_filename = f"input_{uuid.uuid4().hex}.json"
-    json_path = os.path.join(UPLOAD_DIR, json_filename)
-    with open(json_path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-
-    # Generate HTML using the specific template
-    html_filename = f"report_{uuid.uuid4().hex}.html"
-    html_path = os.path.join(OUTPUT_DIR, html_filename)
+    Request body: a JSON array of report payloads (or {"items": [...]}), or NDJSON
+    with one payload per line (Content-Type: application/x-ndjson). Each payload
+    accepts the same fields as /generate-pdf-json/, including its own template, blur_funds, optimize and render_options.
     
-    # Set template files based on the selected template
-    template_map = {
-        "invest4edu": "invest4edu_report.html",
-        "investvalue": "investvalue_report.html"
-    }
-    template_name = template_map[template]
+    Parameters:
+    - concurrency: Maximum number of reports rendered at the same time for this batch
+    - format: 'zip' (default) or 'multipart' (multipart/mixed, one part per report)
     
-    generator.generate_html(template_name, data, html_path)
+    Returns:
+    - A streamed ZIP archive or multipart response; each PDF is sent as soon as it
+      completes. Failed items are reported in manifest.json (ZIP) or as JSON parts
+      (multipart) without failing the whole batch.
+    """
+    if format not in ("zip", "multipart"):
+        return JSONResponse({"error": "Invalid format. Must be 'zip' or 'multipart'"}, status_code=400)
+    try:
+        items = parse_batch_items(await read_body(request, MAX_BATCH_BODY_BYTES), request.headers.get("content-type", ""))
+    except PayloadTooLarge as e:
+        return payload_error_response(e)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    async def render_item(index, item):
+        # Oversized and invalid items fail on their own, with the error (and failing fields) in the manifest
+        check_size(item, MAX_BODY_BYTES)
+        item = validate_payload(item)
+        template, ready_mode, optimize, options, engine = extract_options(item)
+        timings = {}
+        pdf_bytes, _ = await get_report_pdf(template, item, ready_mode, timings, optimize=optimize, options=options,
+                                            engine=engine)
+        metrics.observe_timings(timings)
+        return item_filename(index, template, item), pdf_bytes
 
-    # Generate PDF from HTML
-    pdf_filename = f"output_{uuid.uuid4().hex}.pdf"
-    pdf_path = os.path.join(OUTPUT_DIR, pdf_filename)
+    results = run_batch(items, render_item, concurrency)
+    headers = {"X-Batch-Size": str(len(items))}
+    if format == "multipart":
+        boundary = multipart_boundary()
+        return StreamingResponse(stream_multipart(results, boundary),
+                                 media_type=f"multipart/mixed; boundary={boundary}", headers=headers)
+    headers["Content-Disposition"] = 'attachment; filename="batch_reports.zip"'
+    return StreamingResponse(stream_zip(results), media_type="application/zip", headers=headers)
+
+@app.post("/jobs", status_code=202, openapi_extra=json_body({
+    "clientname": "Akhilesh Gupta",
+    "template": "invest4edu",
+    "blur_funds": False,
+    "priority": 0,
+    "webhook_url": "https://example.com/pdf-ready"
+    # ... (rest of your sample_data.json structure)
+}))
+async def submit_job(request: Request):
+    """
+    Queue a PDF for asynchronous generation and return immediately.
+    
+    Parameters in JSON body:
+    - Same fields as /generate-pdf-json/
+    - priority: (optional) Higher priority jobs are rendered first. Defaults to 0.
+    - webhook_url: (optional) URL that receives a POST with the job status when it finishes.
     
+    Returns:
+    - 202 with the job id and status/result URLs, or 429 with Retry-After if the queue is full
+    """
     try:
-        pdf_success = await generate_pdf_with_playwright_async(html_path, pdf_path)
-        if not pdf_success or not os.path.exists(pdf_path):
-            return JSONResponse({"error": "PDF generation failed."}, status_code=500)
-    except Exception as e:
-        print(f"Error during PDF generation: {str(e)}")
-        return JSONResponse({"error": f"PDF generation error: {str(e)}"}, status_code=500)
+        data = parse_payload(await read_body(request))
+    except (PayloadTooLarge, PayloadError) as e:
+        return payload_error_response(e)
+    # The schema only lets integers through as priorities
+    priority = data.pop("priority", None) or 0
+    webhook_url = data.pop("webhook_url", None)
+    try:
+        if webhook_url is not None:
+            validate_webhook_url(webhook_url)
+        template, ready_mode, optimize, options, engine = extract_options(data)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
 
-    output_filename = f"{template}_report_output.pdf"
-    return FileResponse(pdf_path, media_type="application/pdf", filename=output_filename)
+    job = Job(template, data, ready_mode, priority=priority, webhook_url=webhook_url, optimize=optimize,
+              options=options, engine=engine)
+    try:
+        await job_queue.submit(job)
+    except QueueFullError as e:
+        return JSONResponse({"error": str(e)}, status_code=429, headers={"Retry-After": str(e.retry_after)})
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/jobs/{job.id}",
+        "pdf_url": f"/jobs/{job.id}/pdf",
+    }
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Return the status of a queued job."""
+    job = await job_queue.backend.get(job_id)
+    if job is None:
+        return JSONResponse({"error": "Job not found."}, status_code=404)
+    return job.to_dict()
+
+@app.get("/jobs/{job_id}/pdf")
+async def get_job_pdf(job_id: str):
+    """Return the PDF of a finished job."""
+    job = await job_queue.backend.get(job_id)
+    if job is None:
+        return JSONResponse({"error": "Job not found."}, status_code=404)
+    if job.status == FAILED:
+        return JSONResponse({"error": job.error, "status": job.status}, status_code=500)
+    if job.status != DONE:
+        return JSONResponse({"error": "Job not finished.", "status": job.status}, status_code=409,
+                            headers={"Retry-After": "1"})
+    pdf_bytes = await job_queue.backend.get_pdf(job_id)
+    if pdf_bytes is None:
+        return JSONResponse({"error": "Job result expired."}, status_code=410)
+    return pdf_response(pdf_bytes, job.template, {})
+
+@metrics.collector
+def collect_metrics():
+    """Gauges and counters read from the components' own stats."""
+    pool = browser_pool.snapshot()
+    scheduler = render_scheduler.snapshot()
+    cache = pdf_cache.snapshot()
+    optimized = optimizer.snapshot()
+    gauges = [
+        ("pdf_browser_pool_browsers", "Running pooled browsers", pool["browsers"]),
+        ("pdf_browser_pool_active_pages", "Pages currently rendering", pool["active_pages"]),
+        ("pdf_browser_pool_idle_pages", "Warm pages waiting for work", pool["idle_pages"]),
+        ("pdf_browser_pool_capacity", "Maximum concurrent pages of the pool", pool["capacity"]),
+        ("pdf_inflight_renders", "Renders holding a scheduler slot", scheduler["inflight"]),
+        ("pdf_render_queue_depth", "Renders waiting for a scheduler slot", scheduler["queue_depth"]),
+        ("pdf_render_max_inflight", "Scheduler concurrency limit", scheduler["max_inflight"]),
+        ("pdf_job_queue_depth", "Queued asynchronous jobs", job_queue.stats["queued"]),
+        ("pdf_cache_memory_bytes", "Bytes held by the in-memory PDF cache", cache["memory_bytes"]),
+        ("pdf_browser_rss_bytes", "Resident memory of the pooled browsers' process trees", pool["browser_rss_bytes"]),
+    ]
+    for name, help, value in gauges:
+        yield name, "gauge", help, {}, value
+    counters = [
+        ("pdf_timeouts_total", "Requests that exceeded their deadline", {}, scheduler["deadline_exceeded"]),
+        ("pdf_overload_rejections_total", "Requests rejected with 503 because the render queue was full", {},
+         scheduler["rejected"]),
+        ("pdf_client_disconnects_total", "Renders cancelled because the client went away", {},
+         request_stats["client_disconnects"]),
+        ("pdf_browser_crashes_total", "Pooled browsers that disconnected unexpectedly", {}, pool["crashes"]),
+        ("pdf_ready_timeouts_total", "Pages printed after the readiness wait timed out", {}, pool["ready_timeouts"]),
+        ("pdf_browser_kills_total", "Pooled browsers killed after a render timeout or missed heartbeat", {},
+         pool["kills"]),
+        ("pdf_browser_heartbeat_failures_total", "Browser heartbeats that timed out or failed", {},
+         pool["heartbeat_failures"]),
+        ("pdf_browser_memory_recycles_total", "Browsers recycled for exceeding PDF_BROWSER_MAX_RSS_MB", {},
+         pool["memory_recycles"]),
+        ("pdf_render_retries_total", "Renders retried after a browser or renderer process failed", {},
+         pool["retries"] + (renderer_client.stats["retries"] if renderer_client is not None else 0)),
+        ("pdf_renders_total", "Browser renders by result", {"result": "ok"}, pool["renders"]),
+        ("pdf_renders_total", "Browser renders by result", {"result": "error"}, pool["failures"]),
+        ("pdf_cache_hits_total", "PDF cache hits by tier", {"tier": "memory"}, cache["memory_hits"]),
+        ("pdf_cache_hits_total", "PDF cache hits by tier", {"tier": "disk"}, cache["disk_hits"]),
+        ("pdf_cache_misses_total", "PDF cache misses", {}, cache["misses"]),
+        ("pdf_cache_not_modified_total", "Requests answered with 304 Not Modified", {}, cache["not_modified"]),
+        ("pdf_jobs_total", "Finished asynchronous jobs by status", {"status": "done"}, job_queue.stats["done"]),
+        ("pdf_jobs_total", "Finished asynchronous jobs by status", {"status": "failed"}, job_queue.stats["failed"]),
+        ("pdf_jobs_rejected_total", "Jobs rejected with 429 because the queue was full", {},
+         job_queue.stats["rejected"]),
+        ("pdf_optimized_total", "PDFs run through the optimizer", {}, optimized["optimized"]),
+        ("pdf_optimize_bytes_total", "Size of optimized PDFs before and after optimization", {"size": "original"},
+         optimized["bytes_before"]),
+        ("pdf_optimize_bytes_total", "Size of optimized PDFs before and after optimization", {"size": "optimized"},
+         optimized["bytes_after"]),
+        ("pdf_report_sections_total", "Sections of reports assembled by section, by how they were obtained",
+         {"result": "reused"}, sections.stats["sections_reused"]),
+        ("pdf_report_sections_total", "Sections of reports assembled by section, by how they were obtained",
+         {"result": "rendered"}, sections.stats["sections_rendered"]),
+    ]
+    for name, engine in engines.items():
+        counters += [
+            ("pdf_engine_renders_total", "Renders by engine and result", {"engine": name, "result": "ok"},
+             engine.stats["renders"]),
+            ("pdf_engine_renders_total", "Renders by engine and result", {"engine": name, "result": "error"},
+             engine.stats["failures"]),
+            ("pdf_engine_fallbacks_total", "Renders routed to an engine that handed them to the browser",
+             {"engine": name}, engine.stats["fallbacks"]),
+        ]
+    for name, help, labels, value in counters:
+        yield name, "counter", help, labels, value
+
+def worker_snapshot():
+    """Stats of this API worker, as published to the shared stats store."""
+    return {
+        "metrics": metrics.snapshot(),
+        "pool": browser_pool.snapshot(),
+        "jobs": job_queue.stats,
+        "scheduler": render_scheduler.snapshot(),
+        "cache": pdf_cache.snapshot(),
+        "static_pages": static_pages.snapshot(),
+        "large_reports": large_reports.snapshot(),
+        "sections": sections.snapshot(),
+        "optimizer": optimizer.snapshot(),
+        "engines": {name: engine.snapshot() for name, engine in engines.items()},
+        "templates": generator.snapshot(),
+        "prewarm": warmup.snapshot(),
+    }
+
+@app.get("/healthz")
+def healthz():
+    """Liveness: the process is up and its event loop responds."""
+    return {"status": "ok", "uptime_seconds": round(time.time() - started_at, 1)}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: prewarmed, browsers running and the render queue short enough for steady-state latency.
+
+    Returns 503 with the failing checks otherwise, so load balancers only
+    route to warm instances.
+    """
+    if not uses_browser():
+        browsers_running = True
+    elif renderer_client is not None:
+        browsers_running = await renderer_client.ping()
+    else:
+        browsers_running = browser_pool.snapshot()["browsers"] > 0
+    max_queue_depth = READY_MAX_QUEUE_DEPTH or render_scheduler.max_inflight
+    checks = {
+        "prewarmed": warmup.done,
+        "browsers": browsers_running,
+        "queue": render_scheduler.queue_depth < max_queue_depth,
+    }
+    ready = all(checks.values())
+    body = {
+        "status": "ready" if ready else "not_ready",
+        "checks": checks,
+        "queue_depth": render_scheduler.queue_depth,
+        "max_queue_depth": max_queue_depth,
+        "prewarm": warmup.snapshot(),
+    }
+    return JSONResponse(body, status_code=200 if ready else 503)
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus metrics of this worker, or of all workers sharing the stats store."""
+    await job_queue.refresh_stats()
+    snapshots = {}
+    if shared_stats is not None:
+        published = await asyncio.to_thread(shared_stats.collect)
+        snapshots = {source: stats["metrics"] for source, stats in published.items() if "metrics" in stats}
+    snapshots[f"api-{os.getpid()}"] = metrics.snapshot()
+    return PlainTextResponse(render_prometheus(snapshots), media_type="text/plain; version=0.0.4")
+
+@app.get("/scheduler/stats")
+def scheduler_stats():
+    """Render queue depth, in-flight renders and wait times, plus large-report chunk counters."""
+    return {**render_scheduler.snapshot(), "large_reports": large_reports.snapshot()}
+
+@app.get("/cache/stats")
+def cache_stats():
+    """Hit/miss counters and memory usage of the PDF cache, static page fragments and section cache, and optimizer savings."""
+    return {**pdf_cache.snapshot(), "static_pages": static_pages.snapshot(), "sections": sections.snapshot(),
+            "optimizer": optimizer.snapshot()}
+
+@app.get("/workers/stats")
+async def workers_stats():
+    """Stats of every API worker and renderer process sharing the stats store."""
+    if shared_stats is None:
+        return {f"api-{os.getpid()}": worker_snapshot()}
+    return await asyncio.to_thread(shared_stats.collect)
+
+@app.get("/templates/stats")
+def template_stats():
+    """Precompile and per-request render timings of the templates."""
+    return generator.snapshot()
+
+@app.get("/engines/stats")
+def engine_stats():
+    """Renders, failures and browser fallbacks of each render engine."""
+    return {name: engine.snapshot() for name, engine in engines.items()}
+
+@app.post("/admin/reload-templates")
+async def reload_templates():
+    """Recompile all templates after they were changed on disk."""
+    timings = await asyncio.to_thread(generator.reload)
+    return {"reloaded": timings, "precompile_ms": generator.stats["precompile_ms"]}
+
+@app.get("/assets/report")
+def assets_report():
+    """Per-asset sizes and decode times of the preloaded template assets."""
+    return assets.report()
 
 @app.get("/")
 def root():
@@ -167,6 +762,18 @@ def root():
     <ul>
         <li><strong>POST /generate-pdf/</strong> - Upload a JSON file to generate a PDF</li>
         <li><strong>POST /generate-pdf-json/</strong> - Send JSON data in the request body to generate a PDF</li>
+        <li><strong>POST /generate-pdf-batch/</strong> - Send an array (or NDJSON) of payloads to get a streamed ZIP of PDFs</li>
+        <li><strong>POST /jobs</strong> - Queue a PDF and poll <code>GET /jobs/{id}</code> / <code>GET /jobs/{id}/pdf</code> for the result</li>
+        <li><strong>GET /healthz</strong> - Liveness probe</li>
+        <li><strong>GET /readyz</strong> - Readiness probe: prewarmed, browsers running and render queue below the threshold</li>
+        <li><strong>GET /metrics</strong> - Prometheus metrics: per-stage latency histograms, pool and queue gauges, counters</li>
+        <li><strong>GET /scheduler/stats</strong> - Render queue depth, in-flight renders and wait times</li>
+        <li><strong>GET /cache/stats</strong> - PDF cache hit/miss counters</li>
+        <li><strong>GET /workers/stats</strong> - Stats of all API workers and renderer processes</li>
+        <li><strong>GET /templates/stats</strong> - Template precompile and render timings</li>
+        <li><strong>GET /engines/stats</strong> - Renders and browser fallbacks of each render engine</li>
+        <li><strong>POST /admin/reload-templates</strong> - Recompile templates after editing them</li>
+        <li><strong>GET /assets/report</strong> - Size and decode time of the template assets</li>
     </ul>
     
     <h3>Usage:</h3>
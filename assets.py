@@ -0,0 +1,206 @@
+import base64
+import hashlib
+import io
+import mimetypes
+import os
+import pathlib
+import time
+import urllib.parse
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Origin used by templates when rendered in memory; requests to it never hit
+# the network and are answered from the preloaded asset registry instead.
+ASSET_ORIGIN = "https://report-assets.local"
+
+# How rendered pages reference assets: "route" (intercepted requests to
+# ASSET_ORIGIN) or "datauri" (inlined, cached base64 data URIs)
+ASSET_MODES = ("route", "datauri")
+ASSET_MODE = os.environ.get("PDF_ASSET_MODE", "route")
+# Images are downscaled to this resolution for their printed size on A4
+ASSET_DPI = int(os.environ.get("PDF_ASSET_DPI", "150"))
+ASSET_OPTIMIZE = os.environ.get("PDF_ASSET_OPTIMIZE", "true").lower() in ("1", "true", "yes")
+JPEG_QUALITY = 85
+
+A4_INCHES = (8.27, 11.69)
+
+# Transparent 1x1 GIF used in place of assets that aren't loaded, so reports still render
+MISSING_ASSET_URI = "data:image/gif;base64,R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7"
+
+# Logical asset name -> (path relative to the project root, printed size in inches).
+# Templates reference assets with {{ asset_url('name') }}.
+ASSET_REGISTRY = {
+    "cover": ("static_images/Cover Page.png", A4_INCHES),
+    "intro": ("static_images/2.png", A4_INCHES),
+    "closing": ("static_images/11.png", A4_INCHES),
+    "logo": ("logo.png", (2.0, 0.5)),
+    "flowchart": ("flowchart_asset.png", (8.27, 1.5)),
+    "iv_cover": ("static_images/IV_Cover_Page.jpg", A4_INCHES),
+    "iv_intro": ("static_images/2 IV.png", A4_INCHES),
+    "iv_closing": ("static_images/11_IV.jpg", A4_INCHES),
+    "iv_logo": ("static_images/IV_logo.png", (4.0, 0.6)),
+    "iv_logo_cover": ("static_images/IV_logo_cover.png", (4.0, 0.6)),
+}
+
+
+def file_asset_url(name, root='.'):
+    """URL of the original asset file, for HTML written to disk and opened directly."""
+    path, _ = ASSET_REGISTRY[name]
+    return pathlib.Path(os.path.abspath(os.path.join(root, path))).as_uri()
+
+
+def _decode_time(data):
+    """Seconds needed to fully decode image bytes, or None without Pillow."""
+    if Image is None:
+        return None
+    start = time.perf_counter()
+    with Image.open(io.BytesIO(data)) as image:
+        image.load()
+    return time.perf_counter() - start
+
+
+def optimize_image(data, size_inches, dpi=ASSET_DPI):
+    """Downscale an image to ``dpi`` for its printed size and recompress it.
+
+    Fully opaque images are re-encoded as JPEG, others as optimized PNG.
+    Returns ``(content_type, data)``, or None if the original is already
+    smaller.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        image.load()
+        max_size = (round(size_inches[0] * dpi), round(size_inches[1] * dpi))
+        if image.width > max_size[0] or image.height > max_size[1]:
+            image.thumbnail(max_size, Image.LANCZOS)
+        if image.mode in ("RGBA", "LA") and image.getchannel("A").getextrema() == (255, 255):
+            image = image.convert("RGB")
+        output = io.BytesIO()
+        if image.mode in ("RGB", "L"):
+            image.save(output, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+            content_type = "image/jpeg"
+        else:
+            image.save(output, format="PNG", optimize=True)
+            content_type = "image/png"
+    optimized = output.getvalue()
+    if len(optimized) >= len(data):
+        return None
+    return content_type, optimized
+
+
+class Asset:
+    """A template asset held in memory, ready to be served to the browser."""
+
+    def __init__(self, name, path, content_type, original_size, data):
+        self.name = name
+        self.path = path
+        self.content_type = content_type
+        self.original_size = original_size
+        self.data = data
+        self.original_decode_time = None
+        self.decode_time = None
+        self._data_uri = None
+
+    @property
+    def data_uri(self):
+        """Base64 data URI of the served bytes, built once on first use."""
+        if self._data_uri is None:
+            encoded = base64.b64encode(self.data).decode("ascii")
+            self._data_uri = f"data:{self.content_type};base64,{encoded}"
+        return self._data_uri
+
+
+class AssetRegistry:
+    """Registry of template assets, loaded once and resolved by logical name."""
+
+    def __init__(self, root='.', mode=ASSET_MODE, dpi=ASSET_DPI, optimize=ASSET_OPTIMIZE):
+        """Initialize the registry for assets below the given root directory."""
+        if mode not in ASSET_MODES:
+            raise ValueError(f"Invalid asset mode '{mode}'. Must be one of: {', '.join(ASSET_MODES)}")
+        self.root = root
+        self.mode = mode
+        self.dpi = dpi
+        self.optimize = optimize
+        self.assets = {}
+        self.digest = ""
+        self._missing = set()
+
+    def _load_asset(self, name, path, size_inches):
+        with open(os.path.join(self.root, path), 'rb') as f:
+            original = f.read()
+        content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        asset = Asset(name, path, content_type, len(original), original)
+        if Image is not None:
+            asset.original_decode_time = _decode_time(original)
+            if self.optimize:
+                optimized = optimize_image(original, size_inches, self.dpi)
+                if optimized is not None:
+                    asset.content_type, asset.data = optimized
+            asset.decode_time = _decode_time(asset.data)
+        return asset
+
+    def load(self):
+        """Read, downscale and recompress every registered asset into memory."""
+        if Image is None and self.optimize:
+            print("Pillow is not installed. Assets are served at their original resolution; run 'pip install Pillow' to optimize them.")
+        self.assets = {}
+        for name, (path, size_inches) in ASSET_REGISTRY.items():
+            if not os.path.isfile(os.path.join(self.root, path)):
+                print(f"Warning: asset '{name}' not found at {path}")
+                continue
+            self.assets[name] = self._load_asset(name, path, size_inches)
+        digest = hashlib.sha256(f"{self.dpi}:{self.optimize}".encode("utf-8"))
+        for name in sorted(self.assets):
+            digest.update(name.encode("utf-8"))
+            digest.update(hashlib.sha256(self.assets[name].data).digest())
+        self.digest = digest.hexdigest()
+        original = sum(asset.original_size for asset in self.assets.values())
+        served = sum(len(asset.data) for asset in self.assets.values())
+        print(f"Loaded {len(self.assets)} assets ({original / 1024 / 1024:.1f} MB -> {served / 1024 / 1024:.1f} MB)")
+        return self
+
+    def get(self, name):
+        """Return the Asset registered under a logical name, or None."""
+        return self.assets.get(name)
+
+    def url(self, name):
+        """Resolve a logical asset name to the URL used in rendered HTML.
+
+        Assets that aren't loaded (unknown, or missing on disk) resolve to
+        MISSING_ASSET_URI, with a warning the first time.
+        """
+        asset = self.assets.get(name)
+        if asset is None:
+            if name not in self._missing:
+                self._missing.add(name)
+                print(f"Warning: asset '{name}' is not loaded; rendering a blank image instead")
+            return MISSING_ASSET_URI
+        if self.mode == "datauri":
+            return asset.data_uri
+        return f"{ASSET_ORIGIN}/{urllib.parse.quote(name)}"
+
+    def report(self):
+        """Per-asset sizes and decode times."""
+        rows = []
+        for asset in self.assets.values():
+            rows.append({
+                "name": asset.name,
+                "path": asset.path,
+                "content_type": asset.content_type,
+                "original_bytes": asset.original_size,
+                "served_bytes": len(asset.data),
+                "original_decode_ms": None if asset.original_decode_time is None else round(asset.original_decode_time * 1000, 2),
+                "decode_ms": None if asset.decode_time is None else round(asset.decode_time * 1000, 2),
+            })
+        return {"mode": self.mode, "dpi": self.dpi, "optimized": self.optimize and Image is not None, "assets": rows}
+
+    async def handle_route(self, route):
+        """Playwright route handler serving ASSET_ORIGIN requests from memory."""
+        name = urllib.parse.unquote(urllib.parse.urlsplit(route.request.url).path).lstrip("/")
+        asset = self.get(name)
+        if asset is None:
+            print(f"Warning: asset not found: {name}")
+            await route.fulfill(status=404, body="")
+            return
+        await route.fulfill(status=200, content_type=asset.content_type, body=asset.data)
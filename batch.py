@@ -0,0 +1,160 @@
+import asyncio
+import json
+import os
+import re
+import time
+import uuid
+import zipfile
+
+from payload import PayloadError, decode_json
+
+# Default and maximum number of reports rendered concurrently per batch
+BATCH_CONCURRENCY = int(os.environ.get("PDF_BATCH_CONCURRENCY", "4"))
+BATCH_MAX_CONCURRENCY = int(os.environ.get("PDF_BATCH_MAX_CONCURRENCY", "16"))
+BATCH_MAX_ITEMS = int(os.environ.get("PDF_BATCH_MAX_ITEMS", "500"))
+
+
+def parse_batch_items(raw, content_type=""):
+    """Parse a batch body into a list of item dicts.
+
+    Accepts a JSON array, a JSON object with an ``items`` array, or NDJSON
+    (one JSON object per line). Raises ValueError for malformed input.
+    """
+    if "ndjson" in (content_type or "") or "jsonlines" in (content_type or ""):
+        items = []
+        for line_no, line in enumerate(raw.decode("utf-8").splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                items.append(decode_json(line))
+            except PayloadError as e:
+                raise ValueError(f"Invalid JSON on line {line_no}: {e}")
+    else:
+        body = decode_json(raw)
+        items = body.get("items") if isinstance(body, dict) else body
+    if not isinstance(items, list) or not items:
+        raise ValueError("Batch must be a non-empty array of report payloads")
+    if len(items) > BATCH_MAX_ITEMS:
+        raise ValueError(f"Batch too large: {len(items)} items (maximum {BATCH_MAX_ITEMS})")
+    return items
+
+
+def item_filename(index, template, data):
+    """File name for a batch item, e.g. ``0001_invest4edu_john_doe.pdf``."""
+    client = re.sub(r"[^a-z0-9]+", "_", str(data.get("clientname", "")).lower()).strip("_")
+    return f"{index + 1:04d}_{template}" + (f"_{client}" if client else "") + ".pdf"
+
+
+async def run_batch(items, render_item, concurrency=BATCH_CONCURRENCY):
+    """Render items concurrently and yield results in completion order.
+
+    ``render_item(index, item)`` must return ``(filename, pdf_bytes)``. Each
+    result is a dict with ``index``, ``filename``, ``pdf``, ``error`` and
+    ``seconds``; a failing item never stops the rest of the batch.
+    """
+    semaphore = asyncio.Semaphore(max(1, min(concurrency, BATCH_MAX_CONCURRENCY)))
+
+    async def run_one(index, item):
+        async with semaphore:
+            start = time.perf_counter()
+            result = {"index": index, "filename": None, "pdf": None, "error": None}
+            try:
+                result["filename"], result["pdf"] = await render_item(index, item)
+                if not result["pdf"]:
+                    result["error"] = "PDF generation failed."
+            except Exception as e:
+                result["error"] = str(e)
+                # Payload validation errors carry the failing fields
+                result["fields"] = getattr(e, "errors", None)
+            result["seconds"] = round(time.perf_counter() - start, 3)
+            return result
+
+    tasks = [asyncio.create_task(run_one(index, item)) for index, item in enumerate(items)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # The client may disconnect mid-stream; don't leave renders running
+        for task in tasks:
+            task.cancel()
+
+
+def _manifest_entry(result):
+    entry = {"index": result["index"], "seconds": result["seconds"]}
+    if result["error"]:
+        entry.update(status="error", error=result["error"])
+        if result.get("fields"):
+            entry["fields"] = result["fields"]
+    else:
+        entry.update(status="ok", filename=result["filename"], bytes=len(result["pdf"]))
+    return entry
+
+
+class _ChunkBuffer:
+    """Write-only file object that hands written bytes back to a generator."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+async def stream_zip(results):
+    """Stream batch results as a ZIP archive, one entry per completed item.
+
+    Failed items are listed in ``manifest.json``, written as the last entry.
+    """
+    buffer = _ChunkBuffer()
+    manifest = []
+    try:
+        # PDFs are already compressed; storing avoids burning CPU on deflate
+        with zipfile.ZipFile(buffer, mode="w", compression=zipfile.ZIP_STORED) as archive:
+            async for result in results:
+                manifest.append(_manifest_entry(result))
+                if not result["error"]:
+                    archive.writestr(result["filename"], result["pdf"])
+                    yield buffer.drain()
+            manifest.sort(key=lambda entry: entry["index"])
+            archive.writestr("manifest.json", json.dumps({"items": manifest}, indent=2))
+        yield buffer.drain()
+    finally:
+        await results.aclose()
+
+
+def multipart_boundary():
+    return f"batch-{uuid.uuid4().hex}"
+
+
+async def stream_multipart(results, boundary):
+    """Stream batch results as multipart/mixed, one part per item.
+
+    Successful items are ``application/pdf`` parts; failed items are
+    ``application/json`` parts describing the error.
+    """
+    try:
+        async for result in results:
+            entry = _manifest_entry(result)
+            if result["error"]:
+                headers = f"Content-Type: application/json\r\nX-Batch-Index: {result['index']}\r\n"
+                body = json.dumps(entry).encode("utf-8")
+            else:
+                headers = (
+                    "Content-Type: application/pdf\r\n"
+                    f'Content-Disposition: attachment; filename="{result["filename"]}"\r\n'
+                    f"X-Batch-Index: {result['index']}\r\n"
+                )
+                body = result["pdf"]
+            yield f"--{boundary}\r\n{headers}Content-Length: {len(body)}\r\n\r\n".encode("utf-8") + body + b"\r\n"
+        yield f"--{boundary}--\r\n".encode("utf-8")
+    finally:
+        await results.aclose()
@@ -0,0 +1,345 @@
+import argparse
+import asyncio
+import copy
+import json
+import os
+import platform
+import sys
+import time
+import urllib.request
+
+from assets import AssetRegistry
+from browser_pdf_generator import BrowserPDFGenerator, TEMPLATE_MAP
+from browser_pool import BrowserPool, READY_MODE, READY_MODES
+from large_report import LargeReportRenderer
+from optimize import PDFOptimizer, OPTIMIZE_MODES
+
+# Table rows multiplied by the --sizes factors to build synthetic payloads
+SCALED_ROWS = [
+    ("investment_products", "mutual_fund", "top_funds"),
+    ("pms", "funds"),
+    ("fixed_income_offering", "debt_papers"),
+]
+
+STAGES = ["parse", "validate", "queue_wait", "render_html", "template_render", "asset_resolve", "browser_acquire",
+          "set_content", "ready_wait", "page_pdf", "chunk_render", "merge", "optimize", "time_to_headers", "response_read"]
+
+
+def scale_payload(data, factor):
+    """Return a copy of the payload with every scaled table ``factor`` times longer."""
+    scaled = copy.deepcopy(data)
+    for path in SCALED_ROWS:
+        parent = scaled
+        for key in path[:-1]:
+            parent = parent.get(key) or {}
+        rows = parent.get(path[-1])
+        if rows:
+            parent[path[-1]] = [copy.deepcopy(rows[i % len(rows)]) for i in range(len(rows) * factor)]
+    return scaled
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))]
+
+
+def summarize(values):
+    """Latency summary in milliseconds."""
+    return {
+        "count": len(values),
+        "mean_ms": round(sum(values) / len(values) * 1000, 1) if values else 0.0,
+        "p50_ms": round(percentile(values, 50) * 1000, 1),
+        "p95_ms": round(percentile(values, 95) * 1000, 1),
+        "p99_ms": round(percentile(values, 99) * 1000, 1),
+        "max_ms": round(max(values) * 1000, 1) if values else 0.0,
+    }
+
+
+def _read_proc_tree():
+    """Map pid -> (ppid, rss_bytes, name) for all processes visible in /proc."""
+    processes = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+            # The command name is in parentheses and may contain spaces
+            name = stat[stat.index("(") + 1:stat.rindex(")")]
+            fields = stat[stat.rindex(")") + 2:].split()
+            rss_pages = int(fields[21])
+            processes[int(entry)] = (int(fields[1]), rss_pages * os.sysconf("SC_PAGE_SIZE"), name)
+        except (OSError, ValueError, IndexError):
+            continue
+    return processes
+
+
+def process_rss(pid):
+    """Return ``(process_rss, chromium_rss)`` in bytes for a process and its Chromium descendants."""
+    if not os.path.isdir("/proc"):
+        return None, None
+    processes = _read_proc_tree()
+    children = {}
+    for child, (ppid, _, _) in processes.items():
+        children.setdefault(ppid, []).append(child)
+    chromium = 0
+    stack = list(children.get(pid, []))
+    while stack:
+        child = stack.pop()
+        _, rss, name = processes[child]
+        if "chrom" in name.lower() or "headless" in name.lower():
+            chromium += rss
+        stack.extend(children.get(child, []))
+    own = processes.get(pid, (None, 0, None))[1]
+    return own, chromium
+
+
+class RSSSampler:
+    """Sample peak RSS of a process and its Chromium children in the background."""
+
+    def __init__(self, pid, interval=0.1):
+        self.pid = pid
+        self.interval = interval
+        self.peak_process = 0
+        self.peak_chromium = 0
+        self._task = None
+
+    async def _run(self):
+        while True:
+            own, chromium = await asyncio.to_thread(process_rss, self.pid)
+            if own is None:
+                return
+            self.peak_process = max(self.peak_process, own)
+            self.peak_chromium = max(self.peak_chromium, chromium)
+            await asyncio.sleep(self.interval)
+
+    def __enter__(self):
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    def __exit__(self, *exc):
+        self._task.cancel()
+
+    def result(self):
+        return {
+            "peak_process_rss_mb": round(self.peak_process / 1024 / 1024, 1),
+            "peak_chromium_rss_mb": round(self.peak_chromium / 1024 / 1024, 1),
+        }
+
+
+async def run_requests(count, concurrency, run_one):
+    """Run ``run_one(i)`` ``count`` times with bounded concurrency.
+
+    Returns ``(latencies, stage_timings, errors, wall_seconds)``.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, stages, errors = [], {}, []
+
+    async def timed(i):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                timings = await run_one(i)
+                latencies.append(time.perf_counter() - start)
+                for stage, seconds in timings.items():
+                    stages.setdefault(stage, []).append(seconds)
+            except Exception as e:
+                errors.append(str(e))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(timed(i) for i in range(count)))
+    return latencies, stages, errors, time.perf_counter() - start
+
+
+def make_inprocess_runner(pool, generator, template, payload_bytes, ready_mode, large_reports=None, optimize="none"):
+    optimizer = PDFOptimizer()
+
+    async def run_one(i):
+        timings = {}
+        start = time.perf_counter()
+        data = json.loads(payload_bytes)
+        timings["parse"] = time.perf_counter() - start
+        if large_reports is not None and large_reports.applies(data):
+            pdf_bytes = await large_reports.render(TEMPLATE_MAP[template], data, ready_mode, timings)
+        else:
+            start = time.perf_counter()
+            html_content = generator.render_html(TEMPLATE_MAP[template], data)
+            timings["render_html"] = time.perf_counter() - start
+            if html_content is None:
+                raise RuntimeError("HTML rendering failed")
+            pdf_bytes = await pool.render_pdf(html_content, ready_mode=ready_mode, timings=timings)
+        if not pdf_bytes:
+            raise RuntimeError("PDF generation failed")
+        await optimizer.optimize(pdf_bytes, optimize, timings)
+        return timings
+    return run_one
+
+
+def parse_server_timing(value):
+    """Stage durations in seconds from a ``Server-Timing`` header."""
+    timings = {}
+    for entry in value.split(","):
+        name, _, params = entry.strip().partition(";")
+        for param in params.split(";"):
+            key, _, duration = param.strip().partition("=")
+            if name and key == "dur":
+                try:
+                    timings[name] = float(duration) / 1000
+                except ValueError:
+                    pass
+    return timings
+
+
+def make_http_runner(url, template, payload, ready_mode, vary, optimize="none"):
+    endpoint = url.rstrip("/") + "/generate-pdf-json/"
+
+    def post(i):
+        body = dict(payload, template=template, ready_mode=ready_mode, optimize=optimize)
+        if vary:
+            # A unique client name per request defeats the PDF cache
+            body["clientname"] = f"{payload.get('clientname', 'Client')} #{i}"
+        request = urllib.request.Request(endpoint, data=json.dumps(body).encode("utf-8"),
+                                         headers={"Content-Type": "application/json"}, method="POST")
+        start = time.perf_counter()
+        with urllib.request.urlopen(request, timeout=120) as response:
+            headers_received = time.perf_counter()
+            response.read()
+            timings = parse_server_timing(response.headers.get("Server-Timing", ""))
+        timings.update(response_read=time.perf_counter() - headers_received,
+                       time_to_headers=headers_received - start)
+        return timings
+
+    async def run_one(i):
+        return await asyncio.to_thread(post, i)
+    return run_one
+
+
+async def benchmark(args):
+    with open(args.data, 'r', encoding='utf-8') as f:
+        base_payload = json.load(f)
+    for key in ("template", "blur_funds"):
+        base_payload.pop(key, None)
+
+    pool = generator = large_reports = None
+    if not args.url:
+        assets = AssetRegistry().load()
+        generator = BrowserPDFGenerator(assets=assets)
+        generator.precompile()
+        pool = BrowserPool(size=args.browsers, assets=assets)
+        start = time.perf_counter()
+        await pool.start()
+        if not pool.started:
+            sys.exit(1)
+        print(f"Browser pool started in {time.perf_counter() - start:.2f}s")
+        if args.large:
+            large_reports = LargeReportRenderer(generator, pool)
+
+    runs = []
+    try:
+        for template in args.templates:
+            for size in args.sizes:
+                payload = scale_payload(base_payload, size)
+                payload_bytes = json.dumps(payload).encode("utf-8")
+                for concurrency in args.concurrency:
+                    if args.url:
+                        run_one = make_http_runner(args.url, template, payload, args.ready_mode, not args.allow_cache,
+                                                   args.optimize)
+                        pid = args.server_pid
+                    else:
+                        run_one = make_inprocess_runner(pool, generator, template, payload_bytes, args.ready_mode,
+                                                        large_reports, args.optimize)
+                        pid = os.getpid()
+                    # Warm up so first-use costs don't skew the percentiles
+                    await run_requests(min(args.warmup, args.requests), concurrency, run_one)
+                    sampler = RSSSampler(pid) if pid else None
+                    if sampler:
+                        with sampler:
+                            latencies, stages, errors, wall = await run_requests(args.requests, concurrency, run_one)
+                    else:
+                        latencies, stages, errors, wall = await run_requests(args.requests, concurrency, run_one)
+                    run = {
+                        "template": template,
+                        "size_factor": size,
+                        "payload_bytes": len(payload_bytes),
+                        "concurrency": concurrency,
+                        "requests": args.requests,
+                        "errors": len(errors),
+                        "pdfs_per_sec": round(len(latencies) / wall, 2) if wall else 0.0,
+                        "latency": summarize(latencies),
+                        "stages": {stage: summarize(values) for stage, values in stages.items()},
+                        **(sampler.result() if sampler else {}),
+                    }
+                    runs.append(run)
+                    print_run(run)
+    finally:
+        if pool is not None:
+            await pool.stop()
+    return runs
+
+
+def print_run(run):
+    latency = run["latency"]
+    line = (f"{run['template']:<12} x{run['size_factor']:<4} c={run['concurrency']:<3} "
+            f"p50={latency['p50_ms']:>8.1f}ms p95={latency['p95_ms']:>8.1f}ms p99={latency['p99_ms']:>8.1f}ms "
+            f"{run['pdfs_per_sec']:>6.2f} PDF/s errors={run['errors']}")
+    if "peak_process_rss_mb" in run:
+        line += f" rss={run['peak_process_rss_mb']}MB chromium={run['peak_chromium_rss_mb']}MB"
+    print(line)
+    stages = ", ".join(f"{stage}={run['stages'][stage]['p50_ms']}ms" for stage in STAGES if stage in run["stages"])
+    if stages:
+        print(f"    p50 stages: {stages}")
+
+
+def _int_list(value):
+    return [int(item) for item in value.split(",") if item]
+
+
+def main():
+    """Command line interface for the PDF pipeline benchmark."""
+    parser = argparse.ArgumentParser(description='Measure latency and throughput of the PDF pipeline.')
+    parser.add_argument('--data', '-d', default='sample_data.json', help='Path to the base JSON payload')
+    parser.add_argument('--templates', '-t', default='invest4edu,investvalue',
+                        help='Comma-separated templates to benchmark')
+    parser.add_argument('--sizes', default='1,10,50',
+                        help='Comma-separated row multipliers for top_funds, pms.funds and debt_papers')
+    parser.add_argument('--concurrency', '-c', default='1,4', help='Comma-separated concurrency levels')
+    parser.add_argument('--requests', '-n', type=int, default=20, help='Requests per run')
+    parser.add_argument('--warmup', type=int, default=2, help='Warm-up requests per run (not measured)')
+    parser.add_argument('--browsers', type=int, default=2, help='Browsers in the in-process pool')
+    parser.add_argument('--ready-mode', default=READY_MODE, choices=READY_MODES, help='Page readiness mode')
+    parser.add_argument('--large', action='store_true',
+                        help='Render payloads above PDF_LARGE_REPORT_ROWS in page-sized chunks (in-process mode)')
+    parser.add_argument('--optimize', default='none', choices=OPTIMIZE_MODES,
+                        help='Run the PDF optimization stage on every render')
+    parser.add_argument('--url', help='Benchmark a running server (e.g. http://localhost:8000) instead of in-process')
+    parser.add_argument('--server-pid', type=int, help='PID of the server, to sample its RSS in --url mode')
+    parser.add_argument('--allow-cache', action='store_true',
+                        help='Send identical payloads in --url mode so the PDF cache can serve them')
+    parser.add_argument('--output', '-o', default='bench_results.json', help='Where to write JSON results')
+
+    args = parser.parse_args()
+    args.templates = [t for t in args.templates.split(",") if t]
+    args.sizes = _int_list(args.sizes)
+    args.concurrency = _int_list(args.concurrency)
+    for template in args.templates:
+        if template not in TEMPLATE_MAP:
+            parser.error(f"Invalid template '{template}'. Must be one of: {', '.join(TEMPLATE_MAP)}")
+
+    runs = asyncio.run(benchmark(args))
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "mode": "http" if args.url else "in-process",
+        "host": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "runs": runs,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
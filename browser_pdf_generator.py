@@ -1,34 +1,202 @@
+import asyncio
+import hashlib
 import json
 import os
 import sys
+import time
 import argparse
 import webbrowser
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
+from assets import file_asset_url
+from browser_pool import ASSETS_READY_JS
+from render_options import DEFAULT_RENDER_OPTIONS
+
+# Compiled template bytecode is persisted here and shared by all worker processes
+TEMPLATE_CACHE_DIR = os.environ.get("PDF_TEMPLATE_CACHE_DIR", ".jinja_cache")
+# Poll template files for changes every N seconds (0 disables the watcher);
+# templates are otherwise only reloaded through POST /admin/reload-templates
+TEMPLATE_WATCH_INTERVAL = float(os.environ.get("PDF_TEMPLATE_WATCH_INTERVAL", "0"))
+
+# Template files for each supported template
+TEMPLATE_MAP = {
+    "invest4edu": "invest4edu_report.html",
+    "investvalue": "investvalue_report.html"
+}
 
 class BrowserPDFGenerator:
     """Generate HTML reports that can be printed to PDF using the browser."""
     
-    def __init__(self, template_dir='templates'):
-        """Initialize the generator with template directory."""
+    def __init__(self, template_dir='templates', assets=None, cache_dir=TEMPLATE_CACHE_DIR):
+        """Initialize the generator with template directory and optional AssetRegistry.
+
+        Compiled templates are kept in memory without per-render freshness
+        checks; call reload() (or run watch()) to pick up template changes.
+        """
         self.template_dir = template_dir
-        self.env = Environment(loader=FileSystemLoader(template_dir))
+        self.assets = assets
+        self.cache_dir = cache_dir
+        self._digests = {}
+        self._mtimes = {}
+        self.env = self._create_environment()
+        self.stats = {
+            "precompiled": 0,
+            "precompile_ms": 0.0,
+            "reloads": 0,
+            "last_reload": None,
+            "renders": 0,
+            "render_ms_total": 0.0,
+            "render_ms_max": 0.0,
+            "templates": {},
+        }
+
+    def _create_environment(self):
+        bytecode_cache = None
+        if self.cache_dir:
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                bytecode_cache = FileSystemBytecodeCache(self.cache_dir)
+            except OSError as e:
+                print(f"Warning: template bytecode cache disabled: {e}")
+        return Environment(loader=FileSystemLoader(self.template_dir), bytecode_cache=bytecode_cache,
+                           auto_reload=False)
+
+    def _template_mtimes(self):
+        mtimes = {}
+        for name in self.env.list_templates(extensions=["html"]):
+            try:
+                mtimes[name] = os.stat(os.path.join(self.template_dir, name)).st_mtime_ns
+            except OSError:
+                continue
+        return mtimes
+
+    def precompile(self):
+        """Compile every template up front so no request pays for compilation.
+
+        Returns the per-template load time in milliseconds.
+        """
+        timings = {}
+        start = time.perf_counter()
+        self._mtimes = self._template_mtimes()
+        for name in self._mtimes:
+            template_start = time.perf_counter()
+            try:
+                self.env.get_template(name)
+            except Exception as e:
+                print(f"Error compiling template {name}: {str(e)}")
+                continue
+            self.template_digest(name)
+            timings[name] = round((time.perf_counter() - template_start) * 1000, 2)
+        self.stats["precompiled"] = len(timings)
+        self.stats["precompile_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        self.stats["templates"] = timings
+        print(f"Precompiled {len(timings)} templates in {self.stats['precompile_ms']:.0f} ms")
+        return timings
+
+    def reload(self):
+        """Drop compiled templates and digests, then compile everything again."""
+        self.env = self._create_environment()
+        self._digests = {}
+        timings = self.precompile()
+        self.stats["reloads"] += 1
+        self.stats["last_reload"] = time.time()
+        return timings
+
+    async def watch(self, interval=TEMPLATE_WATCH_INTERVAL):
+        """Reload templates whenever a template file changes, polling every ``interval`` seconds."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                mtimes = await asyncio.to_thread(self._template_mtimes)
+                if mtimes != self._mtimes:
+                    print("Template change detected, reloading templates")
+                    await asyncio.to_thread(self.reload)
+            except Exception as e:
+                print(f"Error watching templates: {str(e)}")
+
+    def snapshot(self):
+        """Compile and render timings of the templates."""
+        renders = self.stats["renders"]
+        return {
+            **self.stats,
+            "render_ms_total": round(self.stats["render_ms_total"], 2),
+            "render_ms_mean": round(self.stats["render_ms_total"] / renders, 2) if renders else 0.0,
+            "bytecode_cache": self.cache_dir or None,
+        }
+
+    def template_digest(self, template_name):
+        """Return a SHA-256 digest of the template source, computed once per template."""
+        if template_name not in self._digests:
+            with open(os.path.join(self.template_dir, template_name), 'rb') as f:
+                self._digests[template_name] = hashlib.sha256(f.read()).hexdigest()
+        return self._digests[template_name]
         
+    def _context(self, data, asset_url, static_page):
+        if asset_url is None:
+            asset_url = self.assets.url if self.assets is not None else file_asset_url
+        context = {**data, 'asset_url': asset_url}
+        if static_page is not None:
+            context['static_page'] = static_page
+        return context
+
+    def stream_html(self, template_name, data, asset_url=None, static_page=None):
+        """Render a template incrementally, yielding the HTML in chunks."""
+        # Get the template and render it with the original data (nested structure)
+        template = self.env.get_template(template_name)
+        return template.generate(self._context(data, asset_url, static_page))
+
+    def render_html(self, template_name, data, asset_url=None, static_page=None, timings=None):
+        """Render a template with data and return the HTML as a string.
+
+        ``asset_url`` resolves logical asset names used by the template; it
+        defaults to the asset registry, or to the files on disk without one.
+        If ``static_page`` is given, full-bleed static pages are rendered as
+        placeholders linking to ``static_page(name)`` (see segments.py). The
+        render time is stored under ``"template_render"`` in ``timings``, and
+        the part of it spent resolving assets under ``"asset_resolve"``.
+        """
+        resolve_seconds = 0.0
+        if timings is not None:
+            resolve = asset_url
+            if resolve is None:
+                resolve = self.assets.url if self.assets is not None else file_asset_url
+
+            def asset_url(name):
+                nonlocal resolve_seconds
+                resolve_start = time.perf_counter()
+                try:
+                    return resolve(name)
+                finally:
+                    resolve_seconds += time.perf_counter() - resolve_start
+
+        start = time.perf_counter()
+        try:
+            # set_content needs the whole document, so the chunks are joined here
+            html_content = "".join(self.stream_html(template_name, data, asset_url, static_page))
+        except Exception as e:
+            print(f"Error generating HTML: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            return None
+        elapsed = time.perf_counter() - start
+        if timings is not None:
+            timings["template_render"] = elapsed
+            timings["asset_resolve"] = resolve_seconds
+        self.stats["renders"] += 1
+        self.stats["render_ms_total"] += elapsed * 1000
+        self.stats["render_ms_max"] = round(max(self.stats["render_ms_max"], elapsed * 1000), 2)
+        return html_content
+
     def generate_html(self, template_name, data, output_path):
         """Generate HTML from template and data."""
         try:
-            # Get the template
-            template = self.env.get_template(template_name)
-            # Render the template with the original data (nested structure)
-            html_content = template.render(**data)
-            # Write the HTML to a file
+            # Assets are referenced from disk since the file is opened directly;
+            # the HTML is streamed to the file without building one big string
             with open(output_path, 'w', encoding='utf-8') as f:
-                f.write(html_content)
-            return output_path
+                f.writelines(self.stream_html(template_name, data, file_asset_url))
         except Exception as e:
             print(f"Error generating HTML: {str(e)}")
-            import traceback
-            traceback.print_exc()
             return None
+        return output_path
     
     def _prepare_template_data(self, data):
         """Prepare data for the template in a simplified format."""
@@ -135,7 +303,7 @@ def load_json_data(file_path):
         return None
 
 
-def generate_pdf_with_playwright(html_path, pdf_path):
+def generate_pdf_with_playwright(html_path, pdf_path, options=DEFAULT_RENDER_OPTIONS):
     """Generate a PDF from the HTML file using Playwright (sync version for Windows)."""
     try:
         # Define absolute paths first
@@ -150,7 +318,6 @@ def generate_pdf_with_playwright(html_path, pdf_path):
         script_content = f"""
 import os
 from playwright.sync_api import sync_playwright
-import time
 
 abs_html_path = r"{os.path.abspath(html_path)}"
 abs_pdf_path = r"{os.path.abspath(pdf_path)}"
@@ -158,17 +325,11 @@ file_url = f"file:///{abs_html_path.replace(os.sep, '/')}"
 
 with sync_playwright() as p:
     browser = p.chromium.launch()
-    page = browser.new_page()
-    page.goto(file_url)
-    # Wait for page to render
-    time.sleep(1)
-    page.pdf(
-        path=abs_pdf_path,
-        format="A4",
-        margin={{"top": "20mm", "bottom": "20mm", "left": "15mm", "right": "15mm"}},
-        print_background=True,
-        display_header_footer=False
-    )
+    page = browser.new_page(**{options.context_kwargs()!r})
+    page.goto(file_url, wait_until="load")
+    # Wait for fonts and images instead of a fixed delay
+    page.evaluate({ASSETS_READY_JS!r})
+    page.pdf(path=abs_pdf_path, **{options.pdf_kwargs()!r})
     browser.close()
 print(f"PDF generated at: {{abs_pdf_path}}")
 """
@@ -202,106 +363,6 @@ print(f"PDF generated at: {{abs_pdf_path}}")
         return False
 
 
-async def generate_pdf_with_playwright_async(html_path, pdf_path):
-    """Generate a PDF from the HTML file using Playwright (async version for FastAPI)."""
-    try:
-        # Define absolute paths first
-        abs_html_path = os.path.abspath(html_path)
-        abs_pdf_path = os.path.abspath(pdf_path)
-        
-        # Import necessary modules
-        import subprocess
-        import sys
-        import asyncio
-        import tempfile
-        from concurrent.futures import ThreadPoolExecutor
-        import uuid
-        
-        # Create a small Python script to generate PDF - use a unique name to avoid reload issues
-        script_content = f"""
-import os
-import sys
-try:
-    from playwright.sync_api import sync_playwright
-    import time
-
-    abs_html_path = r"{os.path.abspath(html_path)}"
-    abs_pdf_path = r"{os.path.abspath(pdf_path)}"
-    file_url = f"file:///{abs_html_path.replace(os.sep, '/')}"
-
-    with sync_playwright() as p:
-        browser = p.chromium.launch()
-        page = browser.new_page()
-        page.goto(file_url)
-        # Wait for page to render
-        time.sleep(1)
-        page.pdf(
-            path=abs_pdf_path,
-            format="A4",
-            margin={{"top": "20mm", "bottom": "20mm", "left": "15mm", "right": "15mm"}},
-            print_background=True,
-            display_header_footer=False
-        )
-        browser.close()
-    print(f"PDF generated at: {{abs_pdf_path}}")
-    sys.exit(0)
-except Exception as e:
-    print(f"Error in PDF generation script: {{str(e)}}")
-    sys.exit(1)
-"""
-        # Create a temporary directory that won't be watched by StatReload
-        temp_dir = os.path.join(os.path.dirname(os.path.dirname(html_path)), 'temp_scripts')
-        os.makedirs(temp_dir, exist_ok=True)
-        
-        # Use a unique filename for each generation to avoid conflicts
-        unique_id = uuid.uuid4().hex
-        script_path = os.path.join(temp_dir, f"pdf_generator_{unique_id}.py")
-        
-        with open(script_path, 'w') as script_file:
-            script_file.write(script_content)
-        
-        # Function to run subprocess in a thread
-        def run_subprocess():
-            try:
-                result = subprocess.run(
-                    [sys.executable, script_path],
-                    capture_output=True, 
-                    text=True, 
-                    check=False,
-                    timeout=30  # Add timeout to prevent hanging
-                )
-                
-                # Always clean up the temporary script
-                try:
-                    os.remove(script_path)
-                except Exception as e:
-                    print(f"Warning: Could not remove temp script: {e}")
-                
-                if result.returncode != 0:
-                    print(f"PDF generation error: {result.stderr}")
-                    return False
-                
-                print(result.stdout)
-                return os.path.exists(pdf_path)
-            except subprocess.TimeoutExpired:
-                print("PDF generation timed out after 30 seconds")
-                return False
-            except Exception as e:
-                print(f"Unexpected error in subprocess: {str(e)}")
-                return False
-        
-        # Run subprocess in a separate thread to avoid blocking the event loop
-        with ThreadPoolExecutor() as executor:
-            return await asyncio.get_event_loop().run_in_executor(executor, run_subprocess)
-    
-    except ImportError:
-        print("Playwright is not installed. Please run 'pip install playwright' and 'playwright install' to use PDF generation.")
-        return False
-    except Exception as e:
-        print(f"Error generating PDF: {str(e)}")
-        return False
-
-
 def main():
     """Command line interface for the browser-based PDF generator."""
     parser = argparse.ArgumentParser(description='Generate HTML reports that can be printed to PDF using the browser.')
@@ -311,6 +372,8 @@ def main():
     parser.add_argument('--output', '-o', default='output_report', help='Base name for output files (without extension)')
     parser.add_argument('--no-open', action='store_true', help='Do not open the generated HTML in browser')
     parser.add_argument('--no-pdf', action='store_true', help='Do not generate PDF using Playwright')
+    parser.add_argument('--engine', default='browser', choices=('browser', 'lite'),
+                        help="Print the PDF with Playwright ('browser') or lay it out with ReportLab ('lite')")
     
     args = parser.parse_args()
     
@@ -338,7 +401,17 @@ def main():
     if success and not args.no_pdf:
         html_file = f"{args.output}.html"
         pdf_file = f"{args.output}.pdf"
-        generate_pdf_with_playwright(html_file, pdf_file)
+        if args.engine == 'lite':
+            from engines import LiteEngine
+            data = load_json_data(args.data)
+            pdf_bytes = LiteEngine(generator).render_pdf(args.template, data)
+            if pdf_bytes:
+                with open(pdf_file, 'wb') as f:
+                    f.write(pdf_bytes)
+                print(f"PDF generated at: {os.path.abspath(pdf_file)}")
+            success = bool(pdf_bytes)
+        else:
+            generate_pdf_with_playwright(html_file, pdf_file)
     
     sys.exit(0 if success else 1)
 
@@ -0,0 +1,425 @@
+import asyncio
+import os
+import time
+from assets import ASSET_ORIGIN
+from render_options import DEFAULT_RENDER_OPTIONS
+from supervisor import (BROWSER_MAX_RSS_MB, HEARTBEAT_INTERVAL_SECONDS, HEARTBEAT_TIMEOUT_SECONDS, RENDER_RETRIES,
+                        RENDER_TIMEOUT_SECONDS, kill_process_group, process_group_rss)
+
+# Seconds a browser gets to close before its process tree is killed
+CLOSE_TIMEOUT_SECONDS = 5
+
+# Pool sizing can be tuned per deployment without code changes
+POOL_BROWSERS = int(os.environ.get("PDF_POOL_BROWSERS", "2"))
+POOL_PAGES_PER_BROWSER = int(os.environ.get("PDF_POOL_PAGES_PER_BROWSER", "4"))
+POOL_RECYCLE_AFTER = int(os.environ.get("PDF_POOL_RECYCLE_AFTER", "200"))
+# Browser contexts kept per browser, one per set of context options (viewport,
+# device scale factor, locale); the least recently used idle one is closed first
+POOL_CONTEXTS_PER_BROWSER = int(os.environ.get("PDF_POOL_CONTEXTS_PER_BROWSER", "4"))
+
+# How to decide that a page has finished rendering before printing it:
+#   load        - the window load event has fired
+#   networkidle - no network activity for 500 ms
+#   assets      - web fonts are loaded and every <img> is decoded
+#   flag        - the template sets window.__reportReady = true
+READY_MODES = ("load", "networkidle", "assets", "flag")
+READY_MODE = os.environ.get("PDF_READY_MODE", "assets")
+READY_TIMEOUT_MS = int(os.environ.get("PDF_READY_TIMEOUT_MS", "10000"))
+
+ASSETS_READY_JS = """async () => {
+    await document.fonts.ready;
+    await Promise.all(Array.from(document.images, img => img.decode().catch(() => {})));
+}"""
+
+async def wait_until_ready(page, mode=READY_MODE, timeout_ms=READY_TIMEOUT_MS):
+    """Wait until the page is ready to print and return the seconds spent waiting.
+
+    The wait never exceeds ``timeout_ms``; on timeout a warning is printed and
+    the page is printed as it is.
+    """
+    if mode not in READY_MODES:
+        raise ValueError(f"Invalid ready mode '{mode}'. Must be one of: {', '.join(READY_MODES)}")
+    if mode in ("load", "networkidle"):
+        waiter = page.wait_for_load_state(mode)
+    elif mode == "assets":
+        waiter = page.evaluate(ASSETS_READY_JS)
+    else:
+        waiter = page.wait_for_function("window.__reportReady === true")
+    start = time.perf_counter()
+    try:
+        await asyncio.wait_for(waiter, timeout_ms / 1000)
+    except asyncio.TimeoutError:
+        print(f"Warning: page not ready ({mode}) after {timeout_ms} ms, printing anyway")
+    return time.perf_counter() - start
+
+
+class PooledBrowser:
+    """A long-lived Chromium instance with a bounded set of reusable pages.
+
+    Pages live in browser contexts keyed by RenderOptions.context_key, so
+    renders with the same viewport, device scale factor and locale reuse
+    the same context and its warm pages.
+    """
+
+    def __init__(self, playwright, index, max_pages, assets=None, max_contexts=POOL_CONTEXTS_PER_BROWSER):
+        """Initialize an empty slot; the browser is launched by start()."""
+        self.playwright = playwright
+        self.assets = assets
+        self.index = index
+        self.max_pages = max_pages
+        self.max_contexts = max(1, max_contexts)
+        self.browser = None
+        # Contexts and their idle and checked-out pages by context key, least recently used first
+        self.contexts = {}
+        self.idle_pages = {}
+        self.busy_pages = {}
+        self._context_lock = asyncio.Lock()
+        self.contexts_created = 0
+        self.active = 0
+        self.jobs = 0
+        self.crashed = False
+        self.crashes = 0
+        self.kills = 0
+        # Chromium's main process, which leads the process group of the whole browser
+        self.pid = None
+        self.rss = None
+        self.recycle_reason = None
+        self._cdp = None
+
+    @property
+    def needs_recycle(self):
+        """Whether the browser should be replaced before taking more work."""
+        return (self.crashed or self.browser is None or self.jobs >= POOL_RECYCLE_AFTER
+                or self.recycle_reason is not None)
+
+    async def start(self):
+        """Launch Chromium and create the browser context for the default options."""
+        self.browser = await self.playwright.chromium.launch()
+        self.browser.on("disconnected", self._on_disconnected)
+        self.contexts, self.idle_pages, self.busy_pages = {}, {}, {}
+        self.contexts[DEFAULT_RENDER_OPTIONS.context_key] = await self._new_context(DEFAULT_RENDER_OPTIONS)
+        self.jobs = 0
+        self.crashed = False
+        self.recycle_reason = None
+        self.pid = self.rss = self._cdp = None
+        try:
+            self._cdp = await self.browser.new_browser_cdp_session()
+            info = await self._cdp.send("SystemInfo.getProcessInfo")
+            self.pid = next((p["id"] for p in info["processInfo"] if p["type"] == "browser"), None)
+        except Exception as e:
+            print(f"Warning: No CDP session for browser {self.index} ({e}); it can't be killed or measured")
+
+    async def close(self):
+        """Close the browser, killing its process tree if it doesn't close in time."""
+        browser, self.browser = self.browser, None
+        self.contexts, self.idle_pages, self.busy_pages = {}, {}, {}
+        if browser is not None:
+            try:
+                await asyncio.wait_for(browser.close(), CLOSE_TIMEOUT_SECONDS)
+            except Exception as e:
+                print(f"Warning: Could not close browser {self.index}: {e or type(e).__name__}")
+                # Whatever is left of the browser would otherwise live on as orphans
+                kill_process_group(self.pid, "chrom")
+
+    async def restart(self):
+        """Replace the browser with a fresh instance."""
+        reason = "crash" if self.crashed else self.recycle_reason or f"{self.jobs} jobs"
+        print(f"Recycling browser {self.index} after {reason}")
+        await self.close()
+        await self.start()
+
+    def kill(self, reason):
+        """Kill the browser's whole process tree; its renders fail and are retried elsewhere."""
+        print(f"Killing browser {self.index}: {reason}")
+        self.crashed = True
+        self.kills += 1
+        kill_process_group(self.pid, "chrom")
+
+    async def heartbeat(self, timeout=HEARTBEAT_TIMEOUT_SECONDS):
+        """Whether the browser answers a CDP round trip within ``timeout`` seconds."""
+        if self._cdp is None:
+            return self.browser is not None and self.browser.is_connected()
+        try:
+            await asyncio.wait_for(self._cdp.send("Browser.getVersion"), timeout)
+            return True
+        except Exception:
+            return False
+
+    def _on_disconnected(self, browser):
+        # Killed browsers are already marked and counted
+        if browser is self.browser and not self.crashed:
+            print(f"Browser {self.index} disconnected")
+            self.crashed = True
+            self.crashes += 1
+
+    async def _new_context(self, options):
+        context = await self.browser.new_context(**options.context_kwargs())
+        if self.assets is not None:
+            await context.route(f"{ASSET_ORIGIN}/**", self.assets.handle_route)
+        self.contexts_created += 1
+        return context
+
+    async def _evict_contexts(self):
+        """Close least recently used contexts without busy pages until there is room for one more."""
+        for key in list(self.contexts):
+            if len(self.contexts) < self.max_contexts:
+                return
+            if self.busy_pages.get(key) or key == DEFAULT_RENDER_OPTIONS.context_key:
+                continue
+            context = self.contexts.pop(key)
+            self.idle_pages.pop(key, None)
+            try:
+                await context.close()
+            except Exception:
+                pass
+
+    async def _context(self, options):
+        """Return the context for the options, creating it if needed, and mark it most recently used."""
+        key = options.context_key
+        async with self._context_lock:
+            context = self.contexts.pop(key, None)
+            if context is None:
+                await self._evict_contexts()
+                context = await self._new_context(options)
+            self.contexts[key] = context
+            self.busy_pages[key] = self.busy_pages.get(key, 0) + 1
+        return context
+
+    async def acquire_page(self, options=DEFAULT_RENDER_OPTIONS):
+        """Return an idle page of the options' context, opening a new one if none is available."""
+        key = options.context_key
+        idle = self.idle_pages.get(key, [])
+        while idle:
+            page = idle.pop()
+            if not page.is_closed():
+                self.contexts[key] = self.contexts.pop(key)
+                self.busy_pages[key] = self.busy_pages.get(key, 0) + 1
+                return page
+        context = await self._context(options)
+        try:
+            return await context.new_page()
+        except Exception:
+            self.busy_pages[key] -= 1
+            raise
+
+    async def release_page(self, page, reusable, options=DEFAULT_RENDER_OPTIONS):
+        """Keep a healthy page for the next job with the same context options, otherwise close it."""
+        key = options.context_key
+        if self.busy_pages.get(key):
+            self.busy_pages[key] -= 1
+        if reusable and not self.crashed and not page.is_closed() and key in self.contexts:
+            self.idle_pages.setdefault(key, []).append(page)
+            return
+        try:
+            await asyncio.wait_for(page.close(), CLOSE_TIMEOUT_SECONDS)
+        except Exception:
+            pass
+
+
+class BrowserPool:
+    """Warm pool of Chromium browsers shared by all PDF requests."""
+
+    def __init__(self, size=POOL_BROWSERS, pages_per_browser=POOL_PAGES_PER_BROWSER, assets=None):
+        """Initialize the pool; browsers are launched by start().
+
+        ``assets`` is an AssetRegistry used to answer template image requests.
+        """
+        self.assets = assets
+        self.size = max(1, size)
+        self.pages_per_browser = max(1, pages_per_browser)
+        self.playwright = None
+        self.browsers = []
+        self._cond = asyncio.Condition()
+        self._supervisor = None
+        self.stats = {"renders": 0, "failures": 0, "ready_timeouts": 0, "render_timeouts": 0, "retries": 0,
+                      "heartbeat_failures": 0, "memory_recycles": 0, "replaced": 0}
+
+    @property
+    def started(self):
+        return self.playwright is not None
+
+    async def start(self):
+        """Start Playwright and launch all browsers in the pool."""
+        if self.started:
+            return
+        try:
+            from playwright.async_api import async_playwright
+        except ImportError:
+            print("Playwright is not installed. Please run 'pip install playwright' and 'playwright install' to use PDF generation.")
+            return
+        self.playwright = await async_playwright().start()
+        self.browsers = [PooledBrowser(self.playwright, i, self.pages_per_browser, self.assets) for i in range(self.size)]
+        await asyncio.gather(*(browser.start() for browser in self.browsers))
+        if HEARTBEAT_INTERVAL_SECONDS > 0:
+            self._supervisor = asyncio.create_task(self._supervise())
+        print(f"Browser pool started with {self.size} browsers x {self.pages_per_browser} pages")
+
+    async def stop(self):
+        """Close every browser and stop Playwright."""
+        if not self.started:
+            return
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+            self._supervisor = None
+        await asyncio.gather(*(browser.close() for browser in self.browsers))
+        await self.playwright.stop()
+        self.playwright = None
+        self.browsers = []
+
+    def snapshot(self):
+        """Browser count, busy and idle pages, and render counters."""
+        return {
+            **self.stats,
+            "browsers": sum(1 for b in self.browsers if b.browser is not None),
+            "active_pages": sum(b.active for b in self.browsers),
+            "idle_pages": sum(len(pages) for b in self.browsers for pages in b.idle_pages.values()),
+            "contexts": sum(len(b.contexts) for b in self.browsers),
+            "contexts_created": sum(b.contexts_created for b in self.browsers),
+            "capacity": self.size * self.pages_per_browser,
+            "crashes": sum(b.crashes for b in self.browsers),
+            "kills": sum(b.kills for b in self.browsers),
+            "recycles_due": sum(1 for b in self.browsers if b.needs_recycle),
+            "browser_rss_bytes": sum(b.rss or 0 for b in self.browsers),
+        }
+
+    async def _check(self, browser):
+        """Heartbeat and memory check of one browser."""
+        if browser.browser is None or browser.crashed:
+            return
+        if not await browser.heartbeat(HEARTBEAT_TIMEOUT_SECONDS):
+            self.stats["heartbeat_failures"] += 1
+            browser.kill(f"no heartbeat within {HEARTBEAT_TIMEOUT_SECONDS:g} s")
+            return
+        if browser.pid is None:
+            return
+        browser.rss = await asyncio.to_thread(process_group_rss, browser.pid)
+        limit = BROWSER_MAX_RSS_MB * 1024 * 1024
+        if limit and browser.rss and browser.rss > limit and browser.recycle_reason is None:
+            browser.recycle_reason = f"{browser.rss >> 20} MB RSS"
+            self.stats["memory_recycles"] += 1
+
+    async def _replace(self, browser):
+        """Restart a browser due for recycling if it is idle, so the next render doesn't wait for it."""
+        async with self._cond:
+            if not browser.needs_recycle or browser.active:
+                return
+            browser.active += 1
+        try:
+            await browser.restart()
+            self.stats["replaced"] += 1
+        except Exception as e:
+            print(f"Warning: Could not restart browser {browser.index}: {e}")
+        finally:
+            await self._release(browser, count_job=False)
+
+    async def _supervise(self):
+        """Check every browser each heartbeat interval and replace dead or oversized ones."""
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL_SECONDS)
+            try:
+                await asyncio.gather(*(self._check(browser) for browser in self.browsers))
+                for browser in self.browsers:
+                    await self._replace(browser)
+            except Exception as e:
+                print(f"Warning: Browser supervision failed: {e}")
+
+    def _pick(self):
+        """Choose the least busy healthy browser, or an idle one due for recycling."""
+        healthy = [b for b in self.browsers if not b.needs_recycle and b.active < b.max_pages]
+        if healthy:
+            return min(healthy, key=lambda b: b.active)
+        for browser in self.browsers:
+            if browser.needs_recycle and browser.active == 0:
+                return browser
+        return None
+
+    async def _acquire(self):
+        async with self._cond:
+            browser = self._pick()
+            while browser is None:
+                await self._cond.wait()
+                browser = self._pick()
+            browser.active += 1
+        if browser.needs_recycle:
+            try:
+                await browser.restart()
+            except Exception:
+                await self._release(browser, count_job=False)
+                raise
+        return browser
+
+    async def _release(self, browser, count_job=True):
+        async with self._cond:
+            browser.active -= 1
+            if count_job:
+                browser.jobs += 1
+            self._cond.notify_all()
+
+    async def render_pdf(self, html, ready_mode=READY_MODE, timings=None, options=None):
+        """Render an HTML string to PDF bytes on a pooled browser page.
+
+        ``options`` is a RenderOptions (the defaults if None). Returns None if
+        rendering fails. A render whose browser crashes, hangs past
+        PDF_RENDER_TIMEOUT_SECONDS or misses a heartbeat is retried up to
+        PDF_RENDER_RETRIES times on a healthy browser. If ``timings`` is a
+        dict, the seconds spent in each stage are stored under
+        ``"browser_acquire"``, ``"set_content"``, ``"ready_wait"`` and ``"page_pdf"``.
+        """
+        if timings is None:
+            timings = {}
+        if options is None:
+            options = DEFAULT_RENDER_OPTIONS
+        if not self.started:
+            await self.start()
+            if not self.started:
+                return None
+        for attempt in range(max(0, RENDER_RETRIES) + 1):
+            if attempt:
+                self.stats["retries"] += 1
+                print(f"Retrying render after a browser failure ({attempt}/{RENDER_RETRIES})")
+            pdf_bytes, browser_failed = await self._render_once(html, ready_mode, timings, options)
+            if pdf_bytes is not None or not browser_failed:
+                return pdf_bytes
+        return None
+
+    async def _print(self, page, html, ready_mode, timings, options):
+        start = time.perf_counter()
+        await page.set_content(html, wait_until="domcontentloaded")
+        timings["set_content"] = time.perf_counter() - start
+        timings["ready_wait"] = await wait_until_ready(page, ready_mode)
+        if timings["ready_wait"] >= READY_TIMEOUT_MS / 1000:
+            self.stats["ready_timeouts"] += 1
+        start = time.perf_counter()
+        pdf_bytes = await page.pdf(**options.pdf_kwargs())
+        timings["page_pdf"] = time.perf_counter() - start
+        return pdf_bytes
+
+    async def _render_once(self, html, ready_mode, timings, options):
+        """One render attempt; returns ``(pdf_bytes, browser_failed)``."""
+        start = time.perf_counter()
+        browser = await self._acquire()
+        page = None
+        reusable = False
+        try:
+            page = await browser.acquire_page(options)
+            timings["browser_acquire"] = time.perf_counter() - start
+            pdf_bytes = await asyncio.wait_for(self._print(page, html, ready_mode, timings, options),
+                                               RENDER_TIMEOUT_SECONDS)
+            reusable = True
+            self.stats["renders"] += 1
+            print(f"PDF generated: {len(pdf_bytes)} bytes (ready wait {timings['ready_wait'] * 1000:.0f} ms)")
+            return pdf_bytes, False
+        except asyncio.TimeoutError:
+            self.stats["render_timeouts"] += 1
+            self.stats["failures"] += 1
+            # A page that stops responding takes its renderer, and usually the browser, with it
+            browser.kill(f"render exceeded {RENDER_TIMEOUT_SECONDS:g} s")
+            return None, True
+        except Exception as e:
+            print(f"Error generating PDF on browser {browser.index}: {str(e)}")
+            self.stats["failures"] += 1
+            return None, browser.crashed
+        finally:
+            if page is not None:
+                await browser.release_page(page, reusable, options)
+            await self._release(browser)
@@ -0,0 +1,887 @@
+import abc
+import asyncio
+import base64
+import functools
+import html
+import io
+import os
+import re
+import time
+import urllib.parse
+import urllib.request
+from html.parser import HTMLParser
+
+from assets import ASSET_REGISTRY
+from render_options import DEFAULT_RENDER_OPTIONS
+from renderer import render_document
+
+try:
+    from reportlab import rl_config
+    from reportlab.lib import colors, pagesizes
+    from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
+    from reportlab.lib.styles import ParagraphStyle
+    from reportlab.lib.utils import ImageReader
+    from reportlab.pdfbase.pdfmetrics import stringWidth
+    from reportlab.platypus import (BaseDocTemplate, Flowable, Frame, NextPageTemplate, PageBreak, PageTemplate,
+                                    Paragraph, Spacer, Table, TableStyle)
+    # Images are embedded as binary streams; ASCII85 encoding them in pure Python costs more than the layout
+    rl_config.useA85 = 0
+except ImportError:
+    BaseDocTemplate = None
+    Flowable = object
+
+# Render backends: "browser" prints the template in Chromium, "lite" lays the
+# same HTML out with ReportLab, without a browser
+ENGINES = ("browser", "lite")
+ENGINE = os.environ.get("PDF_ENGINE", "browser").lower()
+if ENGINE not in ENGINES:
+    raise ValueError(f"Invalid PDF_ENGINE '{ENGINE}'. Must be one of: {', '.join(ENGINES)}")
+
+
+def parse_template_engines(value):
+    """Parse per-template engines written as ``template=engine`` pairs, e.g. ``invest4edu=lite``."""
+    engines = {}
+    for pair in filter(None, (part.strip() for part in value.split(","))):
+        template, _, engine = pair.partition("=")
+        template, engine = template.strip().lower(), engine.strip().lower()
+        if engine not in ENGINES:
+            raise ValueError(f"Invalid engine '{engine}' for template '{template}'. "
+                             f"Must be one of: {', '.join(ENGINES)}")
+        engines[template] = engine
+    return engines
+
+
+# Engines of templates that don't render with PDF_ENGINE, e.g. "invest4edu=lite,investvalue=browser"
+TEMPLATE_ENGINES = parse_template_engines(os.environ.get("PDF_TEMPLATE_ENGINES", ""))
+
+# Template HTML references assets through this scheme in lite renders
+LITE_ASSET_SCHEME = "lite-asset:"
+PX = 0.75  # points per CSS pixel
+BASE_FONT_SIZE = 12.0  # 16px, the browser default
+# Inherited CSS properties the lite engine understands
+_INHERITED = ("color", "font-size", "font-weight", "font-style", "text-align", "line-height")
+_INLINE_TAGS = {"span", "strong", "b", "em", "i", "u", "a", "br", "small", "font", "sup", "sub"}
+_VOID_TAGS = {"img", "br", "meta", "link", "hr", "input", "col", "source"}
+_SKIPPED_TAGS = {"head", "style", "script", "title", "template"}
+# Heading sizes in em and margins in em, as in Chromium's default style sheet
+_HEADINGS = {"h1": (2.0, 0.67), "h2": (1.5, 0.83), "h3": (1.17, 1.0), "h4": (1.0, 1.33), "h5": (0.83, 1.67),
+             "h6": (0.67, 2.33)}
+
+
+def engine_for(template, requested=None):
+    """Name of the engine a template renders with: the requested one, its PDF_TEMPLATE_ENGINES entry or PDF_ENGINE."""
+    return requested or TEMPLATE_ENGINES.get(template, ENGINE)
+
+
+def select_engine(engines, template, requested=None, options=DEFAULT_RENDER_OPTIONS):
+    """The Engine a render uses; renders an engine can't produce fall back to the browser.
+
+    Only selects: the caller that routes a request counts the fallback.
+    """
+    engine = engines[engine_for(template, requested)]
+    if engine.available and engine.supports(options):
+        return engine
+    return engines["browser"]
+
+
+def default_engine(engines, template):
+    """Name of the engine a template renders with when a request asks for nothing else."""
+    return select_engine(engines, template).name
+
+
+class Engine(abc.ABC):
+    """A backend that renders a template with its data to PDF bytes."""
+
+    name = None
+
+    def __init__(self):
+        self.stats = {"renders": 0, "failures": 0, "fallbacks": 0}
+
+    @property
+    def available(self):
+        return True
+
+    @property
+    def version(self):
+        """Suffix for cache keys, so engines never share cached PDFs."""
+        return ""
+
+    def supports(self, options):
+        """Whether the engine can honor the render options."""
+        return True
+
+    @abc.abstractmethod
+    async def render(self, template_name, data, ready_mode, timings, options=DEFAULT_RENDER_OPTIONS, render_info=None,
+                     deadline=None):
+        """Render a template to PDF bytes (None on failure).
+
+        ``deadline`` (event-loop time) is the request's deadline, for engines
+        that wait on the render scheduler themselves.
+        """
+
+    def _count(self, pdf_bytes):
+        self.stats["renders" if pdf_bytes else "failures"] += 1
+        return pdf_bytes
+
+    def snapshot(self):
+        return {**self.stats, "available": self.available}
+
+
+class BrowserEngine(Engine):
+    """Prints templates in Chromium, on the local browser pool or through the renderer service.
+
+    Segmented, large-report and section rendering (see render_document) are
+    only available on this engine.
+    """
+
+    name = "browser"
+
+    def __init__(self, generator, pool, static_pages=None, large_reports=None, sections=None, client=None):
+        super().__init__()
+        self.generator = generator
+        self.pool = pool
+        self.static_pages = static_pages
+        self.large_reports = large_reports
+        self.sections = sections
+        self.client = client
+
+    async def render(self, template_name, data, ready_mode, timings, options=DEFAULT_RENDER_OPTIONS, render_info=None,
+                     deadline=None):
+        if self.client is not None:
+            pdf_bytes = await self.client.render(template_name, data, ready_mode, timings, options, render_info)
+        else:
+            pdf_bytes = await render_document(self.generator, self.pool, self.static_pages, template_name, data,
+                                              ready_mode, timings, self.large_reports, options, self.sections,
+                                              render_info, deadline)
+        return self._count(pdf_bytes)
+
+
+class LiteEngine(Engine):
+    """Lays the template HTML out with ReportLab, without a browser.
+
+    It understands the subset of HTML and CSS the report templates use:
+    full-page images, headers, paragraphs, lists, tables (with repeated
+    header rows, colspans and blurred cells), flex rows, bars and the footer
+    of ``@page with-footer``. Scripts don't run and other CSS is ignored, so
+    check new templates with parity.py before routing them here. Header and
+    footer templates, page ranges, tags, outlines and scaling need the
+    browser; renders using them fall back to it.
+    """
+
+    name = "lite"
+
+    def __init__(self, generator, assets=None):
+        """Initialize the engine for a BrowserPDFGenerator and optional AssetRegistry (the generator's by default)."""
+        super().__init__()
+        self.generator = generator
+        self.assets = assets if assets is not None else generator.assets
+        self.stats["render_ms_total"] = 0.0
+        if BaseDocTemplate is None:
+            print("ReportLab is not installed. Lite renders use the browser; "
+                  "run 'pip install reportlab' to enable them.")
+
+    @property
+    def available(self):
+        return BaseDocTemplate is not None
+
+    @property
+    def version(self):
+        return ":lite"
+
+    def supports(self, options):
+        return options.merge_safe and options.scale == 1.0
+
+    def _image_data(self, src):
+        if src.startswith(LITE_ASSET_SCHEME):
+            name = src[len(LITE_ASSET_SCHEME):]
+            asset = self.assets.get(name) if self.assets is not None else None
+            if asset is not None:
+                return asset.data
+            if name not in ASSET_REGISTRY:
+                return None
+            with open(os.path.join(getattr(self.assets, "root", "."), ASSET_REGISTRY[name][0]), "rb") as f:
+                return f.read()
+        if src.startswith("data:"):
+            header, _, payload = src.partition(",")
+            return base64.b64decode(payload) if header.endswith(";base64") else urllib.parse.unquote_to_bytes(payload)
+        if src.startswith("file:"):
+            with open(urllib.request.url2pathname(urllib.parse.urlparse(src).path), "rb") as f:
+                return f.read()
+        return None
+
+    def image(self, src):
+        """ImageReader for an image source in the template HTML, or None if it can't be loaded."""
+        try:
+            data = self._image_data(src)
+        except OSError as e:
+            print(f"Warning: image {src[:80]} not loaded: {e}")
+            return None
+        return ImageReader(io.BytesIO(data)) if data else None
+
+    def render_pdf(self, template_name, data, options=DEFAULT_RENDER_OPTIONS, timings=None):
+        """Render a template to PDF bytes synchronously; None on failure."""
+        html_content = self.generator.render_html(template_name, data, asset_url=lambda name: LITE_ASSET_SCHEME + name,
+                                                  timings=timings)
+        if html_content is None:
+            return None
+        start = time.perf_counter()
+        try:
+            pdf_bytes = _build_pdf(html_content, options, self.image)
+        except Exception as e:
+            print(f"Error laying out {template_name} with the lite engine: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            return None
+        elapsed = time.perf_counter() - start
+        if timings is not None:
+            timings["lite_render"] = elapsed
+        self.stats["render_ms_total"] += elapsed * 1000
+        return pdf_bytes
+
+    async def render(self, template_name, data, ready_mode, timings, options=DEFAULT_RENDER_OPTIONS, render_info=None,
+                     deadline=None):
+        # There is nothing to wait for, so ready_mode doesn't apply; layout is CPU work in a thread
+        return self._count(await asyncio.to_thread(self.render_pdf, template_name, data, options, timings))
+
+    def snapshot(self):
+        renders = self.stats["renders"]
+        return {**super().snapshot(), "render_ms_total": round(self.stats["render_ms_total"], 2),
+                "render_ms_mean": round(self.stats["render_ms_total"] / renders, 2) if renders else 0.0}
+
+
+class _Node:
+    __slots__ = ("tag", "attrs", "children")
+
+    def __init__(self, tag, attrs):
+        self.tag = tag
+        self.attrs = dict(attrs)
+        self.children = []
+
+    @property
+    def classes(self):
+        return (self.attrs.get("class") or "").split()
+
+    @property
+    def elements(self):
+        return [child for child in self.children if isinstance(child, _Node)]
+
+    def text(self):
+        return "".join(child if isinstance(child, str) else child.text() for child in self.children)
+
+    def find(self, tag):
+        for child in self.elements:
+            if child.tag == tag:
+                return child
+            found = child.find(tag)
+            if found is not None:
+                return found
+        return None
+
+
+class _TreeBuilder(HTMLParser):
+    """Builds a tree of the HTML, tolerating unclosed and stray end tags like a browser."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.root = _Node("root", {})
+        self.css = []
+        self.title = ""
+        self._stack = [self.root]
+
+    def handle_starttag(self, tag, attrs):
+        node = _Node(tag, attrs)
+        self._stack[-1].children.append(node)
+        if tag not in _VOID_TAGS:
+            self._stack.append(node)
+
+    def handle_startendtag(self, tag, attrs):
+        self._stack[-1].children.append(_Node(tag, attrs))
+
+    def handle_endtag(self, tag):
+        for index in range(len(self._stack) - 1, 0, -1):
+            if self._stack[index].tag == tag:
+                del self._stack[index:]
+                return
+
+    def handle_data(self, data):
+        parent = self._stack[-1].tag
+        if parent == "style":
+            self.css.append(data)
+        elif parent == "title":
+            self.title += data
+        else:
+            self._stack[-1].children.append(data)
+
+
+def _declarations(text):
+    declarations = {}
+    for declaration in (text or "").split(";"):
+        prop, _, value = declaration.partition(":")
+        if value.strip():
+            declarations[prop.strip().lower()] = value.strip()
+    return declarations
+
+
+def _css_rules(css):
+    """Declarations of the plain tag and class selectors in a style sheet."""
+    rules = {}
+    for selectors, body in re.findall(r"([^{}]+)\{([^{}]*)\}", re.sub(r"/\*.*?\*/", "", css, flags=re.S)):
+        declarations = _declarations(body)
+        for selector in selectors.split(","):
+            selector = selector.strip()
+            if re.fullmatch(r"\.?[\w-]+", selector):
+                rules.setdefault(selector, {}).update(declarations)
+    return rules
+
+
+def _page_rule(css, name):
+    """Margin and bottom margin boxes of a named ``@page`` rule."""
+    match = re.search(r"@page\s+" + re.escape(name) + r"\s*\{", css)
+    if match is None:
+        return None
+    body, depth = "", 1
+    for char in css[match.end():]:
+        depth += (char == "{") - (char == "}")
+        if depth == 0:
+            break
+        body += char
+    boxes = {box: _declarations(declarations) for box, declarations in re.findall(r"@([\w-]+)\s*\{([^{}]*)\}", body)}
+    rule = _declarations(re.sub(r"@[\w-]+\s*\{[^{}]*\}", "", body))
+    return {"margin": rule.get("margin", "0"), "boxes": boxes}
+
+
+def _length(value, font_size=BASE_FONT_SIZE, reference=None):
+    """A CSS length in points; percentages need ``reference``. None if it can't be resolved."""
+    match = re.fullmatch(r"(-?[\d.]+)(px|pt|em|rem|cm|mm|in|%)?", (value or "").strip())
+    if match is None:
+        return None
+    number, unit = float(match.group(1)), match.group(2)
+    if unit == "%":
+        return number / 100 * reference if reference is not None else None
+    return number * {None: PX, "px": PX, "pt": 1.0, "em": font_size, "rem": BASE_FONT_SIZE, "cm": 72 / 2.54,
+                     "mm": 72 / 25.4, "in": 72.0}[unit]
+
+
+@functools.lru_cache(maxsize=256)
+def _color(value):
+    if not value or value in ("transparent", "inherit", "none"):
+        return None
+    try:
+        return colors.toColor(value.split()[0])
+    except ValueError:
+        return None
+
+
+def _bold(declarations):
+    weight = declarations.get("font-weight", "normal")
+    return weight in ("bold", "bolder") or (weight.isdigit() and int(weight) >= 600)
+
+
+def _markup_text(text):
+    return html.escape(re.sub(r"\s+", " ", text), quote=False)
+
+
+class _FullPage(Flowable):
+    """An image covering a whole frame, cropped like ``object-fit: cover``."""
+
+    def __init__(self, image):
+        super().__init__()
+        self.image = image
+
+    def wrap(self, available_width, available_height):
+        self.width, self.height = available_width, available_height
+        return available_width, available_height
+
+    def draw(self):
+        if self.image is None:
+            return
+        image_width, image_height = self.image.getSize()
+        scale = max(self.width / image_width, self.height / image_height)
+        width, height = image_width * scale, image_height * scale
+        self.canv.saveState()
+        clip = self.canv.beginPath()
+        clip.rect(0, 0, self.width, self.height)
+        self.canv.clipPath(clip, stroke=0, fill=0)
+        self.canv.drawImage(self.image, (self.width - width) / 2, (self.height - height) / 2, width, height,
+                            mask="auto")
+        self.canv.restoreState()
+
+
+class _Picture(Flowable):
+    def __init__(self, image, width, height, align="LEFT"):
+        super().__init__()
+        self.image = image
+        self.width = width
+        self.height = height
+        self.hAlign = align
+
+    def wrap(self, available_width, available_height):
+        return self.width, self.height
+
+    def draw(self):
+        self.canv.drawImage(self.image, 0, 0, self.width, self.height, mask="auto")
+
+
+class _Box(Flowable):
+    """A filled rectangle: colour swatches and blurred text, which is never drawn as text."""
+
+    def __init__(self, width, height, color, radius=0):
+        super().__init__()
+        self.width = width
+        self.height = height
+        self.color = color
+        self.radius = radius
+
+    def wrap(self, available_width, available_height):
+        self.width = min(self.width, available_width)
+        return self.width, self.height
+
+    def draw(self):
+        self.canv.setFillColor(self.color)
+        self.canv.roundRect(0, 0, self.width, self.height, self.radius, stroke=0, fill=1)
+
+
+class _Layout:
+    """Turns the parsed template HTML into ReportLab flowables.
+
+    Elements with ``height: 100vh`` become full-page images on the "full"
+    page template; everything else flows on the "content" page template.
+    """
+
+    def __init__(self, rules, image, width, paged=True):
+        self.rules = rules
+        self.image = image
+        self.width = width
+        self.paged = paged
+        self.story = []
+        self.first_template = None
+        self._template = None
+        self._break = False
+
+    def _sub(self, width):
+        return _Layout(self.rules, self.image, width, paged=False)
+
+    def _add(self, flowable, template="content"):
+        if self.paged:
+            if self._template is None:
+                self.first_template = self._template = template
+            elif self._break or template != self._template:
+                if template != self._template:
+                    self.story.append(NextPageTemplate(template))
+                    self._template = template
+                self.story.append(PageBreak())
+            self._break = False
+        self.story.append(flowable)
+
+    def _page_break(self):
+        if self._template is not None:
+            self._break = True
+
+    def style(self, node, inherited):
+        """Computed declarations of an element: inherited, tag, class and inline ones, with font-size in points."""
+        own = dict(self.rules.get(node.tag, {}))
+        for name in node.classes:
+            own.update(self.rules.get("." + name, {}))
+        own.update(_declarations(node.attrs.get("style")))
+        declarations = {key: value for key, value in inherited.items() if key in _INHERITED}
+        declarations.update((key, value) for key, value in own.items() if value != "inherit")
+        parent_size = float(inherited.get("font-size", f"{BASE_FONT_SIZE}pt")[:-2])
+        if "font-size" in own:
+            size = _length(own["font-size"], parent_size, parent_size) or parent_size
+        else:
+            size = _HEADINGS.get(node.tag, (1.0, None))[0] * parent_size
+        declarations["font-size"] = f"{size:.2f}pt"
+        if "font-weight" not in own and node.tag in (*_HEADINGS, "b", "strong", "th"):
+            declarations["font-weight"] = "bold"
+        return declarations
+
+    def paragraph_style(self, declarations, space_before=0.0, space_after=0.0):
+        size = float(declarations["font-size"][:-2])
+        line_height = declarations.get("line-height", "normal")
+        if line_height == "normal":
+            leading = size * 1.2
+        elif re.fullmatch(r"[\d.]+", line_height):
+            leading = size * float(line_height)
+        else:
+            leading = _length(line_height, size) or size * 1.2
+        bold = _bold(declarations)
+        italic = declarations.get("font-style") == "italic"
+        font = "Helvetica" + ("-BoldOblique" if bold and italic else "-Bold" if bold else "-Oblique" if italic else "")
+        align = {"right": TA_RIGHT, "center": TA_CENTER}.get(declarations.get("text-align"), TA_LEFT)
+        return ParagraphStyle("lite", fontName=font, fontSize=size, leading=leading, alignment=align,
+                              textColor=_color(declarations.get("color")) or colors.black,
+                              spaceBefore=space_before, spaceAfter=space_after)
+
+    def markup(self, nodes, declarations):
+        """ReportLab paragraph markup of inline content."""
+        parts = []
+        for node in nodes:
+            if isinstance(node, str):
+                parts.append(_markup_text(node))
+                continue
+            if node.tag == "br":
+                parts.append("<br/>")
+                continue
+            if node.tag not in _INLINE_TAGS:
+                parts.append(_markup_text(node.text()))
+                continue
+            child = self.style(node, declarations)
+            if child.get("display") == "none":
+                continue
+            opening, closing = "", ""
+            font = []
+            if child.get("color") != declarations.get("color") and _color(child.get("color")) is not None:
+                font.append(f'color="{_color(child["color"]).hexval().replace("0x", "#")}"')
+            if child["font-size"] != declarations["font-size"]:
+                font.append(f'size="{child["font-size"][:-2]}"')
+            if font:
+                opening, closing = f"<font {' '.join(font)}>", "</font>"
+            if _bold(child) and not _bold(declarations):
+                opening, closing = opening + "<b>", "</b>" + closing
+            if child.get("font-style") == "italic" or node.tag in ("em", "i"):
+                opening, closing = opening + "<i>", "</i>" + closing
+            if node.tag == "u":
+                opening, closing = opening + "<u>", "</u>" + closing
+            parts.append(opening + self.markup(node.children, child) + closing)
+        return "".join(parts)
+
+    def _margins(self, node, declarations):
+        size = float(declarations["font-size"][:-2])
+        _, heading_margin = _HEADINGS.get(node.tag, (None, 1.0 if node.tag == "p" else 0.0))
+        default = heading_margin * size
+        before = _length(declarations.get("margin-top"), size)
+        after = _length(declarations.get("margin-bottom"), size)
+        return (default if before is None else before), (default if after is None else after)
+
+    def flowables(self, node, declarations):
+        """Lay out the children of an element as blocks, grouping runs of inline content into paragraphs."""
+        run = []
+
+        def flush():
+            text = self.markup(run, declarations)
+            run.clear()
+            if text.strip():
+                self._add(Paragraph(text, self.paragraph_style(declarations)))
+
+        for child in node.children:
+            if isinstance(child, str) or child.tag in _INLINE_TAGS:
+                run.append(child)
+            else:
+                flush()
+                self.block(child, declarations)
+        flush()
+
+    def block(self, node, inherited):
+        if node.tag in _SKIPPED_TAGS:
+            return
+        declarations = self.style(node, inherited)
+        if declarations.get("display") == "none":
+            return
+        if "always" in (declarations.get("page-break-before"), declarations.get("break-before")):
+            self._page_break()
+        if declarations.get("height") == "100vh" and self.paged:
+            image = node.find("img")
+            self._add(_FullPage(self.image(image.attrs.get("src", "")) if image is not None else None), "full")
+            self._page_break()
+        elif node.tag in ("p",) + tuple(_HEADINGS):
+            text = self.markup(node.children, declarations)
+            if text.strip():
+                self._add(Paragraph(text, self.paragraph_style(declarations, *self._margins(node, declarations))))
+        elif node.tag in ("ul", "ol"):
+            self._list(node, declarations)
+        elif node.tag == "table":
+            self._add(self._table(node, declarations))
+        elif node.tag == "img":
+            picture = self._picture(node, declarations)
+            if picture is not None:
+                self._add(picture)
+        elif node.tag == "br":
+            self._add(Spacer(1, float(declarations["font-size"][:-2])))
+        elif declarations.get("display") == "flex":
+            self._add(self._flex(node, declarations))
+        elif node.elements and all("%" in self.style(child, declarations).get("width", "")
+                                   and self.style(child, declarations).get("float") for child in node.elements):
+            self._add(self._bar(node, declarations))
+        elif _color(declarations.get("background-color")) and not node.elements and node.text().strip():
+            self._add(self._boxed(node, declarations))
+        elif not node.text().strip() and not node.find("img") and _color(declarations.get("background-color")):
+            width = _length(declarations.get("width"), reference=self.width) or self.width
+            self._add(_Box(width, _length(declarations.get("height")) or 0, _color(declarations["background-color"])))
+        else:
+            _, after = self._margins(node, declarations)
+            self.flowables(node, declarations)
+            if after and self.story:
+                self._add(Spacer(1, after))
+        if "always" in (declarations.get("page-break-after"), declarations.get("break-after")):
+            self._page_break()
+
+    def _list(self, node, declarations):
+        style = self.paragraph_style(declarations)
+        indent = _length(declarations.get("padding-left")) or 30.0
+        for index, item in enumerate(child for child in node.elements if child.tag == "li"):
+            item_declarations = self.style(item, declarations)
+            item_style = self.paragraph_style(item_declarations)
+            item_style.leftIndent = indent
+            item_style.bulletIndent = indent - 12
+            item_style.spaceAfter = _length(item_declarations.get("margin-bottom"), style.fontSize) or 0
+            bullet = f"{index + 1}." if node.tag == "ol" else "•"
+            nested = [child for child in item.elements if child.tag in ("ul", "ol")]
+            inline = [child for child in item.children if child not in nested]
+            self._add(Paragraph(self.markup(inline, item_declarations).strip(), item_style, bulletText=bullet))
+            for child in nested:
+                sub = self._sub(self.width - indent)
+                sub._list(child, item_declarations)
+                for flowable in sub.story:
+                    if isinstance(flowable, Paragraph):
+                        flowable.style.leftIndent += indent
+                        flowable.style.bulletIndent += indent
+                    self._add(flowable)
+        self._add(Spacer(1, style.fontSize))
+
+    def _picture(self, node, declarations, width=None):
+        image = self.image(node.attrs.get("src", ""))
+        if image is None:
+            return None
+        available = width or self.width
+        image_width, image_height = image.getSize()
+        width = _length(declarations.get("width"), reference=available)
+        height = _length(declarations.get("height"))
+        if width is None and height is None:
+            width, height = image_width * PX, image_height * PX
+        elif width is None:
+            width = image_width * height / image_height
+        elif height is None:
+            height = image_height * width / image_width
+        if width > available:
+            width, height = available, height * available / width
+        return _Picture(image, width, height)
+
+    def _boxed(self, node, declarations):
+        size = float(declarations["font-size"][:-2])
+        style = self.paragraph_style(declarations)
+        text = self.markup(node.children, declarations).strip()
+        padding = (declarations.get("padding") or "0").split()
+        vertical = _length(padding[0], size) or 0
+        horizontal = _length(padding[1] if len(padding) > 1 else padding[0], size) or 0
+        if declarations.get("display") in ("inline-block", "inline") or node.tag in _INLINE_TAGS:
+            width = min(stringWidth(re.sub(r"<[^>]+>", "", html.unescape(text)), style.fontName, style.fontSize)
+                        + 2 * horizontal + 1, self.width)
+        else:
+            width = self.width
+        box = Table([[Paragraph(text, style)]], colWidths=[width], hAlign="LEFT")
+        box.setStyle(TableStyle([
+            ("BACKGROUND", (0, 0), (-1, -1), _color(declarations["background-color"])),
+            ("LEFTPADDING", (0, 0), (-1, -1), horizontal), ("RIGHTPADDING", (0, 0), (-1, -1), horizontal),
+            ("TOPPADDING", (0, 0), (-1, -1), vertical), ("BOTTOMPADDING", (0, 0), (-1, -1), vertical),
+        ]))
+        box.spaceAfter = _length(declarations.get("margin-bottom"), size) or 0
+        return box
+
+    def _cell(self, node, declarations, width):
+        """Flowables of an element laid out inside a table cell or flex item."""
+        sub = self._sub(width)
+        if node.tag in _INLINE_TAGS and _color(declarations.get("background-color")):
+            return [sub._boxed(node, declarations)]
+        if node.tag in _INLINE_TAGS or node.tag == "td" or node.tag == "th" or not node.elements:
+            sub.flowables(node, declarations)
+        else:
+            sub.block(node, declarations)
+        return sub.story
+
+    def _flex(self, node, declarations):
+        items = [(child, self.style(child, declarations)) for child in node.elements if child.tag not in _SKIPPED_TAGS]
+        # Items with a fixed width keep it (plus their right margin); the others share the rest
+        fixed = [None if "%" in item.get("width", "%") else
+                 (_length(item["width"]) or 0) + (_length(item.get("margin-right")) or 0) for _, item in items]
+        flexible = fixed.count(None)
+        share = max(0.0, self.width - sum(width for width in fixed if width)) / max(1, flexible)
+        widths = [share if width is None else width for width in fixed]
+        spaced = declarations.get("justify-content") == "space-between"
+        cells, commands = [], [("VALIGN", (0, 0), (-1, -1), "MIDDLE")]
+        for index, ((item, item_declarations), width) in enumerate(zip(items, widths)):
+            flowables = self._cell(item, item_declarations, width)
+            right = item_declarations.get("margin-left") == "auto" or (spaced and 0 < index == len(items) - 1)
+            for flowable in flowables:
+                flowable.hAlign = "RIGHT" if right else "LEFT"
+                if right and isinstance(flowable, Paragraph):
+                    flowable.style.alignment = TA_RIGHT
+            cells.append(flowables)
+        for side in ("LEFT", "RIGHT", "TOP", "BOTTOM"):
+            commands.append((f"{side}PADDING", (0, 0), (-1, -1), 0))
+        table = Table([cells], colWidths=widths, hAlign="LEFT")
+        table.setStyle(TableStyle(commands))
+        size = float(declarations["font-size"][:-2])
+        table.spaceBefore = _length(declarations.get("padding", "0").split()[0], size) or 0
+        table.spaceAfter = (_length(declarations.get("margin-bottom"), size) or 0) + table.spaceBefore
+        return table
+
+    def _bar(self, node, declarations):
+        """Side-by-side blocks sized in percent, like the asset allocation bar."""
+        segments = [self.style(child, declarations) for child in node.elements]
+        widths = [_length(segment["width"], reference=self.width) or 0 for segment in segments]
+        remaining = self.width - sum(widths)
+        if remaining > 0.5:
+            widths.append(remaining)
+            segments.append(declarations)
+        height = _length(declarations.get("height")) or 20
+        table = Table([[""] * len(widths)], colWidths=widths, rowHeights=[height], hAlign="LEFT")
+        table.setStyle(TableStyle([("BACKGROUND", (index, 0), (index, 0), _color(segment.get("background-color")))
+                                   for index, segment in enumerate(segments)
+                                   if _color(segment.get("background-color")) is not None]))
+        margin = (declarations.get("margin") or "0").split()
+        table.spaceBefore = table.spaceAfter = _length(margin[0], float(declarations["font-size"][:-2])) or 0
+        return table
+
+    def _table(self, node, declarations):
+        rows, cells, header_rows = [], [], 0
+        for group in [node] + [child for child in node.elements if child.tag in ("thead", "tbody", "tfoot")]:
+            for row in (child for child in group.elements if child.tag == "tr"):
+                row_declarations = self.style(row, self.style(group, declarations))
+                rows.append(row_declarations)
+                cells.append([(cell, self.style(cell, row_declarations)) for cell in row.elements
+                              if cell.tag in ("td", "th")])
+                if group.tag == "thead":
+                    header_rows += 1
+        if not rows:
+            return Spacer(1, 0)
+        columns = max(sum(int(cell.attrs.get("colspan") or 1) for cell, _ in row) for row in cells)
+        widths = self._column_widths(cells, columns)
+        data, commands = [], [("VALIGN", (0, 0), (-1, -1), "MIDDLE")]
+        for y, (row_declarations, row) in enumerate(zip(rows, cells)):
+            line, x = [], 0
+            for cell, cell_declarations in row:
+                span = int(cell.attrs.get("colspan") or 1)
+                size = float(cell_declarations["font-size"][:-2])
+                padding = _length((cell_declarations.get("padding") or "0").split()[0], size) or 0
+                width = sum(widths[x:x + span]) - 2 * padding
+                if cell_declarations.get("color") == "transparent":
+                    # Blurred text is hidden as a grey bar; its text never reaches the PDF
+                    text_width = stringWidth(" ".join(cell.text().split()), "Helvetica", size)
+                    line.append(_Box(min(text_width, width), size, colors.HexColor("#c8c8c8"), radius=size / 3))
+                else:
+                    line.append(self._cell(cell, cell_declarations, width))
+                background = _color(cell_declarations.get("background-color"))
+                if background is not None:
+                    commands.append(("BACKGROUND", (x, y), (x + span - 1, y), background))
+                for side in ("LEFT", "RIGHT", "TOP", "BOTTOM"):
+                    commands.append((f"{side}PADDING", (x, y), (x + span - 1, y), padding))
+                border = (cell_declarations.get("border-bottom") or "").split()
+                if border and _color(border[-1]) is not None:
+                    commands.append(("LINEBELOW", (x, y), (x + span - 1, y), _length(border[0]) or PX,
+                                     _color(border[-1])))
+                if span > 1:
+                    commands.append(("SPAN", (x, y), (x + span - 1, y)))
+                line.extend([""] * (span - 1))
+                x += span
+            line.extend([""] * (columns - x))
+            data.append(line)
+            background = _color(row_declarations.get("background-color"))
+            if background is not None:
+                commands.insert(0, ("BACKGROUND", (0, y), (-1, y), background))
+        table = Table(data, colWidths=widths, repeatRows=header_rows, hAlign="LEFT")
+        table.setStyle(TableStyle(commands))
+        size = float(declarations["font-size"][:-2])
+        table.spaceAfter = _length(self.rules.get("table", {}).get("margin-bottom"), size) or 0
+        return table
+
+    def _column_widths(self, cells, columns):
+        """Column widths of a full-width table, shared out like CSS automatic table layout."""
+        minimum, preferred = [0.0] * columns, [0.0] * columns
+        for row in cells:
+            x = 0
+            for cell, declarations in row:
+                span = int(cell.attrs.get("colspan") or 1)
+                if span == 1:
+                    size = float(declarations["font-size"][:-2])
+                    font = "Helvetica-Bold" if _bold(declarations) else "Helvetica"
+                    padding = 2 * (_length((declarations.get("padding") or "0").split()[0], size) or 0)
+                    words = cell.text().split() or [""]
+                    minimum[x] = max(minimum[x], max(stringWidth(word, font, size) for word in words) + padding)
+                    preferred[x] = max(preferred[x], stringWidth(" ".join(words), font, size) + padding)
+                x += span
+        if sum(minimum) >= self.width:
+            return [width * self.width / sum(minimum) for width in minimum]
+        if sum(preferred) <= self.width:
+            total = sum(preferred) or columns
+            return [(width or 1) * self.width / total for width in preferred]
+        extra = [p - m for p, m in zip(preferred, minimum)]
+        spare = self.width - sum(minimum)
+        return [m + spare * e / (sum(extra) or 1) for m, e in zip(minimum, extra)]
+
+
+def _page_size(options):
+    size = {"A3": pagesizes.A3, "A4": pagesizes.A4, "A5": pagesizes.A5, "Letter": pagesizes.LETTER,
+            "Legal": pagesizes.LEGAL, "Tabloid": pagesizes.TABLOID}[options.format]
+    return pagesizes.landscape(size) if options.landscape else pagesizes.portrait(size)
+
+
+def _content(value):
+    """Text of a CSS ``content`` value and whether it ends with the page counter."""
+    return "".join(re.findall(r'"([^"]*)"', value or "")), "counter(page)" in (value or "")
+
+
+def _footer(page_rule, margin):
+    """Page callback drawing the bottom margin boxes of the page rule."""
+    left = page_rule["boxes"].get("bottom-left", {})
+    right = page_rule["boxes"].get("bottom-right", {})
+
+    def draw(canvas, doc):
+        width = doc.pagesize[0] - 2 * margin
+        canvas.saveState()
+        for box, x, box_width, align in ((left, margin, width * 0.7, "left"), (right, margin + width * 0.7,
+                                                                                width * 0.3, "right")):
+            text, counter = _content(box.get("content"))
+            if counter:
+                text += str(canvas.getPageNumber())
+            if not text:
+                continue
+            size = _length(box.get("font-size")) or 9.0
+            height = min(_length(box.get("height")) or size * 2, margin)
+            y = (margin - height) / 2
+            background = _color(box.get("background") or box.get("background-color"))
+            if background is not None:
+                canvas.setFillColor(background)
+                canvas.rect(x, y, box_width, height, stroke=0, fill=1)
+            canvas.setFillColor(_color(box.get("color")) or colors.black)
+            canvas.setFont("Helvetica", size)
+            baseline = y + (height - size * 0.7) / 2
+            if align == "left":
+                canvas.drawString(x + (_length(box.get("padding-left")) or 0), baseline, text)
+            else:
+                canvas.drawRightString(x + box_width - (_length(box.get("padding-right")) or 0), baseline, text)
+        canvas.restoreState()
+
+    return draw
+
+
+def _build_pdf(html_content, options, image):
+    builder = _TreeBuilder()
+    builder.feed(html_content)
+    builder.close()
+    css = "".join(builder.css)
+    rules = _css_rules(css)
+    page_width, page_height = _page_size(options)
+    # Content pages follow the templates' "with-footer" page; like in Chromium,
+    # @page margins take precedence over the print margins
+    page_rule = _page_rule(css, "with-footer") or {"margin": "0", "boxes": {}}
+    margin = _length(page_rule["margin"].split()[0]) or 0
+    layout = _Layout(rules, image, page_width - 2 * margin)
+    body = builder.root.find("body") or builder.root
+    inherited = {key: value for key, value in rules.get("body", {}).items() if key in _INHERITED}
+    layout.block(body, {**inherited, "font-size": f"{BASE_FONT_SIZE}pt"})
+    if not layout.story:
+        layout.story.append(Spacer(1, 0))
+
+    output = io.BytesIO()
+    doc = BaseDocTemplate(output, pagesize=(page_width, page_height), title=" ".join(builder.title.split()),
+                          leftMargin=0, rightMargin=0, topMargin=0, bottomMargin=0)
+    templates = {
+        "full": PageTemplate("full", frames=[Frame(0, 0, page_width, page_height, 0, 0, 0, 0, id="full")]),
+        "content": PageTemplate("content", frames=[Frame(margin, margin, page_width - 2 * margin,
+                                                         page_height - 2 * margin, 0, 0, 0, 0, id="content")],
+                                onPageEnd=_footer(page_rule, margin)),
+    }
+    first = layout.first_template or "content"
+    doc.addPageTemplates([templates[first]] + [template for name, template in templates.items() if name != first])
+    doc.build(layout.story)
+    return output.getvalue()
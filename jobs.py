@@ -0,0 +1,407 @@
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+import urllib.parse
+import urllib.request
+import uuid
+
+from render_options import DEFAULT_RENDER_OPTIONS, RenderOptions
+
+JOB_BACKEND = os.environ.get("PDF_JOB_BACKEND", "memory")
+JOB_DB_PATH = os.environ.get("PDF_JOB_DB", "jobs.sqlite3")
+JOB_WORKERS = int(os.environ.get("PDF_JOB_WORKERS", "4"))
+JOB_MAX_QUEUED = int(os.environ.get("PDF_JOB_MAX_QUEUED", "100"))
+JOB_RESULT_TTL_SECONDS = int(os.environ.get("PDF_JOB_RESULT_TTL_SECONDS", "3600"))
+WEBHOOK_TIMEOUT_SECONDS = 10
+# Hosts webhook callbacks may be sent to, e.g. "hooks.example.com,crm.internal" (empty = any host)
+WEBHOOK_HOSTS = {host.strip().lower() for host in os.environ.get("PDF_WEBHOOK_HOSTS", "").split(",") if host.strip()}
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class QueueFullError(Exception):
+    """Raised when a job is rejected by admission control."""
+
+    def __init__(self, retry_after):
+        super().__init__("Job queue is full")
+        self.retry_after = retry_after
+
+
+class Job:
+    """A queued report render and its outcome."""
+
+    def __init__(self, template, data, ready_mode, priority=0, webhook_url=None, job_id=None, optimize="none",
+                 options=DEFAULT_RENDER_OPTIONS, engine="browser"):
+        self.id = job_id or uuid.uuid4().hex
+        self.template = template
+        self.data = data
+        self.ready_mode = ready_mode
+        self.optimize = optimize
+        self.options = options
+        self.engine = engine
+        self.priority = priority
+        self.webhook_url = webhook_url
+        self.status = QUEUED
+        self.error = None
+        self.pdf_size = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def to_dict(self):
+        """Public status representation (without the payload)."""
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "template": self.template,
+            "optimize": self.optimize,
+            "engine": self.engine,
+            "priority": self.priority,
+            "error": self.error,
+            "pdf_size": self.pdf_size,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class MemoryJobBackend:
+    """In-process job store; jobs are lost when the process exits."""
+
+    def __init__(self):
+        self.jobs = {}
+        self.results = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = asyncio.Condition()
+
+    async def submit(self, job):
+        async with self._cond:
+            self.jobs[job.id] = job
+            # Higher priority first, FIFO within a priority
+            heapq.heappush(self._heap, (-job.priority, next(self._seq), job.id))
+            self._cond.notify()
+
+    async def next_job(self):
+        """Wait for the highest-priority queued job and mark it running."""
+        async with self._cond:
+            while not self._heap:
+                await self._cond.wait()
+            _, _, job_id = heapq.heappop(self._heap)
+            job = self.jobs[job_id]
+            job.status = RUNNING
+            job.started_at = time.time()
+            return job
+
+    async def finish(self, job, pdf_bytes=None):
+        if pdf_bytes is not None:
+            self.results[job.id] = pdf_bytes
+
+    async def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    async def get_pdf(self, job_id):
+        return self.results.get(job_id)
+
+    async def depth(self):
+        return len(self._heap)
+
+    async def purge(self, older_than):
+        """Drop finished jobs (and their PDFs) finished before ``older_than``."""
+        expired = [job_id for job_id, job in self.jobs.items()
+                   if job.finished_at is not None and job.finished_at < older_than]
+        for job_id in expired:
+            self.jobs.pop(job_id, None)
+            self.results.pop(job_id, None)
+        return len(expired)
+
+    async def close(self):
+        pass
+
+
+class SQLiteJobBackend:
+    """Job store in a local SQLite file, surviving restarts of the process.
+
+    Jobs that were running when the process stopped are queued again on start.
+    """
+
+    def __init__(self, path=JOB_DB_PATH, poll_interval=1.0):
+        self.path = path
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._wakeup = asyncio.Event()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, status TEXT NOT NULL, priority INTEGER NOT NULL,"
+            " created_at REAL NOT NULL, started_at REAL, finished_at REAL,"
+            " template TEXT NOT NULL, ready_mode TEXT NOT NULL, data TEXT NOT NULL,"
+            " webhook_url TEXT, error TEXT, pdf_size INTEGER, pdf BLOB,"
+            " optimize TEXT NOT NULL DEFAULT 'none', render_options TEXT, engine TEXT NOT NULL DEFAULT 'browser')"
+        )
+        # Columns added since the table was first created, for existing databases
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        for column, definition in (("optimize", "TEXT NOT NULL DEFAULT 'none'"), ("render_options", "TEXT"),
+                                   ("engine", "TEXT NOT NULL DEFAULT 'browser'")):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {definition}")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, priority DESC, created_at)")
+        self._conn.execute("UPDATE jobs SET status = ?, started_at = NULL WHERE status = ?", (QUEUED, RUNNING))
+        self._conn.commit()
+
+    def _execute(self, sql, params=(), fetch=None):
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            result = cursor.fetchone() if fetch == "one" else cursor.fetchall() if fetch == "all" else cursor.rowcount
+            self._conn.commit()
+            return result
+
+    @staticmethod
+    def _row_to_job(row):
+        (job_id, status, priority, created_at, started_at, finished_at,
+         template, ready_mode, data, webhook_url, error, pdf_size, optimize, render_options, engine) = row
+        options = RenderOptions.model_validate_json(render_options) if render_options else DEFAULT_RENDER_OPTIONS
+        job = Job(template, json.loads(data), ready_mode, priority, webhook_url, job_id, optimize, options, engine)
+        job.status = status
+        job.created_at = created_at
+        job.started_at = started_at
+        job.finished_at = finished_at
+        job.error = error
+        job.pdf_size = pdf_size
+        return job
+
+    _COLUMNS = ("id, status, priority, created_at, started_at, finished_at,"
+                " template, ready_mode, data, webhook_url, error, pdf_size, optimize, render_options, engine")
+
+    async def submit(self, job):
+        await asyncio.to_thread(
+            self._execute,
+            "INSERT INTO jobs (id, status, priority, created_at, template, ready_mode, data, webhook_url, optimize,"
+            " render_options, engine) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job.id, job.status, job.priority, job.created_at, job.template, job.ready_mode,
+             json.dumps(job.data), job.webhook_url, job.optimize, job.options.model_dump_json(), job.engine),
+        )
+        self._wakeup.set()
+
+    def _claim(self):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {self._COLUMNS} FROM jobs WHERE status = ?"
+                " ORDER BY priority DESC, created_at LIMIT 1", (QUEUED,)
+            ).fetchone()
+            if row is None:
+                return None
+            started_at = time.time()
+            # Guard on status so that two processes sharing the file never claim the same job
+            claimed = self._conn.execute(
+                "UPDATE jobs SET status = ?, started_at = ? WHERE id = ? AND status = ?",
+                (RUNNING, started_at, row[0], QUEUED),
+            ).rowcount
+            self._conn.commit()
+            if not claimed:
+                return None
+        job = self._row_to_job(row)
+        job.status = RUNNING
+        job.started_at = started_at
+        return job
+
+    async def next_job(self):
+        """Wait for the highest-priority queued job and mark it running."""
+        while True:
+            job = await asyncio.to_thread(self._claim)
+            if job is not None:
+                return job
+            self._wakeup.clear()
+            try:
+                # Poll as well, in case another process queued a job
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def finish(self, job, pdf_bytes=None):
+        await asyncio.to_thread(
+            self._execute,
+            "UPDATE jobs SET status = ?, finished_at = ?, error = ?, pdf_size = ?, pdf = ? WHERE id = ?",
+            (job.status, job.finished_at, job.error, job.pdf_size, pdf_bytes, job.id),
+        )
+
+    async def get(self, job_id):
+        row = await asyncio.to_thread(self._execute, f"SELECT {self._COLUMNS} FROM jobs WHERE id = ?", (job_id,), "one")
+        return self._row_to_job(row) if row else None
+
+    async def get_pdf(self, job_id):
+        row = await asyncio.to_thread(self._execute, "SELECT pdf FROM jobs WHERE id = ?", (job_id,), "one")
+        return row[0] if row else None
+
+    async def depth(self):
+        row = await asyncio.to_thread(self._execute, "SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,), "one")
+        return row[0]
+
+    async def purge(self, older_than):
+        return await asyncio.to_thread(
+            self._execute, "DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (older_than,))
+
+    async def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+JOB_BACKENDS = {
+    "memory": MemoryJobBackend,
+    "sqlite": SQLiteJobBackend,
+}
+
+
+def create_job_backend(name=JOB_BACKEND):
+    """Instantiate a job backend by name ('memory' or 'sqlite')."""
+    if name not in JOB_BACKENDS:
+        raise ValueError(f"Invalid job backend '{name}'. Must be one of: {', '.join(JOB_BACKENDS)}")
+    return JOB_BACKENDS[name]()
+
+
+def validate_webhook_url(url, allowed_hosts=WEBHOOK_HOSTS):
+    """Check a client-supplied webhook URL before a job is queued.
+
+    Only http(s) URLs with a host, and with PDF_WEBHOOK_HOSTS set only those
+    hosts, are accepted, so clients can't make the server fetch local files
+    or arbitrary internal services. Raises ValueError otherwise.
+    """
+    if not isinstance(url, str):
+        raise ValueError("Invalid webhook_url. Must be a string")
+    parsed = urllib.parse.urlsplit(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise ValueError("Invalid webhook_url. Must be an http or https URL with a host")
+    if allowed_hosts and parsed.hostname.lower() not in allowed_hosts:
+        raise ValueError(f"Invalid webhook_url. Host '{parsed.hostname}' is not allowed")
+    return url
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # A redirect could point the callback at a host or scheme the URL check never saw
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+_webhook_opener = urllib.request.build_opener(_NoRedirect)
+
+
+def _post_webhook(url, payload):
+    request = urllib.request.Request(
+        url, data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"}, method="POST",
+    )
+    with _webhook_opener.open(request, timeout=WEBHOOK_TIMEOUT_SECONDS) as response:
+        return response.status
+
+
+class JobQueue:
+    """Bounded job queue feeding a pool of render workers."""
+
+    def __init__(self, render, backend=None, workers=JOB_WORKERS, max_queued=JOB_MAX_QUEUED,
+                 result_ttl=JOB_RESULT_TTL_SECONDS):
+        """Initialize the queue.
+
+        ``render(job)`` is a coroutine returning the PDF bytes for a job (or
+        None on failure).
+        """
+        self.render = render
+        self.backend = backend
+        self.workers = max(1, workers)
+        self.max_queued = max_queued
+        self.result_ttl = result_ttl
+        self._tasks = []
+        self._durations = []
+        self.stats = {"queued": 0, "submitted": 0, "rejected": 0, "done": 0, "failed": 0}
+
+    def _average_duration(self):
+        return sum(self._durations) / len(self._durations) if self._durations else 5.0
+
+    async def submit(self, job):
+        """Queue a job, or raise QueueFullError if the queue is at capacity."""
+        depth = await self.backend.depth()
+        self.stats["queued"] = depth
+        if depth >= self.max_queued:
+            self.stats["rejected"] += 1
+            # Estimate when a slot frees up from recent job durations
+            retry_after = max(1, round(self._average_duration() * (depth - self.max_queued + 1) / self.workers))
+            raise QueueFullError(retry_after)
+        await self.backend.submit(job)
+        self.stats["submitted"] += 1
+        self.stats["queued"] = depth + 1
+        return job
+
+    async def refresh_stats(self):
+        """Update the queued count from the backend and return the stats."""
+        if self.backend is not None:
+            self.stats["queued"] = await self.backend.depth()
+        return self.stats
+
+    async def _notify(self, job, pdf_url):
+        payload = job.to_dict()
+        if job.status == DONE:
+            payload["pdf_url"] = pdf_url
+        try:
+            status = await asyncio.to_thread(_post_webhook, job.webhook_url, payload)
+            print(f"Webhook for job {job.id} delivered ({status})")
+        except Exception as e:
+            print(f"Warning: webhook for job {job.id} failed: {e}")
+
+    async def _run(self, job):
+        pdf_bytes = None
+        try:
+            pdf_bytes = await self.render(job)
+            if pdf_bytes:
+                job.status = DONE
+                job.pdf_size = len(pdf_bytes)
+            else:
+                job.status = FAILED
+                job.error = "PDF generation failed."
+        except Exception as e:
+            print(f"Error running job {job.id}: {str(e)}")
+            job.status = FAILED
+            job.error = str(e)
+        job.finished_at = time.time()
+        self.stats[job.status] += 1
+        self._durations = (self._durations + [job.finished_at - job.started_at])[-50:]
+        await self.backend.finish(job, pdf_bytes if job.status == DONE else None)
+
+    async def _worker(self, pdf_url_for):
+        while True:
+            job = await self.backend.next_job()
+            await self._run(job)
+            if job.webhook_url:
+                asyncio.create_task(self._notify(job, pdf_url_for(job)))
+
+    async def _purge_loop(self):
+        while True:
+            await asyncio.sleep(60)
+            try:
+                await self.backend.purge(time.time() - self.result_ttl)
+            except Exception as e:
+                print(f"Error purging finished jobs: {str(e)}")
+
+    def start(self, pdf_url_for=lambda job: None):
+        """Start the worker tasks.
+
+        ``pdf_url_for(job)`` builds the result URL sent in webhook callbacks.
+        """
+        if self.backend is None:
+            self.backend = create_job_backend()
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker(pdf_url_for)) for _ in range(self.workers)]
+            self._tasks.append(asyncio.create_task(self._purge_loop()))
+
+    async def stop(self):
+        """Cancel the workers and close the backend."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.backend is not None:
+            await self.backend.close()
@@ -0,0 +1,241 @@
+import asyncio
+import functools
+import io
+import os
+import tempfile
+import time
+
+from render_options import DEFAULT_RENDER_OPTIONS
+from scheduler import RENDER_MEMORY_MB, run_in_slots
+from segments import PdfReader, merge_segments, placeholder_pages, static_marker
+
+# Reports whose holdings tables add up to this many rows are rendered in
+# page-sized chunks instead of one huge document (0 disables it)
+LARGE_REPORT_ROWS = int(os.environ.get("PDF_LARGE_REPORT_ROWS", "300"))
+# Table rows per chunk; a chunk is meant to fill about one A4 page
+LARGE_REPORT_CHUNK_ROWS = int(os.environ.get("PDF_LARGE_REPORT_CHUNK_ROWS", "25"))
+# Per-report budget: the memory budget decides how many chunks are rendered
+# at once (PDF_RENDER_MEMORY_MB each), the time budget replaces the default request deadline
+LARGE_REPORT_MEMORY_MB = int(os.environ.get("PDF_LARGE_REPORT_MEMORY_MB", "1000"))
+LARGE_REPORT_BUDGET_SECONDS = float(os.environ.get("PDF_LARGE_REPORT_BUDGET_SECONDS", "120"))
+
+# Tables that can be split, with the path of their rows in the payload
+CHUNKED_TABLES = {
+    "top_funds": ("investment_products", "mutual_fund", "top_funds"),
+    "pms_funds": ("pms", "funds"),
+    "debt_papers": ("fixed_income_offering", "debt_papers"),
+    "scrips": ("private_equity", "scrips"),
+}
+
+PLACEHOLDER_PAGE = ('<div style="page-break-before: always;">'
+                    '<a href="{href}" style="display: block; width: 100%; height: 10mm;"></a></div>')
+
+
+def table_rows(data, path):
+    """Rows of the table at ``path`` in the payload, or an empty list."""
+    for key in path:
+        data = data.get(key) if isinstance(data, dict) else None
+    return data if isinstance(data, list) else []
+
+
+def with_rows(data, path, rows):
+    """Copy of ``data`` with the table at ``path`` replaced; only the dicts on the path are copied."""
+    head, rest = path[0], path[1:]
+    copy = dict(data)
+    copy[head] = with_rows(data.get(head) or {}, rest, rows) if rest else rows
+    return copy
+
+
+def page_count(pdf_bytes):
+    return len(PdfReader(io.BytesIO(pdf_bytes)).pages)
+
+
+def spool_chunk(directory, name, pdf_bytes):
+    """Write a chunk PDF to ``directory``; returns its path and page count."""
+    path = os.path.join(directory, name.replace("/", "_") + ".pdf")
+    with open(path, "wb") as f:
+        f.write(pdf_bytes)
+    return path, page_count(pdf_bytes)
+
+
+class LargeReportRenderer:
+    """Renders reports with very long tables as page-sized chunks merged into one PDF.
+
+    The report is rendered with each long table cut to its first chunk and
+    followed by placeholder pages. The remaining chunks are rendered in
+    parallel as documents holding only the table (header row included, on
+    the section's page style) and replace the placeholders, so no single
+    page ever lays out more than a chunk of rows. Finished chunks are
+    spooled to temporary files until the merge.
+
+    The caller's render slot covers one chunk at a time; with a scheduler,
+    every further chunk in parallel holds a slot of its own, so a large
+    report can't take more pages than the scheduler admits.
+    """
+
+    def __init__(self, generator, pool, static_pages=None, threshold=LARGE_REPORT_ROWS,
+                 chunk_rows=LARGE_REPORT_CHUNK_ROWS, memory_mb=LARGE_REPORT_MEMORY_MB, scheduler=None):
+        """Initialize the renderer for a BrowserPDFGenerator, BrowserPool, optional StaticPageCache and RenderScheduler."""
+        self.generator = generator
+        self.pool = pool
+        self.static_pages = static_pages
+        self.scheduler = scheduler
+        self.threshold = threshold
+        self.chunk_rows = max(1, chunk_rows)
+        self.concurrency = max(1, memory_mb // RENDER_MEMORY_MB)
+        self.stats = {"reports": 0, "chunks": 0, "chunks_rerendered": 0, "fallbacks": 0}
+        if threshold > 0 and PdfReader is None:
+            print("pypdf is not installed. Large reports are rendered as one document; run 'pip install pypdf' to render them in chunks.")
+
+    @property
+    def enabled(self):
+        return self.threshold > 0 and PdfReader is not None
+
+    @property
+    def version(self):
+        """Suffix for cache keys; the chunk size changes where pages break."""
+        return f":large{self.chunk_rows}"
+
+    def applies(self, data):
+        """Whether the report has enough table rows to be rendered in chunks."""
+        if not self.enabled:
+            return False
+        return sum(len(table_rows(data, path)) for path in CHUNKED_TABLES.values()) >= self.threshold
+
+    def split(self, data):
+        """Cut the long tables of a report into chunks.
+
+        Returns the data with every long table cut to its first chunk, and
+        ``{name: (table, rows)}`` for the remaining chunks in page order.
+        """
+        report_data = data
+        chunks = {}
+        for table, path in CHUNKED_TABLES.items():
+            rows = table_rows(data, path)
+            if len(rows) <= self.chunk_rows:
+                continue
+            report_data = with_rows(report_data, path, rows[:self.chunk_rows])
+            for index, start in enumerate(range(self.chunk_rows, len(rows), self.chunk_rows), start=1):
+                chunks[f"{table}/{index}"] = (table, rows[start:start + self.chunk_rows])
+        return report_data, chunks
+
+    async def _render_report(self, template_name, data, ready_mode, timings, options):
+        if self.static_pages is not None and self.static_pages.enabled:
+            return await self.static_pages.render(template_name, data, ready_mode, timings, options)
+        html_content = self.generator.render_html(template_name, data, timings=timings)
+        if html_content is None:
+            return None
+        return await self.pool.render_pdf(html_content, ready_mode=ready_mode, timings=timings, options=options)
+
+    async def _render_with_placeholders(self, template_name, data, chunks, pages, ready_mode, timings, options):
+        """Render the report with ``pages[name]`` placeholder pages per chunk.
+
+        Returns the PDF and the page number of each placeholder found in it.
+        """
+        def table_continuation(table):
+            html = []
+            for name, (chunk_table, _) in chunks.items():
+                if chunk_table == table:
+                    html.extend(PLACEHOLDER_PAGE.format(href=static_marker(name if extra == 0 else f"{name}+{extra}"))
+                                for extra in range(pages[name]))
+            return "\n".join(html)
+
+        pdf_bytes = await self._render_report(template_name, {**data, "table_continuation": table_continuation},
+                                              ready_mode, timings, options)
+        if not pdf_bytes:
+            return None, {}
+        return pdf_bytes, await asyncio.to_thread(placeholder_pages, pdf_bytes)
+
+    async def _render_chunk(self, template_name, table, rows, page_start, ready_mode, blur_funds, options):
+        # Only this table's section has content; the others are empty, as the templates expect them
+        data = {path[0]: {} for path in CHUNKED_TABLES.values()}
+        data.update(table_chunk=table, page_start=page_start, blur_funds=blur_funds)
+        data = with_rows(data, CHUNKED_TABLES[table], rows)
+        # Static pages are hidden in chunks; markers keep their images from loading
+        html_content = self.generator.render_html(template_name, data, static_page=static_marker)
+        if html_content is None:
+            return None
+        return await self.pool.render_pdf(html_content, ready_mode=ready_mode, options=options)
+
+    async def _render_chunks(self, template_name, chunks, names, positions, ready_mode, blur_funds, options, spool,
+                             deadline=None):
+        """Render the named chunks, at most ``concurrency`` at once, and spool them to ``spool``.
+
+        See run_in_slots for how the chunks share the scheduler. Returns
+        ``{name: (path, page count)}``, or None if a chunk failed.
+        """
+        async def render_one(name):
+            table, rows = chunks[name]
+            pdf_bytes = await self._render_chunk(template_name, table, rows, positions[name], ready_mode, blur_funds,
+                                                 options)
+            if not pdf_bytes:
+                return None
+            return await asyncio.to_thread(spool_chunk, spool, name, pdf_bytes)
+
+        spooled = await run_in_slots(self.scheduler, [functools.partial(render_one, name) for name in names],
+                                     self.concurrency, deadline)
+        if not all(spooled):
+            return None
+        return dict(zip(names, spooled))
+
+    async def render(self, template_name, data, ready_mode, timings, options=DEFAULT_RENDER_OPTIONS, deadline=None):
+        """Render a large report and return the merged PDF bytes, or None on failure.
+
+        Chunks are numbered from the page of their placeholder, assuming one
+        page per chunk. If a chunk overflows, the report and the chunks after
+        it are rendered again with the real page counts. Falls back to a
+        single document if the template has no table placeholders. Chunks
+        don't wait for extra scheduler slots past ``deadline`` (event-loop time).
+        """
+        report_data, chunks = self.split(data)
+        if not chunks:
+            return await self._render_report(template_name, data, ready_mode, timings, options)
+        self.stats["reports"] += 1
+        blur_funds = data.get("blur_funds", False)
+
+        pages = dict.fromkeys(chunks, 1)
+        report_pdf, positions = await self._render_with_placeholders(template_name, report_data, chunks, pages,
+                                                                     ready_mode, timings, options)
+        if not report_pdf:
+            return None
+        if any(name not in positions for name in chunks):
+            print("Warning: table placeholders not found, rendering the large report as one document")
+            self.stats["fallbacks"] += 1
+            return await self._render_report(template_name, data, ready_mode, timings, options)
+        with tempfile.TemporaryDirectory(prefix="pdf-chunks-") as spool:
+            start = time.perf_counter()
+            rendered = await self._render_chunks(template_name, chunks, list(chunks), positions, ready_mode,
+                                                 blur_funds, options, spool, deadline)
+            if rendered is None:
+                return None
+            self.stats["chunks"] += len(chunks)
+            counts = {name: count for name, (_, count) in rendered.items()}
+            if counts != pages:
+                pages = counts
+                report_pdf, moved = await self._render_with_placeholders(template_name, report_data, chunks, pages,
+                                                                         ready_mode, timings, options)
+                if not report_pdf or any(name not in moved for name in chunks):
+                    return None
+                shifted = [name for name in chunks if moved[name] != positions[name]]
+                rerendered = await self._render_chunks(template_name, chunks, shifted, moved, ready_mode, blur_funds,
+                                                       options, spool, deadline)
+                if rerendered is None:
+                    return None
+                rendered.update(rerendered)
+                self.stats["chunks_rerendered"] += len(shifted)
+            timings["chunk_render"] = time.perf_counter() - start
+
+            fragments = {}
+            for name, (path, _) in rendered.items():
+                fragments[name] = path
+                fragments.update((f"{name}+{extra}", None) for extra in range(1, pages[name]))
+            start = time.perf_counter()
+            pdf_bytes = await asyncio.to_thread(merge_segments, report_pdf, fragments)
+            timings["merge"] = timings.get("merge", 0.0) + time.perf_counter() - start
+        print(f"Merged {len(chunks)} table chunks: {len(report_pdf)} -> {len(pdf_bytes)} bytes")
+        return pdf_bytes
+
+    def snapshot(self):
+        """Configuration and chunk counters."""
+        return {**self.stats, "enabled": self.enabled, "threshold_rows": self.threshold,
+                "chunk_rows": self.chunk_rows, "concurrency": self.concurrency}
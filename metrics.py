@@ -0,0 +1,173 @@
+import bisect
+import json
+import os
+import time
+
+# Print one JSON line with the stage timings of every PDF request
+TIMING_LOG = os.environ.get("PDF_TIMING_LOG", "false").lower() in ("1", "true", "yes")
+
+# Stages recorded in the per-request timings dict, in pipeline order
+STAGES = ("parse", "validate", "queue_wait", "template_render", "asset_resolve", "browser_acquire",
+          "set_content", "ready_wait", "page_pdf", "chunk_render", "section_render", "lite_render", "merge", "optimize",
+          "response_write")
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+REQUEST_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Responses whose write time is recorded as the response_write stage
+_DOCUMENT_TYPES = (b"application/pdf", b"application/zip", b"multipart/mixed")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+               for value in labels.values())
+    return "{" + ",".join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + "}"
+
+
+class Histogram:
+    """Cumulative Prometheus histogram, optionally split by a single label."""
+
+    def __init__(self, name, help, label=None, buckets=STAGE_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = tuple(buckets)
+        self._series = {}
+
+    def observe(self, seconds, label_value=None):
+        series = self._series.get(label_value)
+        if series is None:
+            series = self._series[label_value] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+        index = bisect.bisect_left(self.buckets, seconds)
+        if index < len(self.buckets):
+            series["counts"][index] += 1
+        series["sum"] += seconds
+        series["count"] += 1
+
+    def samples(self):
+        for label_value, series in sorted(self._series.items(), key=lambda item: str(item[0])):
+            labels = {self.label: label_value} if self.label else {}
+            cumulative = 0
+            for bound, count in zip(self.buckets, series["counts"]):
+                cumulative += count
+                yield f"{self.name}_bucket", {**labels, "le": f"{bound:g}"}, cumulative
+            yield f"{self.name}_bucket", {**labels, "le": "+Inf"}, series["count"]
+            yield f"{self.name}_sum", labels, round(series["sum"], 6)
+            yield f"{self.name}_count", labels, series["count"]
+
+
+class MetricsRegistry:
+    """Histograms recorded by the app plus collectors read at scrape time.
+
+    A collector is a function returning ``(name, type, help, labels, value)``
+    tuples, typically derived from the stats dicts the components already keep.
+    """
+
+    def __init__(self):
+        self.histograms = []
+        self.collectors = []
+        self.stages = self.histogram("pdf_stage_seconds", "Time spent in each stage of a PDF request", label="stage")
+        self.requests = self.histogram("pdf_http_request_seconds", "HTTP request duration by route",
+                                       label="route", buckets=REQUEST_BUCKETS)
+
+    def histogram(self, name, help, label=None, buckets=STAGE_BUCKETS):
+        histogram = Histogram(name, help, label, buckets)
+        self.histograms.append(histogram)
+        return histogram
+
+    def collector(self, collect):
+        """Register a scrape-time collector (usable as a decorator)."""
+        self.collectors.append(collect)
+        return collect
+
+    def observe_timings(self, timings):
+        """Record every known stage of a per-request timings dict."""
+        for stage in STAGES:
+            if stage in timings:
+                self.stages.observe(timings[stage], stage)
+
+    def snapshot(self):
+        """All metric families as a JSON-serializable dict."""
+        families = {}
+        for histogram in self.histograms:
+            families[histogram.name] = {"type": "histogram", "help": histogram.help,
+                                        "samples": list(histogram.samples())}
+        for collect in self.collectors:
+            try:
+                for name, metric_type, help, labels, value in collect():
+                    family = families.setdefault(name, {"type": metric_type, "help": help, "samples": []})
+                    family["samples"].append((name, labels, value))
+            except Exception as e:
+                print(f"Error collecting metrics: {str(e)}")
+        return families
+
+
+def render_prometheus(snapshots):
+    """Render ``{source: snapshot}`` in the Prometheus text format.
+
+    With more than one source every sample gets a ``worker`` label.
+    """
+    merged = {}
+    for source, families in snapshots.items():
+        for name, family in families.items():
+            target = merged.setdefault(name, {"type": family["type"], "help": family["help"], "samples": []})
+            for sample_name, labels, value in family["samples"]:
+                if len(snapshots) > 1:
+                    labels = {"worker": source, **labels}
+                target["samples"].append((sample_name, labels, value))
+    lines = []
+    for name in sorted(merged):
+        family = merged[name]
+        lines.append(f"# HELP {name} {family['help']}")
+        lines.append(f"# TYPE {name} {family['type']}")
+        for sample_name, labels, value in family["samples"]:
+            lines.append(f"{sample_name}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def server_timing(timings):
+    """``Server-Timing`` header value for the recorded stages."""
+    return ", ".join(f"{stage};dur={timings[stage] * 1000:.1f}" for stage in STAGES if stage in timings)
+
+
+def log_timings(event, timings, **fields):
+    """Print a structured timing line when PDF_TIMING_LOG is enabled."""
+    if TIMING_LOG:
+        spans = {stage: round(timings[stage] * 1000, 2) for stage in STAGES if stage in timings}
+        print(json.dumps({"event": event, **fields, "timings_ms": spans}))
+
+
+class TimingMiddleware:
+    """ASGI middleware timing each request and the write of document responses.
+
+    The request start is stored as ``request.state.request_start`` so
+    handlers can time body parsing.
+    """
+
+    def __init__(self, app, registry):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        scope.setdefault("state", {})["request_start"] = start
+        response = {}
+
+        async def timed_send(message):
+            if message["type"] == "http.response.start":
+                response["start"] = time.perf_counter()
+                content_type = dict(message.get("headers", [])).get(b"content-type", b"")
+                response["document"] = content_type.startswith(_DOCUMENT_TYPES)
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body") and response.get("document"):
+                self.registry.stages.observe(time.perf_counter() - response["start"], "response_write")
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            route = getattr(scope.get("route"), "path", "other")
+            self.registry.requests.observe(time.perf_counter() - start, route)
@@ -0,0 +1,230 @@
+import asyncio
+import hashlib
+import io
+import math
+import os
+import time
+
+try:
+    import pikepdf
+except ImportError:
+    pikepdf = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Post-processing of rendered PDFs, selectable per request:
+#   none  - the PDF is sent as printed by Chromium
+#   fast  - identical streams (the logo on every section, images and fonts
+#           repeated by merged pages) are stored once, object streams are
+#           compressed and the file is linearized for fast web view
+#   small - fast, plus images are downsampled to PDF_OPTIMIZE_DPI for the
+#           size they are printed at and recompressed as JPEG
+OPTIMIZE_MODES = ("none", "fast", "small")
+OPTIMIZE_MODE = os.environ.get("PDF_OPTIMIZE", "none")
+OPTIMIZE_DPI = int(os.environ.get("PDF_OPTIMIZE_DPI", "150"))
+OPTIMIZE_JPEG_QUALITY = int(os.environ.get("PDF_OPTIMIZE_JPEG_QUALITY", "80"))
+
+# Images are only resampled when they are this much larger than needed
+RESAMPLE_THRESHOLD = 1.25
+# Nested form XObjects followed when measuring where images are drawn
+MAX_FORM_DEPTH = 8
+
+
+def _stream_key(stream):
+    """Digest of a stream's data and dictionary, equal for interchangeable streams."""
+    header = pikepdf.Dictionary({key: value for key, value in stream.stream_dict.items() if key != "/Length"})
+    return hashlib.sha256(header.unparse() + b"\0" + stream.read_raw_bytes()).digest()
+
+
+def _replace_references(pdf, replacements):
+    """Point every reference to an object in ``replacements`` at its replacement."""
+    def visit(container):
+        keys = range(len(container)) if isinstance(container, pikepdf.Array) else list(container.keys())
+        for key in keys:
+            value = container[key]
+            if not isinstance(value, pikepdf.Object):
+                continue
+            if value.is_indirect:
+                if value.objgen in replacements:
+                    container[key] = replacements[value.objgen]
+            elif isinstance(value, (pikepdf.Array, pikepdf.Dictionary)):
+                visit(value)
+
+    for obj in pdf.objects:
+        if isinstance(obj, (pikepdf.Array, pikepdf.Dictionary, pikepdf.Stream)):
+            visit(obj)
+
+
+def dedupe_streams(pdf):
+    """Store identical streams once and return how many copies were dropped.
+
+    Runs until nothing changes, since streams referring to duplicates (e.g.
+    images sharing a soft mask) only become identical once those are merged.
+    """
+    # Dropped copies stay in the object table until the file is saved
+    dropped = set()
+    while True:
+        canonical = {}
+        replacements = {}
+        for obj in pdf.objects:
+            if isinstance(obj, pikepdf.Stream) and obj.objgen not in dropped:
+                first = canonical.setdefault(_stream_key(obj), obj)
+                if first.objgen != obj.objgen:
+                    replacements[obj.objgen] = first
+        if not replacements:
+            return len(dropped)
+        _replace_references(pdf, replacements)
+        dropped.update(replacements)
+
+
+def _multiply(m, n):
+    """Product of two PDF matrices ``[a b c d e f]``, ``m`` applied first."""
+    return [m[0] * n[0] + m[1] * n[2], m[0] * n[1] + m[1] * n[3],
+            m[2] * n[0] + m[3] * n[2], m[2] * n[1] + m[3] * n[3],
+            m[4] * n[0] + m[5] * n[2] + n[4], m[4] * n[1] + m[5] * n[3] + n[5]]
+
+
+def image_placements(pdf):
+    """Largest printed size in points of every image, keyed by object id."""
+    sizes = {}
+
+    def walk(content, resources, ctm, depth):
+        xobjects = resources.get("/XObject", {}) if resources is not None else {}
+        stack = []
+        for operands, operator in pikepdf.parse_content_stream(content):
+            op = str(operator)
+            if op == "q":
+                stack.append(ctm)
+            elif op == "Q" and stack:
+                ctm = stack.pop()
+            elif op == "cm":
+                ctm = _multiply([float(value) for value in operands], ctm)
+            elif op == "Do" and operands[0] in xobjects:
+                xobject = xobjects[operands[0]]
+                if xobject.get("/Subtype") == "/Image":
+                    width, height = math.hypot(ctm[0], ctm[1]), math.hypot(ctm[2], ctm[3])
+                    known = sizes.get(xobject.objgen, (0, 0))
+                    sizes[xobject.objgen] = (max(known[0], width), max(known[1], height))
+                elif xobject.get("/Subtype") == "/Form" and depth < MAX_FORM_DEPTH:
+                    matrix = [float(value) for value in xobject.get("/Matrix", [1, 0, 0, 1, 0, 0])]
+                    walk(xobject, xobject.get("/Resources", resources), _multiply(matrix, ctm), depth + 1)
+
+    for page in pdf.pages:
+        walk(page, page.obj.get("/Resources"), [1, 0, 0, 1, 0, 0], 0)
+    return sizes
+
+
+def downsample_images(pdf, dpi=OPTIMIZE_DPI, quality=OPTIMIZE_JPEG_QUALITY):
+    """Downsample images printed above ``dpi`` and store them as JPEG.
+
+    Images with masks or unusual color spaces are left alone. Returns the
+    number of images replaced.
+    """
+    replaced = 0
+    for objgen, (width_pt, height_pt) in image_placements(pdf).items():
+        image = pdf.get_object(objgen)
+        if image.get("/ImageMask") or "/Mask" in image or image.get("/BitsPerComponent") != 8:
+            continue
+        width, height = int(image.Width), int(image.Height)
+        target = (max(1, round(width_pt / 72 * dpi)), max(1, round(height_pt / 72 * dpi)))
+        if width < target[0] * RESAMPLE_THRESHOLD and height < target[1] * RESAMPLE_THRESHOLD:
+            continue
+        try:
+            pil_image = pikepdf.PdfImage(image).as_pil_image()
+        except Exception:
+            continue
+        if pil_image.mode not in ("RGB", "L"):
+            continue
+        target = (min(width, target[0]), min(height, target[1]))
+        output = io.BytesIO()
+        pil_image.resize(target, Image.LANCZOS).save(output, "JPEG", quality=quality, optimize=True)
+        if len(output.getvalue()) >= len(image.read_raw_bytes()):
+            continue
+        image.write(output.getvalue(), filter=pikepdf.Name.DCTDecode)
+        image.Width, image.Height = target
+        for key in ("/DecodeParms", "/Decode"):
+            if key in image:
+                del image[key]
+        replaced += 1
+    return replaced
+
+
+def optimize_pdf(pdf_bytes, mode, dpi=OPTIMIZE_DPI, quality=OPTIMIZE_JPEG_QUALITY):
+    """Optimize a PDF and return ``(pdf_bytes, stats)``.
+
+    The input is returned unchanged if optimizing doesn't make it smaller.
+    """
+    stats = {"bytes_before": len(pdf_bytes), "streams_deduplicated": 0, "images_resampled": 0}
+    with pikepdf.open(io.BytesIO(pdf_bytes)) as pdf:
+        stats["streams_deduplicated"] = dedupe_streams(pdf)
+        if mode == "small" and Image is not None:
+            stats["images_resampled"] = downsample_images(pdf, dpi, quality)
+        pdf.remove_unreferenced_resources()
+        output = io.BytesIO()
+        pdf.save(output, linearize=True, compress_streams=True,
+                 object_stream_mode=pikepdf.ObjectStreamMode.generate, recompress_flate=mode == "small")
+    if output.tell() < len(pdf_bytes):
+        pdf_bytes = output.getvalue()
+    stats["bytes_after"] = len(pdf_bytes)
+    return pdf_bytes, stats
+
+
+class PDFOptimizer:
+    """Optional post-render optimization of the PDF output (requires pikepdf)."""
+
+    def __init__(self, mode=OPTIMIZE_MODE, dpi=OPTIMIZE_DPI, quality=OPTIMIZE_JPEG_QUALITY):
+        """Initialize the optimizer; ``mode`` is used for requests that don't choose one."""
+        if mode not in OPTIMIZE_MODES:
+            raise ValueError(f"Invalid optimize mode '{mode}'. Must be one of: {', '.join(OPTIMIZE_MODES)}")
+        self.mode = mode
+        self.dpi = dpi
+        self.quality = quality
+        self.stats = {"optimized": 0, "failures": 0, "bytes_before": 0, "bytes_after": 0,
+                      "streams_deduplicated": 0, "images_resampled": 0}
+        if pikepdf is None:
+            print("pikepdf is not installed. PDFs are sent unoptimized; run 'pip install pikepdf' to enable optimization.")
+
+    @property
+    def available(self):
+        return pikepdf is not None
+
+    def version(self, mode):
+        """Suffix for cache keys, so each optimization level is cached on its own."""
+        if mode == "none" or not self.available:
+            return ""
+        return f":{mode}" + (f"{self.dpi}q{self.quality}" if mode == "small" else "")
+
+    async def optimize(self, pdf_bytes, mode, timings=None):
+        """Optimize PDF bytes off the event loop.
+
+        Returns ``(pdf_bytes, original_size)``; the original PDF is returned if
+        optimization is disabled or fails. The time spent is stored under
+        ``"optimize"`` in ``timings``.
+        """
+        if mode not in OPTIMIZE_MODES:
+            raise ValueError(f"Invalid optimize mode '{mode}'. Must be one of: {', '.join(OPTIMIZE_MODES)}")
+        if mode == "none" or not self.available or not pdf_bytes:
+            return pdf_bytes, len(pdf_bytes or b"")
+        start = time.perf_counter()
+        try:
+            optimized, stats = await asyncio.to_thread(optimize_pdf, pdf_bytes, mode, self.dpi, self.quality)
+        except Exception as e:
+            print(f"Warning: PDF optimization failed ({e}), sending the PDF as printed")
+            self.stats["failures"] += 1
+            return pdf_bytes, len(pdf_bytes)
+        if timings is not None:
+            timings["optimize"] = time.perf_counter() - start
+        self.stats["optimized"] += 1
+        for key, value in stats.items():
+            self.stats[key] += value
+        print(f"Optimized PDF ({mode}): {stats['bytes_before']} -> {stats['bytes_after']} bytes, "
+              f"{stats['streams_deduplicated']} duplicate streams, {stats['images_resampled']} images resampled")
+        return optimized, stats["bytes_before"]
+
+    def snapshot(self):
+        """Optimization counters and total bytes saved."""
+        return {**self.stats, "available": self.available, "default_mode": self.mode, "dpi": self.dpi, "jpeg_quality": self.quality,
+                "bytes_saved": self.stats["bytes_before"] - self.stats["bytes_after"]}
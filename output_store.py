@@ -0,0 +1,97 @@
+import asyncio
+import os
+import time
+
+# Persisting outputs is opt-in; by default PDFs are only streamed back
+RETAIN_OUTPUTS = os.environ.get("PDF_RETAIN_OUTPUTS", "false").lower() in ("1", "true", "yes")
+OUTPUT_DIR = os.environ.get("PDF_OUTPUT_DIR", "outputs")
+OUTPUT_TTL_SECONDS = int(os.environ.get("PDF_OUTPUT_TTL_SECONDS", str(24 * 3600)))
+OUTPUT_MAX_BYTES = int(os.environ.get("PDF_OUTPUT_MAX_MB", "500")) * 1024 * 1024
+CLEANUP_INTERVAL_SECONDS = int(os.environ.get("PDF_CLEANUP_INTERVAL_SECONDS", "300"))
+
+
+class OutputStore:
+    """Directory of persisted outputs with TTL and total-size eviction."""
+
+    def __init__(self, directory=OUTPUT_DIR, ttl_seconds=OUTPUT_TTL_SECONDS, max_bytes=OUTPUT_MAX_BYTES):
+        """Initialize the store; the directory is created on first write."""
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._task = None
+
+    def save(self, filename, data):
+        """Write bytes to the store and return the file path."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, filename)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return path
+
+    def _entries(self):
+        entries = []
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.is_file():
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def cleanup(self):
+        """Delete expired files, then the oldest files until under the size budget.
+
+        Returns the number of files removed.
+        """
+        now = time.time()
+        removed = 0
+        kept = []
+        for mtime, size, path in self._entries():
+            if self.ttl_seconds > 0 and now - mtime > self.ttl_seconds:
+                removed += self._remove(path)
+            else:
+                kept.append((mtime, size, path))
+        total = sum(size for _, size, _ in kept)
+        for mtime, size, path in sorted(kept):
+            if total <= self.max_bytes:
+                break
+            removed += self._remove(path)
+            total -= size
+        if removed:
+            print(f"Output cleanup removed {removed} files from {self.directory}")
+        return removed
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            return 1
+        except OSError as e:
+            print(f"Warning: Could not remove {path}: {e}")
+            return 0
+
+    async def _cleanup_loop(self, interval):
+        while True:
+            try:
+                await asyncio.to_thread(self.cleanup)
+            except Exception as e:
+                print(f"Error during output cleanup: {str(e)}")
+            await asyncio.sleep(interval)
+
+    def start_cleanup(self, interval=CLEANUP_INTERVAL_SECONDS):
+        """Run cleanup periodically in a worker thread without blocking the event loop."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._cleanup_loop(interval))
+
+    async def stop_cleanup(self):
+        """Cancel the periodic cleanup task."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,152 @@
+import argparse
+import asyncio
+import collections
+import difflib
+import io
+import json
+import os
+import re
+import sys
+import time
+
+from assets import AssetRegistry
+from browser_pdf_generator import BrowserPDFGenerator, TEMPLATE_MAP, load_json_data
+from browser_pool import BrowserPool, READY_MODE, READY_MODES
+from engines import BrowserEngine, LiteEngine
+
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+# Reports whose lite text matches the browser's this closely (0-1) pass
+MIN_SIMILARITY = 0.95
+
+
+def pdf_words(pdf_bytes):
+    """Page count and the lower-cased words of a PDF, in reading order."""
+    reader = PdfReader(io.BytesIO(pdf_bytes))
+    text = " ".join(page.extract_text() or "" for page in reader.pages)
+    return len(reader.pages), re.findall(r"\w+", text.lower())
+
+
+def compare(browser_pdf, lite_pdf, min_similarity=MIN_SIMILARITY):
+    """Compare the page counts and text of the two engines' PDFs."""
+    browser_pages, browser_words = pdf_words(browser_pdf)
+    lite_pages, lite_words = pdf_words(lite_pdf)
+    similarity = difflib.SequenceMatcher(None, browser_words, lite_words, autojunk=False).ratio()
+    browser_counts, lite_counts = collections.Counter(browser_words), collections.Counter(lite_words)
+    return {
+        "pages": {"browser": browser_pages, "lite": lite_pages},
+        "similarity": round(similarity, 4),
+        "missing_words": [word for word, _ in (browser_counts - lite_counts).most_common(10)],
+        "extra_words": [word for word, _ in (lite_counts - browser_counts).most_common(10)],
+        "passed": browser_pages == lite_pages and similarity >= min_similarity,
+    }
+
+
+async def timed_render(engine, template_name, data, ready_mode):
+    timings = {}
+    start = time.perf_counter()
+    pdf_bytes = await engine.render(template_name, json.loads(json.dumps(data)), ready_mode, timings)
+    return pdf_bytes, (time.perf_counter() - start) * 1000
+
+
+async def run(args):
+    data = load_json_data(args.data)
+    if not isinstance(data, dict):
+        sys.exit(1)
+    for key in ("template", "ready_mode", "optimize", "engine", "render_options"):
+        data.pop(key, None)
+    data["blur_funds"] = args.blur_funds
+
+    assets = AssetRegistry().load()
+    generator = BrowserPDFGenerator(assets=assets)
+    generator.precompile()
+    lite = LiteEngine(generator, assets)
+    if not lite.available:
+        sys.exit(1)
+    pool = BrowserPool(size=1, assets=assets)
+    await pool.start()
+    if not pool.started:
+        sys.exit(1)
+    browser = BrowserEngine(generator, pool)
+
+    results = []
+    try:
+        for template in args.templates:
+            template_name = TEMPLATE_MAP[template]
+            # The first render of each engine pays for fonts and page setup
+            await timed_render(browser, template_name, data, args.ready_mode)
+            await timed_render(lite, template_name, data, args.ready_mode)
+            browser_pdf, browser_ms = await timed_render(browser, template_name, data, args.ready_mode)
+            lite_pdf, lite_ms = await timed_render(lite, template_name, data, args.ready_mode)
+            if not browser_pdf or not lite_pdf:
+                result = {"template": template, "passed": False, "error": "render failed"}
+            else:
+                result = {"template": template, **compare(browser_pdf, lite_pdf, args.min_similarity),
+                          "render_ms": {"browser": round(browser_ms, 1), "lite": round(lite_ms, 1)},
+                          "bytes": {"browser": len(browser_pdf), "lite": len(lite_pdf)}}
+                if args.keep:
+                    os.makedirs(args.keep, exist_ok=True)
+                    for engine, pdf_bytes in (("browser", browser_pdf), ("lite", lite_pdf)):
+                        with open(os.path.join(args.keep, f"{template}_{engine}.pdf"), "wb") as f:
+                            f.write(pdf_bytes)
+            results.append(result)
+            print_result(result)
+    finally:
+        await pool.stop()
+    return results
+
+
+def print_result(result):
+    if "error" in result:
+        print(f"{result['template']:<12} FAIL {result['error']}")
+        return
+    pages = result["pages"]
+    print(f"{result['template']:<12} {'PASS' if result['passed'] else 'FAIL'} "
+          f"pages={pages['browser']}/{pages['lite']} similarity={result['similarity']:.3f} "
+          f"render={result['render_ms']['browser']:.0f}ms/{result['render_ms']['lite']:.0f}ms (browser/lite)")
+    if result["missing_words"]:
+        print(f"    missing in lite: {', '.join(result['missing_words'])}")
+    if result["extra_words"]:
+        print(f"    only in lite: {', '.join(result['extra_words'])}")
+
+
+def main():
+    """Command line interface for the browser/lite engine parity check."""
+    parser = argparse.ArgumentParser(description='Render reports with both engines and compare page counts and text.')
+    parser.add_argument('--data', '-d', default='sample_data.json', help='Path to the JSON payload')
+    parser.add_argument('--templates', '-t', default=','.join(TEMPLATE_MAP), help='Comma-separated templates to check')
+    parser.add_argument('--min-similarity', type=float, default=MIN_SIMILARITY,
+                        help='Minimum text similarity (0-1) for a template to pass')
+    parser.add_argument('--blur-funds', action='store_true',
+                        help='Render with blurred fund names (the browser keeps them as invisible text, the lite engine '
+                             'leaves them out, so expect them among the missing words)')
+    parser.add_argument('--ready-mode', default=READY_MODE, choices=READY_MODES, help='Page readiness mode')
+    parser.add_argument('--keep', help='Directory to write both PDFs of every template to')
+    parser.add_argument('--output', '-o', help='Where to write JSON results')
+
+    args = parser.parse_args()
+    args.templates = [t for t in args.templates.split(",") if t]
+    for template in args.templates:
+        if template not in TEMPLATE_MAP:
+            parser.error(f"Invalid template '{template}'. Must be one of: {', '.join(TEMPLATE_MAP)}")
+    if PdfReader is None:
+        print("pypdf is not installed. Run 'pip install pypdf' to compare PDFs.")
+        sys.exit(1)
+
+    results = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+    passed = [result["template"] for result in results if result["passed"]]
+    if passed:
+        engines = ",".join(f"{template}=lite" for template in passed)
+        print(f"Templates that can render with the lite engine: PDF_TEMPLATE_ENGINES={engines}")
+    sys.exit(0 if len(passed) == len(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
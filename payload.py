@@ -0,0 +1,253 @@
+import json
+import os
+from typing import Annotated, List, Optional, Union
+
+from pydantic import BaseModel, BeforeValidator, ConfigDict, Field, StrictInt, ValidationError
+
+from render_options import DEFAULT_RENDER_OPTIONS, RenderOptions
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Requests above these limits are rejected before any rendering is scheduled
+MAX_BODY_BYTES = int(os.environ.get("PDF_MAX_BODY_KB", "4096")) * 1024
+MAX_BATCH_BODY_BYTES = int(os.environ.get("PDF_MAX_BATCH_BODY_MB", "64")) * 1024 * 1024
+MAX_TABLE_ROWS = int(os.environ.get("PDF_MAX_TABLE_ROWS", "500"))
+# Holdings tables (top_funds, pms.funds, debt_papers, scrips) are rendered in
+# chunks when long (see large_report.py), so they may be much longer
+MAX_HOLDINGS_ROWS = int(os.environ.get("PDF_MAX_HOLDINGS_ROWS", "10000"))
+
+
+def _scalar(value):
+    if isinstance(value, (dict, list, bool)):
+        raise ValueError("Input should be a string or a number")
+    return value
+
+
+# Values printed as-is by the templates, e.g. "1.00Cr" or 12.5
+Display = Annotated[Union[str, int, float], BeforeValidator(_scalar)]
+
+
+class PayloadTooLarge(Exception):
+    """Raised when a request body exceeds its size limit."""
+
+    def __init__(self, size, limit):
+        super().__init__(f"Payload too large: {size} bytes (maximum {limit})")
+        self.size = size
+        self.limit = limit
+
+
+class PayloadError(ValueError):
+    """Raised for malformed or invalid report data; ``errors`` lists the failing fields."""
+
+    def __init__(self, message, errors=None):
+        super().__init__(message)
+        self.errors = errors or []
+
+
+class _Model(BaseModel):
+    # Unknown fields are kept so templates can use data the schema doesn't describe
+    model_config = ConfigDict(extra="allow")
+
+
+def _rows(max_length=MAX_TABLE_ROWS):
+    return Field(default_factory=list, max_length=max_length)
+
+
+class FundReturns(_Model):
+    one_year: Optional[Display] = None
+    three_years: Optional[Display] = None
+    five_years: Optional[Display] = None
+
+
+class TopFund(_Model):
+    name: Optional[str] = None
+    category: Optional[Display] = None
+    returns: Optional[FundReturns] = None
+
+
+class MutualFund(_Model):
+    description: Optional[str] = None
+    points: List[str] = _rows()
+    top_funds: List[TopFund] = _rows(MAX_HOLDINGS_ROWS)
+
+
+class InvestmentProducts(_Model):
+    target: Optional[Display] = None
+    mutual_fund: Optional[MutualFund] = None
+
+
+class Distribution(_Model):
+    equity: Optional[float] = Field(default=None, ge=0, le=100)
+    debt: Optional[float] = Field(default=None, ge=0, le=100)
+
+
+class AllocationItem(_Model):
+    name: Optional[str] = None
+    details: List[str] = _rows()
+    asset_class: Optional[str] = None
+    amount: Optional[Display] = None
+
+
+class AssetAllocation(_Model):
+    description: Optional[str] = None
+    benefits: List[str] = _rows()
+    distribution: Optional[Distribution] = None
+    items: List[AllocationItem] = _rows()
+    total: Optional[Display] = None
+
+
+class Offering(_Model):
+    target: Optional[Display] = None
+    description: Optional[str] = None
+    bullets: List[str] = _rows()
+
+
+class PMSFund(_Model):
+    fund_name: Optional[str] = None
+    category: Optional[Display] = None
+    investment_size: Optional[Display] = None
+
+
+class PMS(Offering):
+    funds: List[PMSFund] = _rows(MAX_HOLDINGS_ROWS)
+
+
+class DebtPaper(_Model):
+    fund_name: Optional[str] = None
+    maturity: Optional[Display] = None
+    payment_frequency: Optional[Display] = None
+    ytm: Optional[Display] = None
+    quantum: Optional[Display] = None
+    type: Optional[Display] = None
+    face_value: Optional[Display] = None
+    rating: Optional[Display] = None
+
+
+class FixedIncomeOffering(Offering):
+    debt_papers: List[DebtPaper] = _rows(MAX_HOLDINGS_ROWS)
+
+
+class Scrip(_Model):
+    name: Optional[str] = None
+    industry: Optional[Display] = None
+    investment_size: Optional[Display] = None
+
+
+class PrivateEquity(Offering):
+    scrips: List[Scrip] = _rows(MAX_HOLDINGS_ROWS)
+
+
+class ProposalPayload(_Model):
+    """Report data accepted by the PDF endpoints.
+
+    Every field is optional: the templates leave out whatever is missing, so
+    only wrong types and oversized tables are rejected.
+    """
+
+    clientname: Optional[str] = None
+    report_title: Optional[str] = None
+    logo_url: Optional[str] = None
+    template: Optional[str] = None
+    blur_funds: bool = False
+    ready_mode: Optional[str] = None
+    optimize: Optional[str] = None
+    engine: Optional[str] = None
+    render_options: Optional[RenderOptions] = None
+    # Job queue fields; true/false are not priorities
+    priority: Optional[StrictInt] = None
+    investment_products: Optional[InvestmentProducts] = None
+    asset_allocation: Optional[AssetAllocation] = None
+    pms: Optional[PMS] = None
+    fixed_income_offering: Optional[FixedIncomeOffering] = None
+    private_equity: Optional[PrivateEquity] = None
+
+
+def decode_json(raw):
+    """Decode JSON bytes, with orjson when it is installed.
+
+    Raises PayloadError for malformed input.
+    """
+    try:
+        if orjson is not None:
+            return orjson.loads(raw)
+        return json.loads(raw)
+    except (ValueError, UnicodeDecodeError) as e:
+        # orjson.JSONDecodeError and json.JSONDecodeError are both ValueErrors
+        raise PayloadError(f"Invalid JSON data: {e}")
+
+
+def check_size(data, max_bytes=MAX_BODY_BYTES):
+    """Raise PayloadTooLarge if decoded data would take more than ``max_bytes`` as compact JSON.
+
+    For payloads that arrive inside a larger body, such as batch items.
+    """
+    if orjson is not None:
+        size = len(orjson.dumps(data))
+    else:
+        size = len(json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode("utf-8"))
+    if size > max_bytes:
+        raise PayloadTooLarge(size, max_bytes)
+
+
+def field_errors(error):
+    """Flatten a pydantic ValidationError into ``{"field", "message", "type"}`` dicts."""
+    return [
+        {"field": ".".join(str(part) for part in item["loc"]), "message": item["msg"], "type": item["type"]}
+        for item in error.errors()
+    ]
+
+
+def validate_payload(data):
+    """Validate decoded report data and return it as a plain dict.
+
+    Only fields present in the input are returned, so the templates' ``is
+    defined`` checks behave as before. Raises PayloadError with field errors.
+    """
+    if not isinstance(data, dict) or not data:
+        raise PayloadError("Invalid JSON data.")
+    try:
+        payload = ProposalPayload.model_validate(data)
+    except ValidationError as e:
+        raise PayloadError("Invalid report data.", field_errors(e))
+    return payload.model_dump(exclude_unset=True)
+
+
+def parse_render_options(raw):
+    """Validate render options given as a JSON string, e.g. a query parameter.
+
+    Returns the default options for an empty value. Raises PayloadError with
+    field errors.
+    """
+    if not raw:
+        return DEFAULT_RENDER_OPTIONS
+    try:
+        return RenderOptions.model_validate_json(raw)
+    except ValidationError as e:
+        errors = [{**error, "field": ".".join(filter(None, ("render_options", error["field"])))}
+                  for error in field_errors(e)]
+        raise PayloadError("Invalid render options.", errors)
+
+
+def parse_payload(raw, max_bytes=MAX_BODY_BYTES):
+    """Decode and validate report data straight from request bytes."""
+    if len(raw) > max_bytes:
+        raise PayloadTooLarge(len(raw), max_bytes)
+    return validate_payload(decode_json(raw))
+
+
+async def read_body(request, max_bytes=MAX_BODY_BYTES):
+    """Read a request body, giving up as soon as it exceeds ``max_bytes``."""
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > max_bytes:
+        raise PayloadTooLarge(int(declared), max_bytes)
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > max_bytes:
+            raise PayloadTooLarge(size, max_bytes)
+        chunks.append(chunk)
+    return b"".join(chunks)
@@ -0,0 +1,168 @@
+import asyncio
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from output_store import OutputStore
+
+CACHE_ENABLED = os.environ.get("PDF_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+CACHE_MEMORY_BYTES = int(os.environ.get("PDF_CACHE_MEMORY_MB", "256")) * 1024 * 1024
+# The disk tier is optional and only used when a directory is configured
+CACHE_DISK_DIR = os.environ.get("PDF_CACHE_DIR", "")
+CACHE_DISK_BYTES = int(os.environ.get("PDF_CACHE_DISK_MB", "2048")) * 1024 * 1024
+# The disk tier is scanned for eviction once per this many writes, not on every write
+CACHE_DISK_CLEANUP_EVERY = int(os.environ.get("PDF_CACHE_DISK_CLEANUP_EVERY", "50"))
+
+
+def canonical_json(data):
+    """Serialize data so that equal payloads always produce identical bytes."""
+    return json.dumps(data, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+def make_cache_key(template_name, template_version, data, blur_funds):
+    """Content address of a rendered PDF."""
+    digest = hashlib.sha256()
+    for part in (template_name, template_version, str(bool(blur_funds)), canonical_json(data)):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def etag_matches(if_none_match, etag):
+    """Whether an If-None-Match header value matches the given ETag."""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+class PDFCache:
+    """Two-tier (memory LRU + optional disk) cache of rendered PDFs."""
+
+    def __init__(self, memory_bytes=CACHE_MEMORY_BYTES, disk_dir=CACHE_DISK_DIR, disk_bytes=CACHE_DISK_BYTES,
+                 cleanup_every=CACHE_DISK_CLEANUP_EVERY):
+        """Initialize an empty cache with the given byte budgets."""
+        self.memory_bytes = memory_bytes
+        self.memory = OrderedDict()
+        self.memory_used = 0
+        self.disk = OutputStore(disk_dir, ttl_seconds=0, max_bytes=disk_bytes) if disk_dir else None
+        self.cleanup_every = max(1, cleanup_every)
+        self._disk_writes = 0
+        self._inflight = {}
+        self.stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "not_modified": 0,
+            "evictions": 0,
+        }
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk.directory, f"{key}.pdf")
+
+    def _remember(self, key, data):
+        """Insert into the memory tier, evicting least recently used entries."""
+        if len(data) > self.memory_bytes:
+            return
+        if key in self.memory:
+            self.memory_used -= len(self.memory.pop(key))
+        self.memory[key] = data
+        self.memory_used += len(data)
+        while self.memory_used > self.memory_bytes:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_used -= len(evicted)
+            self.stats["evictions"] += 1
+
+    def _read_disk(self, key):
+        try:
+            with open(self._disk_path(key), 'rb') as f:
+                data = f.read()
+            # Touch the file so size-based eviction removes the least recently used entries
+            os.utime(self._disk_path(key))
+            return data
+        except FileNotFoundError:
+            return None
+
+    def _write_disk(self, key, data, cleanup):
+        self.disk.save(f"{key}.pdf", data)
+        if cleanup:
+            self.disk.cleanup()
+
+    async def get(self, key):
+        """Return cached PDF bytes and the tier they came from ('memory' or 'disk')."""
+        data = self.memory.get(key)
+        if data is not None:
+            self.memory.move_to_end(key)
+            self.stats["memory_hits"] += 1
+            return data, "memory"
+        if self.disk is not None:
+            data = await asyncio.to_thread(self._read_disk, key)
+            if data is not None:
+                self._remember(key, data)
+                self.stats["disk_hits"] += 1
+                return data, "disk"
+        return None, None
+
+    async def put(self, key, data):
+        """Store PDF bytes in every configured tier."""
+        self._remember(key, data)
+        if self.disk is not None:
+            # Listing the whole directory on every write would cost more than the write itself
+            self._disk_writes += 1
+            cleanup = self._disk_writes % self.cleanup_every == 0
+            try:
+                await asyncio.to_thread(self._write_disk, key, data, cleanup)
+            except Exception as e:
+                print(f"Warning: Could not write cache entry {key}: {e}")
+
+    async def get_or_render(self, key, render):
+        """Return ``(pdf_bytes, status)`` from the cache or by awaiting ``render()``.
+
+        Concurrent requests for the same key share a single render. ``status``
+        is 'memory', 'disk', 'miss' or 'shared' (joined an in-flight render);
+        failed renders (None) are not cached.
+        """
+        while True:
+            data, tier = await self.get(key)
+            if data is not None:
+                return data, tier
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            # Unlike awaiting the future, wait() only raises if this task is cancelled
+            await asyncio.wait({inflight})
+            if not inflight.cancelled():
+                return inflight.result(), "shared"
+            # Take over: the request that owned the render went away
+        self.stats["misses"] += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            data = await render()
+            if data:
+                await self.put(key, data)
+            future.set_result(data)
+            return data, "miss"
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    def snapshot(self):
+        """Counters and sizes for monitoring."""
+        lookups = self.stats["memory_hits"] + self.stats["disk_hits"] + self.stats["misses"]
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        return {
+            **self.stats,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self.memory),
+            "memory_bytes": self.memory_used,
+            "memory_budget_bytes": self.memory_bytes,
+            "disk_enabled": self.disk is not None,
+        }
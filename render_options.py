@@ -0,0 +1,107 @@
+import hashlib
+from typing import Literal, Optional
+
+from pydantic import BaseModel, ConfigDict, Field
+
+# CSS lengths accepted by Chromium for margins, e.g. "20mm" or "0.5in"
+CSS_LENGTH = r"^\d+(\.\d+)?(px|in|cm|mm)$"
+# Pages to print, e.g. "1-5, 8, 11-13"
+PAGE_RANGES = r"^(\s*\d+(\s*-\s*\d+)?\s*(,\s*\d+(\s*-\s*\d+)?\s*)*)?$"
+LOCALE = r"^[A-Za-z]{2,3}(-[A-Za-z0-9]{2,8})*$"
+
+# Chromium prints its own date and title when only one template is given
+EMPTY_HEADER_FOOTER = "<span></span>"
+
+
+class _Options(BaseModel):
+    # Frozen so options can be compared, hashed and shared between requests
+    model_config = ConfigDict(frozen=True, extra="forbid")
+
+
+class Margins(_Options):
+    top: str = Field("20mm", pattern=CSS_LENGTH)
+    bottom: str = Field("20mm", pattern=CSS_LENGTH)
+    left: str = Field("15mm", pattern=CSS_LENGTH)
+    right: str = Field("15mm", pattern=CSS_LENGTH)
+
+
+class RenderOptions(_Options):
+    """Page and browser options of a render, accepted as ``render_options``.
+
+    The PDF options are applied to every print. The context options
+    (viewport, device scale factor and locale) pick the pooled browser
+    context the page is rendered in; renders with the same context options
+    share contexts whatever their PDF options.
+    """
+
+    format: Literal["A3", "A4", "A5", "Letter", "Legal", "Tabloid"] = "A4"
+    landscape: bool = False
+    margin: Margins = Margins()
+    scale: float = Field(1.0, ge=0.1, le=2.0)
+    header_template: Optional[str] = Field(None, max_length=10000)
+    footer_template: Optional[str] = Field(None, max_length=10000)
+    page_ranges: str = Field("", pattern=PAGE_RANGES)
+    tagged: bool = False
+    outline: bool = False
+    viewport_width: int = Field(1280, ge=320, le=3840)
+    viewport_height: int = Field(720, ge=320, le=3840)
+    device_scale_factor: float = Field(1.0, ge=0.5, le=4.0)
+    locale: Optional[str] = Field(None, pattern=LOCALE)
+
+    @property
+    def context_key(self):
+        """Options that need their own browser context."""
+        return (self.viewport_width, self.viewport_height, self.device_scale_factor, self.locale)
+
+    @property
+    def merge_safe(self):
+        """Whether the PDF can be assembled from separately printed parts.
+
+        Header/footer page numbers, page ranges, tags and outlines cover the
+        whole document and are lost or wrong in merged parts, so reports
+        using them are printed in one piece.
+        """
+        return not (self.header_template or self.footer_template or self.page_ranges.strip()
+                    or self.tagged or self.outline)
+
+    @property
+    def version(self):
+        """Suffix for cache keys; empty for the default options."""
+        if self == DEFAULT_RENDER_OPTIONS:
+            return ""
+        return ":opts" + hashlib.sha256(self.model_dump_json().encode("utf-8")).hexdigest()[:16]
+
+    def pdf_kwargs(self):
+        """Keyword arguments for Playwright's ``page.pdf``."""
+        kwargs = {
+            "format": self.format,
+            "landscape": self.landscape,
+            "margin": self.margin.model_dump(),
+            "scale": self.scale,
+            "print_background": True,
+            "display_header_footer": bool(self.header_template or self.footer_template),
+        }
+        if kwargs["display_header_footer"]:
+            kwargs["header_template"] = self.header_template or EMPTY_HEADER_FOOTER
+            kwargs["footer_template"] = self.footer_template or EMPTY_HEADER_FOOTER
+        if self.page_ranges.strip():
+            kwargs["page_ranges"] = self.page_ranges.strip()
+        # Only passed when used, so older Playwright versions keep working
+        if self.tagged:
+            kwargs["tagged"] = True
+        if self.outline:
+            kwargs["outline"] = True
+        return kwargs
+
+    def context_kwargs(self):
+        """Keyword arguments for Playwright's ``browser.new_context``."""
+        kwargs = {
+            "viewport": {"width": self.viewport_width, "height": self.viewport_height},
+            "device_scale_factor": self.device_scale_factor,
+        }
+        if self.locale:
+            kwargs["locale"] = self.locale
+        return kwargs
+
+
+DEFAULT_RENDER_OPTIONS = RenderOptions()
@@ -0,0 +1,372 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import struct
+import sys
+import time
+
+from assets import AssetRegistry
+from browser_pdf_generator import BrowserPDFGenerator, TEMPLATE_MAP
+from browser_pool import BrowserPool, POOL_PAGES_PER_BROWSER, READY_MODE
+from large_report import LargeReportRenderer, LARGE_REPORT_BUDGET_SECONDS
+from render_options import DEFAULT_RENDER_OPTIONS, RenderOptions
+from sections import SectionRenderer
+from segments import StaticPageCache
+from shared_stats import SharedStats, STATS_DB
+from supervisor import (HEARTBEAT_INTERVAL_SECONDS, HEARTBEAT_TIMEOUT_SECONDS, RENDER_RETRIES, RENDERER_MAX_JOBS,
+                        RENDERER_MAX_RSS_MB, WorkerHealth, kill_process_group, process_group_rss, process_rss)
+from warmup import Warmup
+
+# When set, API workers send renders to the renderer service listening on
+# this Unix socket instead of launching their own browsers
+RENDERER_SOCKET = os.environ.get("PDF_RENDERER_SOCKET", "")
+RENDERER_WORKERS = int(os.environ.get("PDF_RENDERER_WORKERS", "0"))  # 0 = one per available core
+# Large reports may use their whole time budget
+RENDERER_TIMEOUT_SECONDS = max(120, LARGE_REPORT_BUDGET_SECONDS)
+
+_HEADER = struct.Struct("!I")
+
+
+async def send_message(writer, header, body=b""):
+    """Send a JSON header followed by an optional binary body."""
+    encoded = json.dumps({**header, "body_size": len(body)}).encode("utf-8")
+    writer.write(_HEADER.pack(len(encoded)) + encoded)
+    if body:
+        writer.write(body)
+    await writer.drain()
+
+
+async def read_message(reader):
+    """Read a message written by send_message and return ``(header, body)``."""
+    (size,) = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+    header = json.loads(await reader.readexactly(size))
+    body = await reader.readexactly(header["body_size"]) if header["body_size"] else b""
+    return header, body
+
+
+async def render_document(generator, pool, static_pages, template_name, data, ready_mode, timings, large_reports=None,
+                          options=DEFAULT_RENDER_OPTIONS, sections=None, render_info=None, deadline=None):
+    """Render a template to PDF bytes on a browser pool, segmented, in chunks or by section if enabled.
+
+    Options that span the whole document (see RenderOptions.merge_safe) are
+    always printed in one piece. ``render_info`` receives how many sections
+    were reused when the report is assembled from sections. ``deadline``
+    (event-loop time) bounds the wait for extra scheduler slots of chunks and
+    sections.
+    """
+    if options.merge_safe:
+        if large_reports is not None and large_reports.applies(data):
+            return await large_reports.render(template_name, data, ready_mode, timings, options, deadline)
+        if sections is not None and sections.applies(template_name, data):
+            return await sections.render(template_name, data, ready_mode, timings, options, render_info, deadline)
+        if static_pages is not None and static_pages.enabled:
+            return await static_pages.render(template_name, data, ready_mode, timings, options)
+    html_content = generator.render_html(template_name, data, timings=timings)
+    if html_content is None:
+        return None
+    return await pool.render_pdf(html_content, ready_mode=ready_mode, timings=timings, options=options)
+
+
+class RendererClient:
+    """Submits renders to the renderer service over its Unix socket."""
+
+    def __init__(self, path=RENDERER_SOCKET, timeout=RENDERER_TIMEOUT_SECONDS, retries=RENDER_RETRIES):
+        self.path = path
+        self.timeout = timeout
+        self.retries = max(0, retries)
+        self.stats = {"retries": 0}
+
+    async def ping(self, timeout=1.0):
+        """Whether the renderer service accepts connections."""
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_unix_connection(self.path), timeout)
+        except (OSError, asyncio.TimeoutError):
+            return False
+        writer.close()
+        with contextlib.suppress(Exception):
+            await writer.wait_closed()
+        return True
+
+    async def render(self, template_name, data, ready_mode=READY_MODE, timings=None, options=DEFAULT_RENDER_OPTIONS,
+                     render_info=None):
+        """Render a template remotely and return the PDF bytes (None on failure).
+
+        Cancelling the call closes the connection, which cancels the render
+        in the renderer process. A render whose renderer process dies is
+        retried up to ``retries`` times; the socket hands it to a live one.
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                return await self._render(template_name, data, ready_mode, timings, options, render_info)
+            except (asyncio.IncompleteReadError, ConnectionError) as e:
+                if attempt == self.retries:
+                    raise
+                self.stats["retries"] += 1
+                print(f"Renderer connection lost ({type(e).__name__}), retrying ({attempt + 1}/{self.retries})")
+
+    async def _render(self, template_name, data, ready_mode, timings, options, render_info):
+        reader, writer = await asyncio.open_unix_connection(self.path)
+        try:
+            await send_message(writer, {"template": template_name, "data": data, "ready_mode": ready_mode,
+                                        "options": options.model_dump()})
+            header, body = await asyncio.wait_for(read_message(reader), self.timeout)
+        finally:
+            writer.close()
+            with contextlib.suppress(Exception):
+                await writer.wait_closed()
+        if timings is not None:
+            timings.update(header.get("timings", {}))
+        if render_info is not None:
+            render_info.update(header.get("render_info", {}))
+        if header.get("error"):
+            print(f"Renderer error: {header['error']}")
+            return None
+        return body
+
+
+class RendererWorker:
+    """One renderer process: a single pinned Chromium serving the shared socket.
+
+    The worker reports a heartbeat and its browser's pid to the supervising
+    process, and retires (stops accepting, finishes its renders and exits to
+    be replaced) after PDF_RENDERER_MAX_JOBS renders or PDF_RENDERER_MAX_RSS_MB
+    of memory, browser included.
+    """
+
+    def __init__(self, index, pages, health=None):
+        self.index = index
+        self.health = health
+        self.assets = AssetRegistry()
+        self.generator = BrowserPDFGenerator(assets=self.assets)
+        self.pool = BrowserPool(size=1, pages_per_browser=pages, assets=self.assets)
+        self.static_pages = StaticPageCache(self.generator, self.pool, self.assets)
+        self.large_reports = LargeReportRenderer(self.generator, self.pool, self.static_pages)
+        self.sections = SectionRenderer(self.generator, self.pool, self.static_pages)
+        self.warmup = Warmup()
+        self.inflight = 0
+        self.retiring = None
+        self.stats = {"renders": 0, "failures": 0, "cancelled": 0}
+
+    def snapshot(self):
+        return {**self.stats, "pid": os.getpid(), "inflight": self.inflight, "rss_bytes": self.rss(),
+                "pool": self.pool.snapshot(), "static_pages": self.static_pages.snapshot(),
+                "large_reports": self.large_reports.snapshot(), "sections": self.sections.snapshot(),
+                "prewarm": self.warmup.snapshot()}
+
+    def _browser_pid(self):
+        return next((b.pid for b in self.pool.browsers if b.pid is not None), None)
+
+    def rss(self):
+        """Memory of this process and its browser in bytes, or None where /proc is not available."""
+        own = process_rss(os.getpid())
+        browser_pid = self._browser_pid()
+        return own + (process_group_rss(browser_pid) or 0) if own is not None and browser_pid else own
+
+    def retire(self, reason):
+        """Stop taking renders; serve() returns once the renders in flight are done."""
+        if self.retiring is not None and not self.retiring.is_set():
+            print(f"Renderer {self.index} retiring after {reason}")
+            self.retiring.set()
+
+    async def _heartbeat(self):
+        """Report liveness to the supervisor and retire when over the memory limit."""
+        interval = HEARTBEAT_INTERVAL_SECONDS or 5
+        while True:
+            if self.health is not None:
+                self.health.beat(self._browser_pid())
+            rss = await asyncio.to_thread(self.rss)
+            if RENDERER_MAX_RSS_MB and rss and rss > RENDERER_MAX_RSS_MB * 1024 * 1024:
+                self.retire(f"{rss >> 20} MB RSS")
+            await asyncio.sleep(interval)
+
+    async def _render(self, header):
+        timings = {}
+        render_info = {}
+        pdf_bytes = await render_document(self.generator, self.pool, self.static_pages, header["template"],
+                                          header["data"], header.get("ready_mode", READY_MODE), timings,
+                                          self.large_reports, RenderOptions.model_validate(header.get("options") or {}),
+                                          self.sections, render_info)
+        return pdf_bytes, timings, render_info
+
+    async def handle(self, reader, writer):
+        try:
+            header, _ = await read_message(reader)
+        except (asyncio.IncompleteReadError, ValueError):
+            writer.close()
+            return
+        self.inflight += 1
+        render = asyncio.create_task(self._render(header))
+        # The client closing its end means nobody wants the result any more
+        hangup = asyncio.create_task(reader.read(1))
+        try:
+            await asyncio.wait({render, hangup}, return_when=asyncio.FIRST_COMPLETED)
+            if not render.done():
+                render.cancel()
+                self.stats["cancelled"] += 1
+                return
+            pdf_bytes, timings, render_info = render.result()
+            if pdf_bytes:
+                self.stats["renders"] += 1
+                await send_message(writer, {"timings": timings, "render_info": render_info}, pdf_bytes)
+            else:
+                self.stats["failures"] += 1
+                await send_message(writer, {"error": "PDF generation failed.", "timings": timings})
+        except Exception as e:
+            self.stats["failures"] += 1
+            print(f"Renderer {self.index} error: {str(e)}")
+            with contextlib.suppress(Exception):
+                await send_message(writer, {"error": str(e)})
+        finally:
+            self.inflight -= 1
+            hangup.cancel()
+            writer.close()
+            jobs = self.stats["renders"] + self.stats["failures"]
+            if RENDERER_MAX_JOBS and jobs >= RENDERER_MAX_JOBS:
+                self.retire(f"{jobs} jobs")
+
+    async def serve(self, sock):
+        self.retiring = asyncio.Event()
+        # Started first, so a slow startup isn't mistaken for a hang
+        heartbeat = asyncio.create_task(self._heartbeat())
+        await asyncio.to_thread(self.assets.load)
+        await asyncio.to_thread(self.generator.precompile)
+        await self.pool.start()
+
+        async def prewarm_render(template_name, data):
+            return await render_document(self.generator, self.pool, self.static_pages, template_name, data,
+                                         READY_MODE, {}, self.large_reports, sections=self.sections)
+
+        # Connections wait on the shared socket (or go to warm workers) until this one is warm. Failed
+        # prewarms aren't retried here; the API's own prewarm through this worker keeps /readyz failing
+        await self.warmup.run(prewarm_render, TEMPLATE_MAP.values(), retry=False)
+        shared_stats = SharedStats() if STATS_DB else None
+        if shared_stats is not None:
+            shared_stats.start(f"renderer-{self.index}", self.snapshot)
+        server = await asyncio.start_unix_server(self.handle, sock=sock)
+        print(f"Renderer {self.index} (pid {os.getpid()}) ready")
+        try:
+            async with server:
+                await self.retiring.wait()
+            # Connections still waiting on the socket go to the other workers
+            while self.inflight:
+                await asyncio.sleep(0.1)
+        finally:
+            heartbeat.cancel()
+            if shared_stats is not None:
+                await shared_stats.stop()
+            await self.pool.stop()
+
+
+def _run_worker(index, sock, cpu, pages, health):
+    # A process group of its own, so the supervisor can kill the worker with its Playwright driver
+    os.setpgid(0, 0)
+    if cpu is not None:
+        # Chromium processes launched from here inherit the affinity
+        os.sched_setaffinity(0, {cpu})
+    # The parent terminates workers; shut down through KeyboardInterrupt so Chromium is closed too
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        asyncio.run(RendererWorker(index, pages, health).serve(sock))
+    except KeyboardInterrupt:
+        pass
+
+
+def _available_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def serve(path=RENDERER_SOCKET, workers=RENDERER_WORKERS, pages=POOL_PAGES_PER_BROWSER, pin=True):
+    """Run the renderer service until interrupted.
+
+    Starts ``workers`` processes that accept connections on one shared Unix
+    socket, each pinned to its own core. Workers that exit, retire or miss
+    their heartbeat are replaced; a hung worker is killed along with its
+    Playwright driver, and the browser of a dead worker is killed too so it
+    can't live on as an orphan.
+    """
+    cpus = _available_cpus()
+    workers = workers or len(cpus)
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    os.chmod(path, 0o660)
+    sock.listen(128)
+
+    context = multiprocessing.get_context("fork")
+    pinning = pin and hasattr(os, "sched_setaffinity")
+
+    def spawn(index):
+        cpu = cpus[index % len(cpus)] if pinning else None
+        health = WorkerHealth(context)
+        process = context.Process(target=_run_worker, args=(index, sock, cpu, pages, health), daemon=True)
+        process.start()
+        return process, health
+
+    def kill(process, health):
+        if not kill_process_group(process.pid):
+            process.kill()
+        process.join(10)
+        kill_process_group(health.browser_pid, "chrom")
+
+    # Workers are killed once their heartbeat is this old; it covers a missed beat
+    stale_after = HEARTBEAT_INTERVAL_SECONDS + HEARTBEAT_TIMEOUT_SECONDS
+    processes = [spawn(i) for i in range(workers)]
+    print(f"Renderer listening on {path} with {workers} workers x {pages} pages")
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+    try:
+        while not stopping:
+            time.sleep(1)
+            for i, (process, health) in enumerate(processes):
+                if stopping:
+                    break
+                if not process.is_alive():
+                    print(f"Renderer {i} exited ({process.exitcode}), restarting")
+                elif HEARTBEAT_INTERVAL_SECONDS > 0 and health.age > stale_after:
+                    print(f"Renderer {i} missed its heartbeat for {health.age:.0f} s, killing it")
+                else:
+                    continue
+                kill(process, health)
+                processes[i] = spawn(i)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process, _ in processes:
+            process.terminate()
+        # Anything a worker leaves behind (a stuck driver or browser) is killed
+        for process, health in processes:
+            process.join(10)
+            kill(process, health)
+        sock.close()
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(path)
+
+
+def main():
+    """Command line interface for the renderer service."""
+    parser = argparse.ArgumentParser(description='Run the shared PDF renderer service on a Unix socket.')
+    parser.add_argument('--socket', '-s', default=RENDERER_SOCKET or '/tmp/pdf-renderer.sock',
+                        help='Unix socket path the API workers connect to')
+    parser.add_argument('--workers', '-w', type=int, default=RENDERER_WORKERS,
+                        help='Renderer processes, one Chromium each (0 = one per available core)')
+    parser.add_argument('--pages', '-p', type=int, default=POOL_PAGES_PER_BROWSER,
+                        help='Concurrent pages per renderer process')
+    parser.add_argument('--no-pin', action='store_true', help='Do not pin renderer processes to cores')
+    args = parser.parse_args()
+    if not hasattr(socket, "AF_UNIX"):
+        print("Error: the renderer service requires Unix domain sockets.")
+        sys.exit(1)
+    serve(args.socket, args.workers, args.pages, pin=not args.no_pin)
+
+
+if __name__ == "__main__":
+    main()
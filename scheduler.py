@@ -0,0 +1,252 @@
+import asyncio
+import collections
+import contextlib
+import os
+
+# Approximate peak memory of one in-flight Chromium render
+RENDER_MEMORY_MB = int(os.environ.get("PDF_RENDER_MEMORY_MB", "250"))
+MAX_INFLIGHT = int(os.environ.get("PDF_MAX_INFLIGHT", "0"))  # 0 = size from CPU and memory
+MAX_WAITING = int(os.environ.get("PDF_MAX_WAITING", "200"))
+REQUEST_DEADLINE_MS = int(os.environ.get("PDF_REQUEST_DEADLINE_MS", "30000"))
+DISCONNECT_POLL_SECONDS = 0.5
+
+
+class SchedulerOverloaded(Exception):
+    """Raised when the waiting queue is full; carries a Retry-After estimate."""
+
+    def __init__(self, retry_after):
+        super().__init__("Renderer is overloaded")
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a render could not finish before its deadline."""
+
+
+class ClientDisconnected(Exception):
+    """Raised when the client went away and its render was cancelled."""
+
+
+def _available_memory_mb():
+    """Memory available to this process in MB, honouring cgroup limits."""
+    available = None
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    available = int(line.split()[1]) // 1024
+                    break
+    except OSError:
+        pass
+    if available is None:
+        try:
+            available = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+        except (ValueError, OSError, AttributeError):
+            return None
+    try:
+        with open("/sys/fs/cgroup/memory.max") as f:
+            limit = f.read().strip()
+        if limit != "max":
+            available = min(available, int(limit) // (1024 * 1024))
+    except (OSError, ValueError):
+        pass
+    return available
+
+
+def default_max_inflight():
+    """Size concurrent renders from CPU count and available memory."""
+    if MAX_INFLIGHT > 0:
+        return MAX_INFLIGHT
+    by_cpu = (os.cpu_count() or 1) * 2
+    memory = _available_memory_mb()
+    by_memory = memory // RENDER_MEMORY_MB if memory else by_cpu
+    return max(1, min(by_cpu, by_memory))
+
+
+class RenderScheduler:
+    """Global limit on in-flight renders with a fair FIFO waiting queue."""
+
+    def __init__(self, max_inflight=None, max_waiting=MAX_WAITING):
+        """Initialize the scheduler; ``max_inflight`` defaults to default_max_inflight()."""
+        self.max_inflight = max_inflight or default_max_inflight()
+        self.max_waiting = max_waiting
+        self.inflight = 0
+        self._waiters = collections.deque()
+        self._wait_times = collections.deque(maxlen=1000)
+        self._render_times = collections.deque(maxlen=100)
+        self.stats = {
+            "admitted": 0,
+            "rejected": 0,
+            "deadline_exceeded": 0,
+            "cancelled": 0,
+            "extra_slots": 0,
+        }
+
+    @property
+    def queue_depth(self):
+        return sum(1 for waiter in self._waiters if not waiter.done())
+
+    def _retry_after(self):
+        average = sum(self._render_times) / len(self._render_times) if self._render_times else 5.0
+        return max(1, round(average * (self.queue_depth + 1) / self.max_inflight))
+
+    async def acquire(self, deadline=None):
+        """Wait for a render slot in arrival order.
+
+        ``deadline`` is an event-loop time; raises DeadlineExceeded if no slot
+        frees up before it, or SchedulerOverloaded if the queue is full.
+        """
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        if self.inflight < self.max_inflight and not self.queue_depth:
+            self.inflight += 1
+        else:
+            if self.queue_depth >= self.max_waiting:
+                self.stats["rejected"] += 1
+                raise SchedulerOverloaded(self._retry_after())
+            waiter = loop.create_future()
+            self._waiters.append(waiter)
+            timeout = None if deadline is None else max(0, deadline - start)
+            try:
+                # A granted waiter inherits the releasing render's slot
+                await asyncio.wait_for(waiter, timeout)
+            except asyncio.TimeoutError:
+                self.stats["deadline_exceeded"] += 1
+                raise DeadlineExceeded("Deadline exceeded while waiting for a render slot")
+            except asyncio.CancelledError:
+                self.stats["cancelled"] += 1
+                if waiter.done() and not waiter.cancelled():
+                    self.release()
+                raise
+            finally:
+                with contextlib.suppress(ValueError):
+                    self._waiters.remove(waiter)
+        self.stats["admitted"] += 1
+        self._wait_times.append(loop.time() - start)
+
+    def release(self):
+        """Hand the slot to the next waiter, or free it."""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.inflight -= 1
+
+    @contextlib.asynccontextmanager
+    async def slot(self, deadline=None):
+        """Hold a render slot for the duration of the block."""
+        await self.acquire(deadline)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        try:
+            yield
+        finally:
+            self._render_times.append(loop.time() - start)
+            self.release()
+
+    def snapshot(self):
+        """Queue depth, in-flight count and wait-time statistics."""
+        waits = sorted(self._wait_times)
+
+        def percentile(p):
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))] * 1000, 1) if waits else 0.0
+
+        return {
+            **self.stats,
+            "max_inflight": self.max_inflight,
+            "inflight": self.inflight,
+            "queue_depth": self.queue_depth,
+            "wait_ms_p50": percentile(0.50),
+            "wait_ms_p95": percentile(0.95),
+            "wait_ms_max": round(waits[-1] * 1000, 1) if waits else 0.0,
+        }
+
+
+async def run_in_slots(scheduler, jobs, limit=None, deadline=None):
+    """Await the coroutine functions in ``jobs`` with bounded fan-out; returns their results in order.
+
+    The caller must already hold a render slot. One worker runs jobs in that
+    slot; up to ``limit - 1`` more (default: one per job) take a scheduler
+    slot of their own per job, and stop when the scheduler is full or
+    ``deadline`` (event-loop time) passes, so a single request never has more
+    renders in flight than the scheduler admits. Without a scheduler the
+    workers run without slots. No job is started after one returns a falsy
+    result; those results stay None.
+    """
+    pending = collections.deque(enumerate(jobs))
+    results = [None] * len(pending)
+    waiting = set()
+    failed = False
+
+    async def run_next():
+        nonlocal failed
+        index, job = pending.popleft()
+        results[index] = await job()
+        failed = failed or not results[index]
+
+    async def own_slot_worker():
+        while pending and not failed:
+            await run_next()
+
+    async def extra_slot_worker():
+        task = asyncio.current_task()
+        while pending and not failed:
+            waiting.add(task)
+            try:
+                await scheduler.acquire(deadline)
+            except (SchedulerOverloaded, DeadlineExceeded):
+                return
+            finally:
+                waiting.discard(task)
+            try:
+                if pending and not failed:
+                    scheduler.stats["extra_slots"] += 1
+                    await run_next()
+            finally:
+                scheduler.release()
+
+    worker = own_slot_worker if scheduler is None else extra_slot_worker
+    workers = [asyncio.create_task(worker()) for _ in range(min(limit or len(results), len(results)) - 1)]
+    try:
+        await own_slot_worker()
+        # Workers still waiting for a slot have nothing left to run
+        for task in list(waiting):
+            task.cancel()
+        for result in await asyncio.gather(*workers, return_exceptions=True):
+            if isinstance(result, Exception):
+                raise result
+    finally:
+        for task in workers:
+            task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await asyncio.gather(*workers, return_exceptions=True)
+    return results
+
+
+def deadline_from_ms(deadline_ms):
+    """Convert a relative deadline in milliseconds to an event-loop time (None if <= 0)."""
+    if not deadline_ms or deadline_ms <= 0:
+        return None
+    return asyncio.get_running_loop().time() + deadline_ms / 1000
+
+
+async def run_until_disconnected(is_disconnected, coro, poll_interval=DISCONNECT_POLL_SECONDS):
+    """Await ``coro``, cancelling it if ``is_disconnected()`` becomes true.
+
+    Raises ClientDisconnected after cancelling the work.
+    """
+    task = asyncio.create_task(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval)
+            if done:
+                return task.result()
+            if await is_disconnected():
+                task.cancel()
+                with contextlib.suppress(asyncio.CancelledError, Exception):
+                    await task
+                raise ClientDisconnected("Client disconnected")
+    finally:
+        if not task.done():
+            task.cancel()
@@ -0,0 +1,241 @@
+import asyncio
+import functools
+import os
+import time
+from collections import OrderedDict
+
+from large_report import page_count
+from pdf_cache import CACHE_DISK_BYTES, CACHE_DISK_DIR, PDFCache, make_cache_key
+from render_options import DEFAULT_RENDER_OPTIONS
+from scheduler import run_in_slots
+from segments import PdfReader, merge_segments, placeholder_pages, static_marker
+
+# Reports are assembled from separately cached sections, so a request that
+# changes some sections of a proposal only re-renders those
+INCREMENTAL_SECTIONS = os.environ.get("PDF_INCREMENTAL_SECTIONS", "false").lower() in ("1", "true", "yes")
+SECTION_CACHE_BYTES = int(os.environ.get("PDF_SECTION_CACHE_MB", "128")) * 1024 * 1024
+# Section PDFs are kept next to the report PDFs, shared by all workers
+SECTION_CACHE_DIR = os.path.join(CACHE_DISK_DIR, "sections") if CACHE_DISK_DIR else ""
+
+# Top-level sections of each template in page order, as the payload path
+# the template checks before printing the section; the first key holds its data
+TEMPLATE_SECTIONS = {
+    "invest4edu_report.html": (
+        ("asset_allocation",),
+        ("investment_products",),
+        ("pms",),
+        ("fixed_income_offering",),
+        ("private_equity",),
+    ),
+    "investvalue_report.html": (
+        ("asset_allocation",),
+        ("investment_products", "mutual_fund"),
+        ("pms",),
+        ("alternative_investment",),
+        ("fixed_income_offering",),
+        ("private_equity",),
+    ),
+}
+
+# Page counts remembered per section content, to number sections before they are rendered
+MAX_PAGE_HINTS = 10000
+
+# Section placeholders sit between the introduction and the closing page, each on a page of its own
+SECTION_PLACEHOLDER = ('<div style="page-break-before: always; page-break-after: always;">'
+                       '<a href="{href}" style="display: block; width: 100%; height: 10mm;"></a></div>')
+
+
+def section_marker(name):
+    """Placeholder name of a section in the frame."""
+    return f"section/{name}"
+
+
+class SectionRenderer:
+    """Renders reports section by section, re-rendering only the sections whose data changed.
+
+    Every top-level section is printed as a document of its own and cached
+    under a fingerprint of its data, blur_funds, the template and asset
+    versions, the render options and its first page number. The rest of the
+    report (cover, introduction and static pages) is cached as a frame with a
+    placeholder page per section, which the section PDFs replace.
+    """
+
+    def __init__(self, generator, pool, static_pages=None, enabled=INCREMENTAL_SECTIONS, cache=None, scheduler=None):
+        """Initialize the renderer for a BrowserPDFGenerator, BrowserPool, optional StaticPageCache and RenderScheduler."""
+        self.generator = generator
+        self.pool = pool
+        self.static_pages = static_pages
+        self.scheduler = scheduler
+        self.cache = cache if cache is not None else PDFCache(SECTION_CACHE_BYTES, SECTION_CACHE_DIR, CACHE_DISK_BYTES)
+        self._enabled = enabled
+        self._page_hints = OrderedDict()
+        self.stats = {"reports": 0, "frames_reused": 0, "sections_reused": 0, "sections_rendered": 0,
+                      "sections_renumbered": 0, "fallbacks": 0}
+        if enabled and PdfReader is None:
+            print("pypdf is not installed. Reports are rendered in one piece; run 'pip install pypdf' to render them by section.")
+
+    @property
+    def enabled(self):
+        return self._enabled and PdfReader is not None
+
+    @property
+    def version(self):
+        """Suffix for cache keys; sections always start on a new page."""
+        return ":sections"
+
+    def present(self, template_name, data):
+        """Names of the template's sections that the data fills, in page order."""
+        names = []
+        for path in TEMPLATE_SECTIONS.get(template_name, ()):
+            value = data
+            for key in path:
+                value = value.get(key) if isinstance(value, dict) else None
+            if value:
+                names.append(path[0])
+        return names
+
+    def applies(self, template_name, data):
+        """Whether the report is assembled from cached sections."""
+        return self.enabled and bool(self.present(template_name, data))
+
+    def _version(self, template_name, options):
+        assets = self.generator.assets
+        asset_digest = assets.digest if assets is not None else ""
+        return self.generator.template_digest(template_name) + asset_digest + options.version
+
+    def fingerprint(self, template_name, name, data, options, page_start=None):
+        """Cache key of a section PDF; without ``page_start``, of its content only."""
+        version = f"{self._version(template_name, options)}:section:{name}"
+        if page_start is not None:
+            version += f":{page_start}"
+        return make_cache_key(template_name, version, data.get(name), data.get("blur_funds", False))
+
+    def _remember_pages(self, key, pages):
+        self._page_hints[key] = pages
+        self._page_hints.move_to_end(key)
+        while len(self._page_hints) > MAX_PAGE_HINTS:
+            self._page_hints.popitem(last=False)
+
+    async def _render_full(self, template_name, data, ready_mode, timings, options):
+        if self.static_pages is not None and self.static_pages.enabled:
+            return await self.static_pages.render(template_name, data, ready_mode, timings, options)
+        html_content = self.generator.render_html(template_name, data, timings=timings)
+        if html_content is None:
+            return None
+        return await self.pool.render_pdf(html_content, ready_mode=ready_mode, timings=timings, options=options)
+
+    async def _render_frame(self, template_name, frame_data, names, ready_mode, timings, options):
+        def section_slots():
+            return "\n".join(SECTION_PLACEHOLDER.format(href=static_marker(section_marker(name))) for name in names)
+
+        return await self._render_full(template_name, {**frame_data, "section_slots": section_slots},
+                                       ready_mode, timings, options)
+
+    async def _render_section(self, template_name, name, data, page_start, ready_mode, options):
+        # Only this section has content; the others are empty, as the templates expect them
+        section_data = {path[0]: {} for path in TEMPLATE_SECTIONS[template_name]}
+        section_data.update({name: data[name], "blur_funds": data.get("blur_funds", False),
+                             "section_only": name, "page_start": page_start})
+        # Static pages are hidden in sections; markers keep their images from loading
+        html_content = self.generator.render_html(template_name, section_data, static_page=static_marker)
+        if html_content is None:
+            return None
+        return await self.pool.render_pdf(html_content, ready_mode=ready_mode, options=options)
+
+    async def render(self, template_name, data, ready_mode, timings, options=DEFAULT_RENDER_OPTIONS, render_info=None,
+                     deadline=None):
+        """Render a report from cached and freshly rendered sections; None on failure.
+
+        Sections are numbered from the page of their placeholder, using the
+        page counts seen for the same content before (one page if unknown).
+        Sections that land on other pages than assumed are rendered once more
+        with the right numbers. ``render_info`` receives the number of
+        sections reused and rendered. Sections missing from the cache are
+        rendered like large-report chunks (see run_in_slots), waiting for
+        extra scheduler slots until ``deadline`` at most. Falls back to a
+        single document if the placeholders can't be matched.
+        """
+        names = self.present(template_name, data)
+        if not names:
+            return await self._render_full(template_name, data, ready_mode, timings, options)
+        self.stats["reports"] += 1
+        frame_data = {**data, **{path[0]: {} for path in TEMPLATE_SECTIONS[template_name]}}
+        frame_key = make_cache_key(template_name, f"{self._version(template_name, options)}:frame:{','.join(names)}",
+                                   frame_data, data.get("blur_funds", False))
+        frame_pdf, frame_status = await self.cache.get_or_render(
+            frame_key, lambda: self._render_frame(template_name, frame_data, names, ready_mode, timings, options))
+        if not frame_pdf:
+            return None
+        if frame_status != "miss":
+            self.stats["frames_reused"] += 1
+        positions = await asyncio.to_thread(placeholder_pages, frame_pdf)
+        if any(section_marker(name) not in positions for name in names):
+            print("Warning: section placeholders not found, rendering the report as one document")
+            self.stats["fallbacks"] += 1
+            return await self._render_full(template_name, data, ready_mode, timings, options)
+
+        first_page = positions[section_marker(names[0])]
+        content_keys = {name: self.fingerprint(template_name, name, data, options) for name in names}
+        rendered = set()
+
+        def page_starts(pages):
+            starts, page = {}, first_page
+            for name in names:
+                starts[name] = page
+                page += pages[name]
+            return starts
+
+        async def section(name, page_start):
+            async def render():
+                rendered.add(name)
+                return await self._render_section(template_name, name, data, page_start, ready_mode, options)
+            pdf_bytes, _ = await self.cache.get_or_render(
+                self.fingerprint(template_name, name, data, options, page_start), render)
+            return pdf_bytes
+
+        async def sections(starts):
+            pdfs = {}
+            for name, page in starts.items():
+                pdfs[name], _ = await self.cache.get(self.fingerprint(template_name, name, data, options, page))
+            # Cached sections need no slot; the others share the scheduler with the rest of the service
+            missing = [name for name, pdf_bytes in pdfs.items() if pdf_bytes is None]
+            jobs = [functools.partial(section, name, starts[name]) for name in missing]
+            pdfs.update(zip(missing, await run_in_slots(self.scheduler, jobs, deadline=deadline)))
+            return pdfs
+
+        start = time.perf_counter()
+        starts = page_starts({name: self._page_hints.get(content_keys[name], 1) for name in names})
+        pdfs = await sections(starts)
+        if not all(pdfs.values()):
+            return None
+        counts = {name: page_count(pdf_bytes) for name, pdf_bytes in pdfs.items()}
+        for name, pages in counts.items():
+            self._remember_pages(content_keys[name], pages)
+        moved = {name: page for name, page in page_starts(counts).items() if page != starts[name]}
+        if moved:
+            pdfs.update(await sections(moved))
+            if not all(pdfs.values()):
+                return None
+            self.stats["sections_renumbered"] += len(moved)
+        timings["section_render"] = time.perf_counter() - start
+        reused = len(names) - len(rendered)
+        self.stats["sections_reused"] += reused
+        self.stats["sections_rendered"] += len(rendered)
+        if render_info is not None:
+            render_info.update(sections_reused=reused, sections_rendered=len(rendered))
+
+        start = time.perf_counter()
+        try:
+            pdf_bytes = await asyncio.to_thread(
+                merge_segments, frame_pdf, {section_marker(name): pdfs[name] for name in names})
+        except Exception as e:
+            print(f"Warning: section merge failed ({e}), rendering the report as one document")
+            self.stats["fallbacks"] += 1
+            return await self._render_full(template_name, data, ready_mode, timings, options)
+        timings["merge"] = timings.get("merge", 0.0) + time.perf_counter() - start
+        print(f"Assembled {len(names)} sections ({reused} reused): {len(pdf_bytes)} bytes")
+        return pdf_bytes
+
+    def snapshot(self):
+        """Section counters and the section cache."""
+        return {**self.stats, "enabled": self.enabled, "cache": self.cache.snapshot()}
@@ -0,0 +1,172 @@
+import asyncio
+import io
+import os
+import time
+import urllib.parse
+
+try:
+    from pypdf import PdfReader, PdfWriter
+except ImportError:
+    PdfReader = PdfWriter = None
+
+from render_options import DEFAULT_RENDER_OPTIONS
+
+# How reports are rendered:
+#   full      - the whole template goes through the browser
+#   segmented - full-bleed static pages are rendered once, cached as PDF
+#               fragments and merged with the client-specific pages
+RENDER_MODES = ("full", "segmented")
+RENDER_MODE = os.environ.get("PDF_RENDER_MODE", "full")
+
+# Placeholder pages link to this origin so they can be found in the rendered PDF
+STATIC_MARKER_ORIGIN = "https://report-static.local"
+STATIC_PAGE_TEMPLATE = "static_page.html"
+
+
+def static_marker(name):
+    """Link target marking the placeholder page of a static asset page."""
+    return f"{STATIC_MARKER_ORIGIN}/{urllib.parse.quote(name)}"
+
+
+def _marker_name(page):
+    """Asset name of the static page a placeholder page stands for, or None."""
+    for annotation in page.get("/Annots") or []:
+        action = annotation.get_object().get("/A")
+        uri = str(action.get_object().get("/URI", "")) if action is not None else ""
+        if uri.startswith(STATIC_MARKER_ORIGIN + "/"):
+            return urllib.parse.unquote(uri[len(STATIC_MARKER_ORIGIN) + 1:])
+    return None
+
+
+def placeholder_pages(pdf_bytes):
+    """Map the placeholder names found in a PDF to their 1-based page numbers."""
+    pages = {}
+    for number, page in enumerate(PdfReader(io.BytesIO(pdf_bytes)).pages, start=1):
+        name = _marker_name(page)
+        if name is not None:
+            pages[name] = number
+    return pages
+
+
+def merge_segments(dynamic_pdf, fragments):
+    """Replace every placeholder page of ``dynamic_pdf`` with its static fragment.
+
+    ``fragments`` maps asset names to PDF bytes or the path of a PDF file; a
+    fragment of None removes its placeholder page. Raises ValueError if a
+    fragment has no placeholder page, so blank pages never go out.
+    """
+    writer = PdfWriter()
+    replaced = set()
+    for page in PdfReader(io.BytesIO(dynamic_pdf)).pages:
+        name = _marker_name(page)
+        if name is None or name not in fragments:
+            writer.add_page(page)
+            continue
+        fragment = fragments[name]
+        if fragment is not None:
+            for static_page in PdfReader(fragment if isinstance(fragment, str) else io.BytesIO(fragment)).pages:
+                writer.add_page(static_page)
+        replaced.add(name)
+    missing = set(fragments) - replaced
+    if missing:
+        raise ValueError(f"Static page placeholders not found: {', '.join(sorted(missing))}")
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+class StaticPageCache:
+    """Static report pages rendered once per asset version and merged into every report."""
+
+    def __init__(self, generator, pool, assets, mode=RENDER_MODE):
+        """Initialize the cache for a BrowserPDFGenerator, BrowserPool and AssetRegistry."""
+        if mode not in RENDER_MODES:
+            raise ValueError(f"Invalid render mode '{mode}'. Must be one of: {', '.join(RENDER_MODES)}")
+        self.generator = generator
+        self.pool = pool
+        self.assets = assets
+        self.mode = mode
+        self._fragments = {}
+        self.stats = {"fragments_rendered": 0, "fragments_reused": 0, "merges": 0, "fallbacks": 0}
+        if mode == "segmented" and PdfWriter is None:
+            print("pypdf is not installed. Reports are rendered in full; run 'pip install pypdf' to enable segmented rendering.")
+
+    @property
+    def enabled(self):
+        return self.mode == "segmented" and PdfWriter is not None
+
+    def _version(self, name, options):
+        # Page format, margins and scale change the fragment, so each set of options has its own
+        return (name, options, self.assets.digest, self.generator.template_digest(STATIC_PAGE_TEMPLATE))
+
+    async def _render_fragment(self, name, ready_mode, options):
+        html_content = self.generator.render_html(STATIC_PAGE_TEMPLATE, {"name": name})
+        if html_content is None:
+            return None
+        return await self.pool.render_pdf(html_content, ready_mode=ready_mode, options=options)
+
+    async def fragment(self, name, ready_mode, options=DEFAULT_RENDER_OPTIONS):
+        """Return the PDF fragment of a static page, rendering it on first use.
+
+        Concurrent callers share one render; a failed render is retried by the
+        next caller.
+        """
+        key = self._version(name, options)
+        future = self._fragments.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._render_fragment(name, ready_mode, options))
+            self._fragments = {k: v for k, v in self._fragments.items() if k[2:] == key[2:]}
+            self._fragments[key] = future
+            self.stats["fragments_rendered"] += 1
+        else:
+            self.stats["fragments_reused"] += 1
+        # Shield the shared render from the cancellation of any single caller
+        pdf_bytes = await asyncio.shield(future)
+        if not pdf_bytes and self._fragments.get(key) is future:
+            del self._fragments[key]
+        return pdf_bytes
+
+    async def render(self, template_name, data, ready_mode, timings, options=DEFAULT_RENDER_OPTIONS):
+        """Render a report with its static pages taken from the fragment cache.
+
+        Fragments that are not cached yet are rendered one after the other
+        before the report. Returns the merged PDF bytes, or None if rendering
+        fails. Falls back to a full render if the placeholders can't be matched.
+        """
+        names = []
+
+        def static_page(name):
+            names.append(name)
+            return static_marker(name)
+
+        html_content = self.generator.render_html(template_name, data, static_page=static_page, timings=timings)
+        if html_content is None:
+            return None
+        # One at a time, as the request holds a single scheduler slot
+        fragments = {}
+        for name in dict.fromkeys(names):
+            fragments[name] = await self.fragment(name, ready_mode, options)
+            if not fragments[name]:
+                return None
+        dynamic_pdf = await self.pool.render_pdf(html_content, ready_mode=ready_mode, timings=timings, options=options)
+        if not dynamic_pdf:
+            return None
+        start = time.perf_counter()
+        try:
+            pdf_bytes = await asyncio.to_thread(merge_segments, dynamic_pdf, fragments)
+        except Exception as e:
+            print(f"Warning: segment merge failed ({e}), rendering in full")
+            self.stats["fallbacks"] += 1
+            html_content = self.generator.render_html(template_name, data)
+            if html_content is None:
+                return None
+            return await self.pool.render_pdf(html_content, ready_mode=ready_mode, timings=timings, options=options)
+        timings["merge"] = time.perf_counter() - start
+        self.stats["merges"] += 1
+        print(f"Merged {len(fragments)} static pages: {len(dynamic_pdf)} -> {len(pdf_bytes)} bytes")
+        return pdf_bytes
+
+    def snapshot(self):
+        """Render mode, cached fragments and merge counters."""
+        return {**self.stats, "mode": self.mode if self.enabled else "full",
+                "cached_fragments": sum(1 for f in self._fragments.values() if f.done() and f.result())}
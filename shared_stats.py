@@ -0,0 +1,77 @@
+import asyncio
+import contextlib
+import json
+import os
+import sqlite3
+import time
+
+# SQLite file where every API worker and renderer process publishes its
+# counters, so any worker can report on all of them (empty disables it)
+STATS_DB = os.environ.get("PDF_STATS_DB", "")
+STATS_INTERVAL_SECONDS = float(os.environ.get("PDF_STATS_INTERVAL_SECONDS", "5"))
+
+
+class SharedStats:
+    """Per-process stats snapshots shared between processes through a SQLite file.
+
+    Each process periodically overwrites its own row; readers collect the rows
+    of processes that published recently.
+    """
+
+    def __init__(self, path=STATS_DB, interval=STATS_INTERVAL_SECONDS):
+        self.path = path
+        self.interval = interval
+        self._task = None
+        self._source = None
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS process_stats ("
+                " source TEXT PRIMARY KEY, pid INTEGER NOT NULL, updated_at REAL NOT NULL, stats TEXT NOT NULL)"
+            )
+
+    def _connect(self):
+        return contextlib.closing(sqlite3.connect(self.path, timeout=5, isolation_level=None))
+
+    def publish(self, source, stats):
+        """Store the latest stats of a process under its source name."""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO process_stats (source, pid, updated_at, stats) VALUES (?, ?, ?, ?)",
+                (source, os.getpid(), time.time(), json.dumps(stats, default=str)),
+            )
+
+    def collect(self, max_age=None):
+        """Return ``{source: stats}`` for processes that published within ``max_age`` seconds."""
+        max_age = max_age if max_age is not None else self.interval * 3
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT source, pid, updated_at, stats FROM process_stats WHERE updated_at >= ? ORDER BY source",
+                (time.time() - max_age,),
+            ).fetchall()
+        return {source: {"pid": pid, "updated_at": updated_at, **json.loads(stats)}
+                for source, pid, updated_at, stats in rows}
+
+    async def _run(self, source, snapshot):
+        while True:
+            try:
+                await asyncio.to_thread(self.publish, source, snapshot())
+            except Exception as e:
+                print(f"Error publishing stats: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    def start(self, source, snapshot):
+        """Publish ``snapshot()`` under ``source`` every interval."""
+        if self._task is None:
+            self._source = source
+            self._task = asyncio.create_task(self._run(source, snapshot))
+
+    async def stop(self):
+        """Stop publishing and remove this process's row."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            with contextlib.suppress(sqlite3.Error):
+                with self._connect() as conn:
+                    conn.execute("DELETE FROM process_stats WHERE source = ?", (self._source,))
@@ -0,0 +1,96 @@
+import os
+import signal
+import time
+
+# Every pooled browser must answer a CDP round trip, and every renderer
+# process must report that its event loop is alive, within the timeout
+HEARTBEAT_INTERVAL_SECONDS = float(os.environ.get("PDF_HEARTBEAT_INTERVAL_SECONDS", "5"))  # 0 disables heartbeats
+HEARTBEAT_TIMEOUT_SECONDS = float(os.environ.get("PDF_HEARTBEAT_TIMEOUT_SECONDS", "10"))
+# A page render (load, readiness wait and print) running longer than this
+# means its browser hung; the browser is killed and its renders retried
+RENDER_TIMEOUT_SECONDS = float(os.environ.get("PDF_RENDER_TIMEOUT_SECONDS", "30"))
+# Retries of a render on a healthy browser or renderer process after a crash
+RENDER_RETRIES = int(os.environ.get("PDF_RENDER_RETRIES", "2"))
+# Browsers whose process tree grows beyond this are recycled once idle (0 = no limit)
+BROWSER_MAX_RSS_MB = int(os.environ.get("PDF_BROWSER_MAX_RSS_MB", "1536"))
+# Renderer processes are replaced after this many renders, or once they and
+# their browser use this much memory (0 = no limit)
+RENDERER_MAX_JOBS = int(os.environ.get("PDF_RENDERER_MAX_JOBS", "5000"))
+RENDERER_MAX_RSS_MB = int(os.environ.get("PDF_RENDERER_MAX_RSS_MB", "3072"))
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def _stat(pid):
+    """Fields of /proc/<pid>/stat after the command name, or None."""
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    return data[data.rfind(b")") + 2:].split()
+
+
+def process_rss(pid):
+    """Resident memory of a process in bytes, or None where /proc is not available."""
+    fields = _stat(pid)
+    return int(fields[21]) * _PAGE_SIZE if fields else None
+
+
+def process_group_rss(pgid):
+    """Resident memory of every process in a process group, or None where /proc is not available."""
+    if not os.path.isdir("/proc"):
+        return None
+    total = 0
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            fields = _stat(entry)
+            if fields and int(fields[2]) == pgid:
+                total += int(fields[21]) * _PAGE_SIZE
+    return total
+
+
+def kill_process_group(pgid, command=None):
+    """SIGKILL a process group and return whether it existed.
+
+    With ``command``, the group leader's command line must contain it, so a
+    recycled pid never takes an unrelated process down.
+    """
+    if not pgid or not hasattr(os, "killpg"):
+        return False
+    if command is not None:
+        try:
+            with open(f"/proc/{pgid}/cmdline", "rb") as f:
+                if command.encode() not in f.read():
+                    return False
+        except OSError:
+            return False
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        return False
+    return True
+
+
+class WorkerHealth:
+    """Heartbeat and browser pid of a renderer process, shared with the process that supervises it."""
+
+    def __init__(self, context):
+        """Create the shared values with a multiprocessing context, before the worker is started."""
+        self._beat = context.Value("d", time.time(), lock=False)
+        self._browser_pid = context.Value("i", 0, lock=False)
+
+    def beat(self, browser_pid=None):
+        """Record that the worker is alive, and the pid of its browser if known."""
+        self._beat.value = time.time()
+        if browser_pid is not None:
+            self._browser_pid.value = browser_pid
+
+    @property
+    def age(self):
+        """Seconds since the last heartbeat."""
+        return time.time() - self._beat.value
+
+    @property
+    def browser_pid(self):
+        return self._browser_pid.value
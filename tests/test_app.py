@@ -0,0 +1,223 @@
+"""API behaviour around the renderer: validation, job admission, caching and batches.
+
+Renders are replaced by a stub, so no browser is needed.
+"""
+import asyncio
+import io
+import json
+import os
+import zipfile
+
+import pytest
+
+pytest.importorskip("httpx")
+
+from fastapi.testclient import TestClient
+
+import app
+import engines as engines_module
+from jobs import MemoryJobBackend
+
+PDF = b"%PDF-1.7 stub"
+SAMPLE_DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sample_data.json")
+
+
+@pytest.fixture
+def client():
+    # Startup (browser pool, prewarm, job workers) is not run without the context manager
+    return TestClient(app.app)
+
+
+@pytest.fixture
+def job_backend(monkeypatch):
+    backend = MemoryJobBackend()
+    monkeypatch.setattr(app.job_queue, "backend", backend)
+    return backend
+
+
+@pytest.mark.parametrize("priority", [True, False, "5", 1.5])
+def test_jobs_reject_non_integer_priorities(client, job_backend, priority):
+    response = client.post("/jobs", json={"clientname": "A", "priority": priority})
+    assert response.status_code == 422
+    assert [error["field"] for error in response.json()["fields"]] == ["priority"]
+    assert not job_backend.jobs
+
+
+def test_jobs_accept_integer_priorities(client, job_backend):
+    response = client.post("/jobs", json={"clientname": "A", "priority": 3})
+    assert response.status_code == 202
+    assert job_backend.jobs[response.json()["job_id"]].priority == 3
+
+
+def test_a_full_job_queue_answers_429_with_retry_after(client, job_backend, monkeypatch):
+    monkeypatch.setattr(app.job_queue, "max_queued", 1)
+    assert client.post("/jobs", json={"clientname": "A"}).status_code == 202
+
+    response = client.post("/jobs", json={"clientname": "B"})
+
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    assert len(job_backend.jobs) == 1
+
+
+def test_job_status_and_pdf_until_the_job_runs(client, job_backend):
+    job_id = client.post("/jobs", json={"clientname": "A"}).json()["job_id"]
+
+    assert client.get(f"/jobs/{job_id}").json()["status"] == "queued"
+    pending = client.get(f"/jobs/{job_id}/pdf")
+    assert (pending.status_code, pending.headers["Retry-After"]) == (409, "1")
+    assert client.get("/jobs/unknown").status_code == 404
+
+
+@pytest.mark.parametrize("url", ["file:///etc/passwd", "ftp://example.com/", "http://"])
+def test_jobs_reject_unsafe_webhook_urls(client, job_backend, url):
+    response = client.post("/jobs", json={"clientname": "A", "webhook_url": url})
+    assert response.status_code == 400
+    assert not job_backend.jobs
+
+
+@pytest.fixture
+def large_report_deadlines(monkeypatch):
+    """Deadlines given to browser renders of reports that are treated as large."""
+    deadlines = []
+
+    async def render(template_name, data, ready_mode, timings, options, render_info, deadline):
+        deadlines.append(deadline)
+        return PDF
+
+    monkeypatch.setattr(app.engines["browser"], "render", render)
+    monkeypatch.setattr(app, "renders_in_chunks", lambda data, options, engine="browser": True)
+    return deadlines
+
+
+def test_large_reports_keep_a_shorter_client_deadline(large_report_deadlines):
+    async def render():
+        deadline = asyncio.get_running_loop().time() + 10
+        await app.render_report("invest4edu", {}, "assets", {}, deadline)
+        return deadline
+
+    assert large_report_deadlines == [asyncio.run(render())]
+
+
+def test_large_reports_get_their_budget_without_a_client_deadline(large_report_deadlines):
+    async def render():
+        now = asyncio.get_running_loop().time()
+        await app.render_report("invest4edu", {}, "assets", {})
+        return now
+
+    now = asyncio.run(render())
+    assert large_report_deadlines[0] - now == pytest.approx(app.LARGE_REPORT_BUDGET_SECONDS, abs=1)
+
+
+def test_large_report_budget_replaces_only_the_default_request_deadline(client, large_report_deadlines):
+    assert client.post("/generate-pdf-json/", json={"clientname": "A"}).status_code == 200
+    assert client.post("/generate-pdf-json/?deadline_ms=5000", json={"clientname": "B"}).status_code == 200
+    default, requested = large_report_deadlines
+    assert default - requested > app.LARGE_REPORT_BUDGET_SECONDS - 10
+
+
+def test_batch_items_over_the_body_limit_fail_on_their_own(client, monkeypatch):
+    async def get_report_pdf(*args, **kwargs):
+        return PDF, "miss"
+
+    monkeypatch.setattr(app, "get_report_pdf", get_report_pdf)
+    monkeypatch.setattr(app, "MAX_BODY_BYTES", 1024)
+    items = [{"clientname": "A"}, {"clientname": "B", "notes": "x" * 2048}]
+
+    response = client.post("/generate-pdf-batch/", json=items)
+
+    assert response.status_code == 200
+    archive = zipfile.ZipFile(io.BytesIO(response.content))
+    assert "0001_invest4edu_a.pdf" in archive.namelist()
+    manifest = json.loads(archive.read("manifest.json"))["items"]
+    assert [entry["status"] for entry in manifest] == ["ok", "error"]
+    assert manifest[1]["error"].startswith("Payload too large")
+
+
+def test_engine_fallbacks_are_counted_once_per_request(monkeypatch):
+    lite = app.engines["lite"]
+    monkeypatch.setitem(lite.stats, "fallbacks", 0)
+    scaled = app.RenderOptions(scale=0.5)
+
+    assert app.resolve_engine("invest4edu", "lite", scaled) == "browser"
+    assert app.resolve_engine("invest4edu", "browser", scaled) == "browser"
+    assert app.default_engine(app.engines, "invest4edu") in app.ENGINES
+    assert lite.stats["fallbacks"] == 1
+
+
+def test_cached_reports_carry_an_etag_and_answer_304(client, monkeypatch):
+    renders = []
+
+    async def render(template_name, data, ready_mode, timings, options, render_info, deadline):
+        renders.append(data["clientname"])
+        return PDF
+
+    monkeypatch.setattr(app.engines["browser"], "render", render)
+    monkeypatch.setattr(app, "pdf_cache", app.PDFCache(1024 * 1024, ""))
+    payload = {"clientname": "Etag Client", "engine": "browser"}
+
+    first = client.post("/generate-pdf-json/", json=payload)
+    second = client.post("/generate-pdf-json/", json=payload)
+    revalidated = client.post("/generate-pdf-json/", json=payload, headers={"If-None-Match": first.headers["ETag"]})
+
+    assert (first.status_code, first.headers["X-Cache"], first.content) == (200, "MISS", PDF)
+    assert (second.headers["X-Cache"], second.headers["ETag"]) == ("HIT", first.headers["ETag"])
+    assert (revalidated.status_code, revalidated.content) == (304, b"")
+    assert renders == ["Etag Client"]
+
+
+def test_renders_are_refused_with_503_when_the_scheduler_queue_is_full(client, monkeypatch):
+    scheduler = app.RenderScheduler(1, max_waiting=0)
+    scheduler.inflight = 1
+    monkeypatch.setattr(app, "render_scheduler", scheduler)
+    monkeypatch.setattr(app, "CACHE_ENABLED", False)
+
+    response = client.post("/generate-pdf-json/", json={"clientname": "Busy"})
+
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1
+
+
+@pytest.fixture
+def rendered(monkeypatch):
+    """Payloads the browser engine was asked to render."""
+    payloads = []
+
+    async def render(template_name, data, ready_mode, timings, options, render_info, deadline):
+        payloads.append(data)
+        return PDF
+
+    monkeypatch.setattr(app.engines["browser"], "render", render)
+    monkeypatch.setattr(app, "CACHE_ENABLED", False)
+    return payloads
+
+
+def test_sample_data_renders_through_the_api(client, rendered):
+    with open(SAMPLE_DATA, "rb") as f:
+        sample = json.load(f)
+    response = client.post("/generate-pdf-json/", json={**sample, "engine": "browser"})
+    assert response.status_code == 200
+    assert response.content == PDF
+    assert rendered[0]["clientname"] == "Vamshi Sudula"
+
+
+def test_invalid_payloads_get_422_without_rendering(client, rendered):
+    response = client.post("/generate-pdf-json/", json={"clientname": "A", "pms": {"funds": "many"}})
+    assert response.status_code == 422
+    assert [error["field"] for error in response.json()["fields"]] == ["pms.funds"]
+    assert not rendered
+
+
+def test_readyz_needs_no_browser_when_every_template_renders_lite(client, monkeypatch):
+    monkeypatch.setattr(app.warmup, "done", True)
+    not_ready = client.get("/readyz")
+    assert not_ready.status_code == 503
+    assert not_ready.json()["checks"] == {"prewarmed": True, "browsers": False, "queue": True}
+
+    monkeypatch.setattr(engines_module, "ENGINE", "lite")
+    monkeypatch.setattr(engines_module, "TEMPLATE_ENGINES", {})
+    # Lite renders count as available whether or not ReportLab is installed here
+    monkeypatch.setattr(engines_module, "BaseDocTemplate", object)
+
+    assert client.get("/readyz").status_code == 200
+    assert client.get("/healthz").json()["status"] == "ok"
@@ -0,0 +1,29 @@
+"""Asset registry: loading from disk and resolving asset names in templates."""
+import base64
+
+from assets import ASSET_ORIGIN, MISSING_ASSET_URI, AssetRegistry
+
+# Smallest valid GIF, standing in for the logo
+GIF = base64.b64decode(MISSING_ASSET_URI.partition(",")[2])
+
+
+def registry(tmp_path, mode="route"):
+    (tmp_path / "logo.png").write_bytes(GIF)
+    return AssetRegistry(root=str(tmp_path), mode=mode, optimize=False).load()
+
+
+def test_loaded_assets_resolve_to_the_asset_origin_or_a_data_uri(tmp_path):
+    assert registry(tmp_path).url("logo") == f"{ASSET_ORIGIN}/logo"
+    assert registry(tmp_path, mode="datauri").url("logo").endswith(";base64," + base64.b64encode(GIF).decode())
+
+
+def test_missing_assets_render_blank_with_one_warning(tmp_path, capsys):
+    assets = registry(tmp_path)
+    capsys.readouterr()
+
+    assert assets.url("cover") == MISSING_ASSET_URI
+    assert assets.url("cover") == MISSING_ASSET_URI
+    assert assets.url("no-such-asset") == MISSING_ASSET_URI
+    warnings = capsys.readouterr().out.splitlines()
+    assert len(warnings) == 2
+    assert "'cover'" in warnings[0]
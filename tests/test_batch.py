@@ -0,0 +1,60 @@
+"""Batch parsing and packing of results into ZIP and multipart responses."""
+import asyncio
+import io
+import json
+import zipfile
+
+import pytest
+
+from batch import item_filename, parse_batch_items, run_batch, stream_multipart, stream_zip
+
+PDF = b"%PDF-1.7 stub"
+
+
+async def render_item(index, item):
+    if item.get("fail"):
+        raise ValueError("PDF generation failed.")
+    await asyncio.sleep(0.01 * (3 - index))
+    return item_filename(index, "invest4edu", item), PDF
+
+
+def collect(stream):
+    async def run():
+        return b"".join([chunk async for chunk in stream])
+
+    return asyncio.run(run())
+
+
+ITEMS = [{"clientname": "Ann Lee"}, {"fail": True}, {"clientname": "Bo"}]
+
+
+def test_parse_batch_items_accepts_arrays_objects_and_ndjson():
+    assert parse_batch_items(b'[{"clientname": "A"}]') == [{"clientname": "A"}]
+    assert parse_batch_items(b'{"items": [{"clientname": "A"}]}') == [{"clientname": "A"}]
+    assert parse_batch_items(b'{"clientname": "A"}\n\n{"clientname": "B"}\n', "application/x-ndjson") == [
+        {"clientname": "A"}, {"clientname": "B"}]
+    for raw in (b"[]", b'{"clientname": "A"}', b"[1"):
+        with pytest.raises(ValueError):
+            parse_batch_items(raw)
+
+
+def test_zip_holds_each_pdf_and_a_manifest_in_item_order():
+    archive = zipfile.ZipFile(io.BytesIO(collect(stream_zip(run_batch(ITEMS, render_item)))))
+
+    assert sorted(archive.namelist()) == ["0001_invest4edu_ann_lee.pdf", "0003_invest4edu_bo.pdf", "manifest.json"]
+    assert archive.read("0003_invest4edu_bo.pdf") == PDF
+    manifest = json.loads(archive.read("manifest.json"))["items"]
+    assert [(entry["index"], entry["status"]) for entry in manifest] == [(0, "ok"), (1, "error"), (2, "ok")]
+    assert manifest[1]["error"] == "PDF generation failed."
+
+
+def test_multipart_sends_a_part_per_item_as_it_completes():
+    body = collect(stream_multipart(run_batch(ITEMS, render_item), "b"))
+
+    parts = body.split(b"--b")
+    assert parts[-1] == b"--\r\n"
+    indexes = [part.split(b"X-Batch-Index: ")[1].split(b"\r\n")[0] for part in parts[1:-1]]
+    # Completion order: the failure first, then the fastest render
+    assert indexes == [b"1", b"2", b"0"]
+    assert b"Content-Type: application/json" in parts[1]
+    assert parts[2].endswith(b"\r\n\r\n" + PDF + b"\r\n")
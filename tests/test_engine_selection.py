@@ -0,0 +1,69 @@
+"""Which engine renders a report; runs without a browser or ReportLab."""
+import pytest
+
+import engines as engines_module
+from engines import Engine, default_engine, engine_for, parse_template_engines, select_engine
+from render_options import RenderOptions
+
+
+class StubEngine(Engine):
+    def __init__(self, name, available=True, supported=True):
+        super().__init__()
+        self.name = name
+        self._available = available
+        self.supported = supported
+
+    @property
+    def available(self):
+        return self._available
+
+    def supports(self, options):
+        return self.supported
+
+    async def render(self, template_name, data, ready_mode, timings, options=None, render_info=None, deadline=None):
+        return b"%PDF"
+
+
+@pytest.fixture(autouse=True)
+def configuration(monkeypatch):
+    monkeypatch.setattr(engines_module, "ENGINE", "browser")
+    monkeypatch.setattr(engines_module, "TEMPLATE_ENGINES", {"investvalue": "lite"})
+
+
+def test_engine_for_prefers_the_request_then_the_template_then_the_default():
+    assert engine_for("investvalue", "browser") == "browser"
+    assert engine_for("investvalue") == "lite"
+    assert engine_for("invest4edu") == "browser"
+
+
+def test_parse_template_engines():
+    assert parse_template_engines(" invest4edu=LITE, ,investvalue = browser") == {
+        "invest4edu": "lite", "investvalue": "browser"}
+    assert parse_template_engines("") == {}
+    with pytest.raises(ValueError, match="Invalid engine 'pdfkit'"):
+        parse_template_engines("invest4edu=pdfkit")
+
+
+@pytest.mark.parametrize("available, supported, expected", [
+    (True, True, "lite"),
+    (False, True, "browser"),
+    (True, False, "browser"),
+])
+def test_select_engine_falls_back_to_the_browser_without_counting(available, supported, expected):
+    engines = {"browser": StubEngine("browser"), "lite": StubEngine("lite", available, supported)}
+
+    assert select_engine(engines, "investvalue", options=RenderOptions()).name == expected
+    assert select_engine(engines, "invest4edu", "lite").name == expected
+    assert select_engine(engines, "investvalue", "browser").name == "browser"
+    assert default_engine(engines, "investvalue") == expected
+    # Counting is left to the request path (app.resolve_engine)
+    assert engines["lite"].stats["fallbacks"] == 0
+
+
+def test_engines_must_implement_render():
+    class Incomplete(Engine):
+        name = "incomplete"
+
+    with pytest.raises(TypeError):
+        Incomplete()
+    assert StubEngine("lite").snapshot() == {"renders": 0, "failures": 0, "fallbacks": 0, "available": True}
@@ -0,0 +1,117 @@
+"""Parity of the lite engine with the browser for the sample report data."""
+import asyncio
+import collections
+import copy
+import os
+import re
+from html.parser import HTMLParser
+
+import pytest
+
+pytest.importorskip("reportlab")
+pytest.importorskip("pypdf")
+
+from assets import AssetRegistry
+from browser_pdf_generator import BrowserPDFGenerator, TEMPLATE_MAP
+from browser_pool import BrowserPool, READY_MODE
+from engines import BrowserEngine, LiteEngine
+from parity import MIN_SIMILARITY, compare, pdf_words
+from warmup import load_prewarm_data
+
+SAMPLE_DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sample_data.json")
+# Pages of either template for sample_data.json, as printed by Chromium
+SAMPLE_PAGES = 9
+
+
+class _VisibleText(HTMLParser):
+    """Text of an HTML document outside <head>, <style> and <script>."""
+
+    def __init__(self):
+        super().__init__()
+        self.hidden = 0
+        self.parts = []
+
+    def handle_starttag(self, tag, attrs):
+        self.hidden += tag in ("head", "style", "script")
+
+    def handle_endtag(self, tag):
+        self.hidden -= tag in ("head", "style", "script")
+
+    def handle_data(self, data):
+        if not self.hidden:
+            self.parts.append(data)
+
+
+def visible_words(html_content):
+    parser = _VisibleText()
+    parser.feed(html_content)
+    return re.findall(r"\w+", " ".join(parser.parts).lower())
+
+
+@pytest.fixture(scope="module")
+def generator():
+    generator = BrowserPDFGenerator(assets=AssetRegistry().load())
+    generator.precompile()
+    return generator
+
+
+@pytest.fixture(scope="module")
+def lite(generator):
+    engine = LiteEngine(generator, generator.assets)
+    assert engine.available
+    return engine
+
+
+@pytest.fixture
+def data():
+    data = load_prewarm_data(SAMPLE_DATA)
+    data["blur_funds"] = False
+    return data
+
+
+@pytest.mark.parametrize("template", TEMPLATE_MAP)
+def test_lite_renders_every_page_and_word(generator, lite, data, template):
+    pdf_bytes = lite.render_pdf(TEMPLATE_MAP[template], copy.deepcopy(data))
+    assert pdf_bytes
+
+    pages, words = pdf_words(pdf_bytes)
+    assert pages == SAMPLE_PAGES
+    # Word wrapping differs between the engines, so count the template's words rather than their order
+    expected = collections.Counter(visible_words(generator.render_html(TEMPLATE_MAP[template], copy.deepcopy(data))))
+    missing = expected - collections.Counter(words)
+    coverage = 1 - sum(missing.values()) / sum(expected.values())
+    assert coverage >= MIN_SIMILARITY, f"missing in lite: {missing.most_common(10)}"
+
+
+@pytest.mark.parametrize("template", TEMPLATE_MAP)
+def test_lite_leaves_out_blurred_fund_names(lite, data, template):
+    fund = data["investment_products"]["mutual_fund"]["top_funds"][0]["name"]
+    _, shown = pdf_words(lite.render_pdf(TEMPLATE_MAP[template], copy.deepcopy(data)))
+    _, blurred = pdf_words(lite.render_pdf(TEMPLATE_MAP[template], {**copy.deepcopy(data), "blur_funds": True}))
+
+    name = " ".join(re.findall(r"\w+", fund.lower()))
+    assert name in " ".join(shown)
+    assert name not in " ".join(blurred)
+
+
+@pytest.mark.parametrize("template", TEMPLATE_MAP)
+def test_lite_matches_browser(generator, lite, data, template):
+    async def render_both():
+        pool = BrowserPool(size=1, assets=generator.assets)
+        try:
+            await pool.start()
+        except Exception as e:
+            await pool.stop()
+            pytest.skip(f"Chromium is not available: {e}")
+        if not pool.started:
+            pytest.skip("Playwright is not installed")
+        try:
+            browser_pdf = await BrowserEngine(generator, pool).render(TEMPLATE_MAP[template], copy.deepcopy(data),
+                                                                      READY_MODE, {})
+        finally:
+            await pool.stop()
+        return browser_pdf, await lite.render(TEMPLATE_MAP[template], copy.deepcopy(data), READY_MODE, {})
+
+    browser_pdf, lite_pdf = asyncio.run(render_both())
+    result = compare(browser_pdf, lite_pdf)
+    assert result["passed"], result
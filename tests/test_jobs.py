@@ -0,0 +1,75 @@
+"""Job queue admission, priorities and webhook URL checks."""
+import asyncio
+
+import pytest
+
+from jobs import DONE, FAILED, Job, JobQueue, MemoryJobBackend, QueueFullError, validate_webhook_url
+
+
+@pytest.mark.parametrize("url", ["http://hooks.example.com/pdf", "https://hooks.example.com:8443/pdf?x=1"])
+def test_webhook_url_accepts_http_and_https(url):
+    assert validate_webhook_url(url, allowed_hosts=set()) == url
+
+
+@pytest.mark.parametrize("url", ["file:///etc/passwd", "ftp://example.com/x", "gopher://example.com", "http:///path",
+                                 "https://", "hooks.example.com/pdf", 42, None])
+def test_webhook_url_rejects_other_schemes_and_missing_hosts(url):
+    with pytest.raises(ValueError):
+        validate_webhook_url(url, allowed_hosts=set())
+
+
+def test_webhook_url_allowlist():
+    allowed = {"hooks.example.com"}
+    assert validate_webhook_url("https://HOOKS.example.com/pdf", allowed_hosts=allowed)
+    with pytest.raises(ValueError, match="not allowed"):
+        validate_webhook_url("http://169.254.169.254/latest/meta-data", allowed_hosts=allowed)
+
+
+def test_memory_backend_runs_higher_priority_first_and_fifo_within_a_priority():
+    async def order():
+        backend = MemoryJobBackend()
+        for job_id, priority in (("low", 0), ("first", 5), ("second", 5), ("lower", -1)):
+            await backend.submit(Job("invest4edu", {}, "assets", priority=priority, job_id=job_id))
+        return [(await backend.next_job()).id for _ in range(4)]
+
+    assert asyncio.run(order()) == ["first", "second", "low", "lower"]
+
+
+def test_queue_rejects_jobs_past_capacity_with_retry_after():
+    async def submit_three():
+        queue = JobQueue(render=None, backend=MemoryJobBackend(), workers=2, max_queued=2)
+        queue._durations = [4.0]
+        await queue.submit(Job("invest4edu", {}, "assets"))
+        await queue.submit(Job("invest4edu", {}, "assets"))
+        with pytest.raises(QueueFullError) as raised:
+            await queue.submit(Job("invest4edu", {}, "assets"))
+        return queue, raised.value
+
+    queue, error = asyncio.run(submit_three())
+    assert error.retry_after == 2
+    assert queue.stats["submitted"] == 2
+    assert queue.stats["rejected"] == 1
+
+
+def test_queue_runs_jobs_and_keeps_only_successful_pdfs():
+    async def run_jobs():
+        async def render(job):
+            if job.data.get("fail"):
+                raise RuntimeError("boom")
+            return b"%PDF-1.7"
+
+        backend = MemoryJobBackend()
+        queue = JobQueue(render, backend=backend, workers=1)
+        ok, failed = Job("invest4edu", {}, "assets"), Job("invest4edu", {"fail": True}, "assets")
+        await queue.submit(ok)
+        await queue.submit(failed)
+        queue.start()
+        while queue.stats["done"] + queue.stats["failed"] < 2:
+            await asyncio.sleep(0.01)
+        await queue.stop()
+        return ok, failed, backend
+
+    ok, failed, backend = asyncio.run(run_jobs())
+    assert (ok.status, ok.pdf_size) == (DONE, 8)
+    assert (failed.status, failed.error) == (FAILED, "boom")
+    assert backend.results == {ok.id: b"%PDF-1.7"}
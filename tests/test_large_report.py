@@ -0,0 +1,79 @@
+"""Large-report chunking: splitting tables, bounded chunk renders and spooling."""
+import asyncio
+import io
+import os
+import tempfile
+
+from pypdf import PdfWriter
+
+from large_report import CHUNKED_TABLES, LargeReportRenderer, table_rows
+from scheduler import RenderScheduler
+
+
+def blank_pdf(pages=1):
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(595, 842)
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+def test_split_cuts_long_tables_into_chunks_in_page_order():
+    renderer = LargeReportRenderer(None, None, threshold=10, chunk_rows=4)
+    data = {"clientname": "A", "pms": {"funds": [{"fund_name": str(i)} for i in range(10)]}}
+
+    assert renderer.applies(data)
+    report_data, chunks = renderer.split(data)
+
+    assert len(table_rows(report_data, CHUNKED_TABLES["pms_funds"])) == 4
+    assert list(chunks) == ["pms_funds/1", "pms_funds/2"]
+    assert [len(rows) for _, rows in chunks.values()] == [4, 2]
+    # The caller's payload is left as it was
+    assert len(data["pms"]["funds"]) == 10
+
+
+def test_chunks_take_scheduler_slots_and_are_spooled_to_disk():
+    scheduler = RenderScheduler(2)
+    renderer = LargeReportRenderer(None, None, memory_mb=2500, scheduler=scheduler)
+    active = peak = 0
+
+    async def render_chunk(template_name, table, rows, page_start, ready_mode, blur_funds, options):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+        return blank_pdf(2 if page_start == 3 else 1)
+
+    renderer._render_chunk = render_chunk
+    chunks = {f"scrips/{i}": ("scrips", []) for i in range(1, 9)}
+    positions = {name: page for page, name in enumerate(chunks, start=2)}
+
+    async def run(spool):
+        await scheduler.acquire()
+        try:
+            return await renderer._render_chunks("t", chunks, list(chunks), positions, "assets", False, None, spool)
+        finally:
+            scheduler.release()
+
+    with tempfile.TemporaryDirectory() as spool:
+        spooled = asyncio.run(run(spool))
+        assert sorted(os.listdir(spool)) == sorted(f"scrips_{i}.pdf" for i in range(1, 9))
+        assert all(os.path.dirname(path) == spool for path, _ in spooled.values())
+    assert {name: count for name, (_, count) in spooled.items()} == {**dict.fromkeys(chunks, 1), "scrips/2": 2}
+    assert peak == 2
+    assert scheduler.inflight == 0
+
+
+def test_a_failed_chunk_fails_the_report():
+    renderer = LargeReportRenderer(None, None)
+
+    async def render_chunk(*args):
+        return None
+
+    renderer._render_chunk = render_chunk
+    chunks = {"scrips/1": ("scrips", []), "scrips/2": ("scrips", [])}
+    with tempfile.TemporaryDirectory() as spool:
+        assert asyncio.run(renderer._render_chunks("t", chunks, list(chunks), dict.fromkeys(chunks, 2), "assets",
+                                                   False, None, spool)) is None
@@ -0,0 +1,75 @@
+"""Payload schema: what the baseline accepted still validates, wrong types and oversized bodies don't."""
+import json
+import os
+
+import pytest
+
+from payload import (MAX_TABLE_ROWS, PayloadError, PayloadTooLarge, check_size, decode_json, parse_payload,
+                     parse_render_options, validate_payload)
+
+SAMPLE_DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sample_data.json")
+
+
+@pytest.fixture
+def sample():
+    with open(SAMPLE_DATA) as f:
+        return json.load(f)
+
+
+def fields(data):
+    with pytest.raises(PayloadError) as raised:
+        validate_payload(data)
+    return [error["field"] for error in raised.value.errors]
+
+
+def test_sample_data_passes_unchanged(sample):
+    assert validate_payload(sample) == sample
+
+
+def test_missing_and_unknown_values_are_kept_as_sent():
+    data = {
+        "report_title": "No client name",
+        "pms": {"funds": [{"category": "Flexi"}]},
+        "private_equity": {"scrips": [{"industry": "Fintech"}]},
+        "asset_allocation": {"distribution": {}, "items": [{"amount": "10L"}]},
+        "advisor": {"name": "Kept for the template"},
+    }
+    assert validate_payload(data) == data
+
+
+def test_wrong_types_name_the_failing_fields():
+    assert fields({"clientname": ["A"], "pms": {"funds": ["not a row"]},
+                   "investment_products": {"target": True}}) == [
+        "clientname", "investment_products.target", "pms.funds.0"]
+    assert fields({"asset_allocation": {"distribution": {"equity": 120}}}) == ["asset_allocation.distribution.equity"]
+
+
+def test_tables_are_limited_in_rows():
+    assert fields({"pms": {"bullets": ["x"] * (MAX_TABLE_ROWS + 1)}}) == ["pms.bullets"]
+
+
+@pytest.mark.parametrize("data", [[], {}, "text"])
+def test_payloads_must_be_non_empty_objects(data):
+    with pytest.raises(PayloadError):
+        validate_payload(data)
+
+
+def test_bodies_are_checked_for_size_and_syntax():
+    with pytest.raises(PayloadTooLarge):
+        parse_payload(b'{"clientname": "A"}', max_bytes=10)
+    with pytest.raises(PayloadError, match="Invalid JSON"):
+        decode_json(b'{"clientname": ')
+    assert parse_payload(b'{"clientname": "A"}') == {"clientname": "A"}
+
+
+def test_check_size_measures_compact_json():
+    check_size({"clientname": "A"}, max_bytes=len('{"clientname":"A"}'))
+    with pytest.raises(PayloadTooLarge):
+        check_size({"clientname": "AB"}, max_bytes=len('{"clientname":"A"}'))
+
+
+def test_render_option_errors_are_prefixed():
+    with pytest.raises(PayloadError) as raised:
+        parse_render_options('{"scale": "big"}')
+    assert [error["field"] for error in raised.value.errors] == ["render_options.scale"]
+    assert parse_render_options("").version == parse_render_options("{}").version
@@ -0,0 +1,108 @@
+"""PDF cache: tiers, shared renders and taking over renders whose owner went away."""
+import asyncio
+
+import pytest
+
+from pdf_cache import PDFCache, etag_matches, make_cache_key
+
+PDF = b"%PDF-1.7 stub"
+
+
+def slow_render(result=PDF, delay=0.05, calls=None):
+    async def render():
+        if calls is not None:
+            calls.append(1)
+        await asyncio.sleep(delay)
+        return result
+    return render
+
+
+def test_cache_keys_ignore_key_order_and_cover_blur_funds():
+    key = make_cache_key("invest4edu_report.html", "v1", {"a": 1, "b": [1, 2]}, False)
+    assert key == make_cache_key("invest4edu_report.html", "v1", {"b": [1, 2], "a": 1}, False)
+    assert key != make_cache_key("invest4edu_report.html", "v1", {"a": 1, "b": [1, 2]}, True)
+    assert key != make_cache_key("invest4edu_report.html", "v2", {"a": 1, "b": [1, 2]}, False)
+
+
+@pytest.mark.parametrize("header, matches", [
+    (None, False), ("", False), ('"abc"', True), ('W/"abc"', True), ('"x", "abc"', True), ("*", True), ('"x"', False),
+])
+def test_etag_matches(header, matches):
+    assert etag_matches(header, '"abc"') is matches
+
+
+def test_memory_tier_evicts_least_recently_used_entries():
+    async def run():
+        cache = PDFCache(2 * len(PDF), "")
+        for key in ("a", "b"):
+            await cache.put(key, PDF)
+        await cache.get("a")
+        await cache.put("c", PDF)
+        return cache
+
+    cache = asyncio.run(run())
+    assert list(cache.memory) == ["a", "c"]
+    assert cache.stats["evictions"] == 1
+
+
+def test_disk_tier_serves_entries_and_is_cleaned_every_n_writes(tmp_path):
+    async def run():
+        cache = PDFCache(1024 * 1024, str(tmp_path), 1024 * 1024, cleanup_every=3)
+        cleanups = []
+        cache.disk.cleanup = lambda: cleanups.append(1)
+        for i in range(7):
+            await cache.put(str(i), PDF)
+        cache.memory.clear()
+        return await cache.get("4"), len(cleanups)
+
+    assert asyncio.run(run()) == ((PDF, "disk"), 2)
+
+
+def test_concurrent_requests_share_one_render():
+    async def run():
+        cache, calls = PDFCache(1024 * 1024, ""), []
+        results = await asyncio.gather(*(cache.get_or_render("k", slow_render(calls=calls)) for _ in range(3)))
+        return results, len(calls), await cache.get_or_render("k", slow_render(calls=calls)), cache.stats["misses"]
+
+    results, calls, again, misses = asyncio.run(run())
+    assert sorted(status for _, status in results) == ["miss", "shared", "shared"]
+    assert calls == 1 and misses == 1
+    assert again == (PDF, "memory")
+
+
+def test_failed_renders_are_not_cached():
+    async def run():
+        cache, calls = PDFCache(1024 * 1024, ""), []
+        first = await cache.get_or_render("k", slow_render(None, calls=calls))
+        second = await cache.get_or_render("k", slow_render(calls=calls))
+        return first, second, len(calls)
+
+    assert asyncio.run(run()) == ((None, "miss"), (PDF, "miss"), 2)
+
+
+def test_a_waiter_takes_over_when_the_owner_is_cancelled():
+    async def run():
+        cache, calls = PDFCache(1024 * 1024, ""), []
+        owner = asyncio.create_task(cache.get_or_render("k", slow_render(calls=calls)))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(cache.get_or_render("k", slow_render(calls=calls)))
+        await asyncio.sleep(0.01)
+        owner.cancel()
+        return await waiter, len(calls), owner.cancelled()
+
+    assert asyncio.run(run()) == ((PDF, "miss"), 2, True)
+
+
+def test_a_cancelled_waiter_leaves_the_shared_render_running():
+    async def run():
+        cache, calls = PDFCache(1024 * 1024, ""), []
+        owner = asyncio.create_task(cache.get_or_render("k", slow_render(calls=calls)))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(cache.get_or_render("k", slow_render(calls=calls)))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        return await owner, len(calls)
+
+    assert asyncio.run(run()) == ((PDF, "miss"), 1)
@@ -0,0 +1,53 @@
+"""Per-request render options: validation, print and context arguments, cache versions."""
+import pytest
+from pydantic import ValidationError
+
+from render_options import DEFAULT_RENDER_OPTIONS, EMPTY_HEADER_FOOTER, RenderOptions
+
+
+def test_defaults_print_a4_with_backgrounds_and_keep_the_cache_key():
+    assert RenderOptions() == DEFAULT_RENDER_OPTIONS
+    assert DEFAULT_RENDER_OPTIONS.version == ""
+    assert DEFAULT_RENDER_OPTIONS.merge_safe
+    assert DEFAULT_RENDER_OPTIONS.pdf_kwargs() == {
+        "format": "A4", "landscape": False, "scale": 1.0, "print_background": True, "display_header_footer": False,
+        "margin": {"top": "20mm", "bottom": "20mm", "left": "15mm", "right": "15mm"},
+    }
+
+
+def test_header_only_gets_an_empty_footer_and_is_printed_in_one_piece():
+    options = RenderOptions(header_template="<span class='pageNumber'></span>", page_ranges=" 1-3, 5 ")
+    kwargs = options.pdf_kwargs()
+    assert kwargs["display_header_footer"]
+    assert kwargs["footer_template"] == EMPTY_HEADER_FOOTER
+    assert kwargs["page_ranges"] == "1-3, 5"
+    assert not options.merge_safe
+
+
+def test_versions_differ_per_option_set():
+    landscape = RenderOptions(landscape=True)
+    assert landscape.version.startswith(":opts")
+    assert landscape.version == RenderOptions.model_validate({"landscape": True}).version
+    assert landscape.version != RenderOptions(scale=0.5).version
+
+
+def test_only_context_options_pick_a_browser_context():
+    assert RenderOptions(landscape=True, scale=0.8).context_key == DEFAULT_RENDER_OPTIONS.context_key
+    localized = RenderOptions(locale="en-IN", device_scale_factor=2)
+    assert localized.context_key != DEFAULT_RENDER_OPTIONS.context_key
+    assert localized.context_kwargs() == {"viewport": {"width": 1280, "height": 720}, "device_scale_factor": 2.0,
+                                          "locale": "en-IN"}
+
+
+@pytest.mark.parametrize("options", [
+    {"format": "B5"}, {"scale": 3}, {"margin": {"top": "2 inches"}}, {"page_ranges": "1-"}, {"locale": "english!"},
+    {"viewport_width": 100}, {"unknown": 1},
+])
+def test_invalid_options_are_rejected(options):
+    with pytest.raises(ValidationError):
+        RenderOptions.model_validate(options)
+
+
+def test_options_are_frozen():
+    with pytest.raises(ValidationError):
+        DEFAULT_RENDER_OPTIONS.scale = 2
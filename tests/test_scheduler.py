@@ -0,0 +1,228 @@
+"""Render scheduler slots, deadlines and bounded fan-out of one request's renders."""
+import asyncio
+
+import pytest
+
+from scheduler import (ClientDisconnected, DeadlineExceeded, RenderScheduler, SchedulerOverloaded, deadline_from_ms,
+                       run_in_slots, run_until_disconnected)
+
+
+class Tracker:
+    """Jobs that record how many of them run at once."""
+
+    def __init__(self, delay=0.01):
+        self.delay = delay
+        self.active = self.peak = self.runs = 0
+
+    def job(self, result="ok"):
+        async def run():
+            self.active += 1
+            self.runs += 1
+            self.peak = max(self.peak, self.active)
+            try:
+                await asyncio.sleep(self.delay)
+            finally:
+                self.active -= 1
+            return result
+        return run
+
+
+def test_waiters_are_admitted_in_arrival_order():
+    async def run():
+        scheduler, order = RenderScheduler(1), []
+
+        async def render(name):
+            async with scheduler.slot():
+                order.append(name)
+                await asyncio.sleep(0.01)
+
+        tasks = []
+        for name in "abcd":
+            tasks.append(asyncio.create_task(render(name)))
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        return scheduler, order
+
+    scheduler, order = asyncio.run(run())
+    assert order == list("abcd")
+    assert scheduler.inflight == 0 and scheduler.stats["admitted"] == 4
+
+
+def test_a_full_queue_is_rejected_with_retry_after():
+    async def run():
+        scheduler = RenderScheduler(1, max_waiting=1)
+        await scheduler.acquire()
+        waiter = asyncio.create_task(scheduler.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(SchedulerOverloaded) as raised:
+            await scheduler.acquire()
+        scheduler.release()
+        await waiter
+        scheduler.release()
+        return scheduler, raised.value
+
+    scheduler, error = asyncio.run(run())
+    assert error.retry_after >= 1
+    assert scheduler.stats["rejected"] == 1
+    assert scheduler.inflight == 0
+
+
+def test_waiting_past_the_deadline_raises_and_leaves_the_queue():
+    async def run():
+        scheduler = RenderScheduler(1)
+        await scheduler.acquire()
+        with pytest.raises(DeadlineExceeded):
+            await scheduler.acquire(deadline_from_ms(20))
+        depth = scheduler.queue_depth
+        scheduler.release()
+        return scheduler, depth
+
+    scheduler, depth = asyncio.run(run())
+    assert depth == 0 and scheduler.inflight == 0
+    assert scheduler.stats["deadline_exceeded"] == 1
+
+
+def test_a_cancelled_waiter_gives_up_its_place():
+    async def run():
+        scheduler = RenderScheduler(1)
+        await scheduler.acquire()
+        waiter = asyncio.create_task(scheduler.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.sleep(0)
+        scheduler.release()
+        return scheduler
+
+    scheduler = asyncio.run(run())
+    assert scheduler.inflight == 0
+    assert scheduler.stats["cancelled"] == 1
+
+
+def test_renders_are_cancelled_when_the_client_disconnects():
+    async def run():
+        cancelled = []
+
+        async def render():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        async def is_disconnected():
+            return True
+
+        with pytest.raises(ClientDisconnected):
+            await run_until_disconnected(is_disconnected, render(), poll_interval=0.01)
+        return cancelled, await run_until_disconnected(is_disconnected, asyncio.sleep(0, "pdf"), poll_interval=0.01)
+
+    assert asyncio.run(run()) == ([True], "pdf")
+
+
+def test_deadline_from_ms():
+    async def run():
+        return deadline_from_ms(0), deadline_from_ms(-5), deadline_from_ms(1000) - asyncio.get_running_loop().time()
+
+    none, negative, relative = asyncio.run(run())
+    assert none is None and negative is None
+    assert relative == pytest.approx(1.0, abs=0.1)
+
+
+def test_fan_out_never_exceeds_the_scheduler_limit():
+    async def run():
+        scheduler, tracker = RenderScheduler(3), Tracker()
+        await scheduler.acquire()  # the request's own slot
+        results = await run_in_slots(scheduler, [tracker.job(i + 1) for i in range(20)], limit=10)
+        inflight = scheduler.inflight
+        scheduler.release()
+        return scheduler, tracker, results, inflight
+
+    scheduler, tracker, results, inflight = asyncio.run(run())
+    assert results == list(range(1, 21))
+    assert tracker.peak == 3
+    assert inflight == 1
+    assert scheduler.inflight == 0 and scheduler.queue_depth == 0
+    assert 0 < scheduler.stats["extra_slots"] < 20
+
+
+def test_fan_out_respects_its_own_limit():
+    async def run():
+        scheduler, tracker = RenderScheduler(10), Tracker()
+        await scheduler.acquire()
+        await run_in_slots(scheduler, [tracker.job() for _ in range(12)], limit=2)
+        scheduler.release()
+        return tracker
+
+    assert asyncio.run(run()).peak == 2
+
+
+def test_fan_out_without_a_scheduler_only_uses_the_limit():
+    async def run():
+        tracker = Tracker()
+        await run_in_slots(None, [tracker.job() for _ in range(12)], limit=4)
+        return tracker
+
+    assert asyncio.run(run()).peak == 4
+
+
+def test_fan_out_runs_everything_in_the_callers_slot_when_no_other_slot_frees_up():
+    async def run():
+        scheduler, tracker = RenderScheduler(1), Tracker(delay=0.001)
+        await scheduler.acquire()
+        deadline = asyncio.get_running_loop().time() + 0.05
+        results = await run_in_slots(scheduler, [tracker.job() for _ in range(5)], limit=5, deadline=deadline)
+        depth = scheduler.queue_depth
+        scheduler.release()
+        return scheduler, tracker, results, depth
+
+    scheduler, tracker, results, depth = asyncio.run(run())
+    assert results == ["ok"] * 5
+    assert tracker.peak == 1
+    # Workers that were still waiting for a slot were withdrawn from the queue
+    assert depth == 0 and scheduler.inflight == 0
+
+
+def test_fan_out_workers_stop_waiting_at_the_deadline():
+    async def run():
+        scheduler = RenderScheduler(1)
+        await scheduler.acquire()
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        deadline = started + 0.05
+        await run_in_slots(scheduler, [Tracker(delay=0.2).job(), Tracker(delay=0.2).job()], limit=2,
+                           deadline=deadline)
+        scheduler.release()
+        return scheduler, loop.time() - started
+
+    scheduler, elapsed = asyncio.run(run())
+    # The extra worker gave up at the deadline and the caller's slot ran both jobs
+    assert scheduler.stats["deadline_exceeded"] == 1
+    assert elapsed >= 0.4
+
+
+def test_fan_out_stops_after_a_failed_job():
+    async def run():
+        tracker = Tracker(delay=0)
+        jobs = [tracker.job(), tracker.job(None)] + [tracker.job() for _ in range(5)]
+        return await run_in_slots(None, jobs, limit=1), tracker
+
+    results, tracker = asyncio.run(run())
+    assert results == ["ok", None, None, None, None, None, None]
+    assert tracker.runs == 2
+
+
+def test_fan_out_raises_job_errors_and_frees_slots():
+    async def boom():
+        raise RuntimeError("render crashed")
+
+    async def run():
+        scheduler = RenderScheduler(4)
+        await scheduler.acquire()
+        with pytest.raises(RuntimeError):
+            await run_in_slots(scheduler, [Tracker().job(), boom, Tracker().job()], limit=3)
+        await asyncio.sleep(0)
+        scheduler.release()
+        return scheduler
+
+    scheduler = asyncio.run(run())
+    assert scheduler.inflight == 0
@@ -0,0 +1,86 @@
+"""Reports assembled from cached sections: bounded section renders and reuse."""
+import asyncio
+
+import pytest
+
+import sections as sections_module
+from pdf_cache import PDFCache
+from scheduler import RenderScheduler
+from sections import TEMPLATE_SECTIONS, SectionRenderer, section_marker
+
+TEMPLATE = "invest4edu_report.html"
+
+
+class Generator:
+    assets = None
+
+    def template_digest(self, template_name):
+        return "v1"
+
+
+@pytest.fixture
+def renderer(monkeypatch):
+    """A SectionRenderer whose frame, sections and merge are stubs that need no browser or pypdf."""
+    names = [path[0] for path in TEMPLATE_SECTIONS[TEMPLATE]]
+    monkeypatch.setattr(sections_module, "placeholder_pages",
+                        lambda pdf_bytes: {section_marker(name): page for page, name in enumerate(names, start=3)})
+    monkeypatch.setattr(sections_module, "page_count", lambda pdf_bytes: 1)
+    monkeypatch.setattr(sections_module, "merge_segments", lambda frame, segments: frame + b"".join(segments.values()))
+
+    renderer = SectionRenderer(Generator(), None, enabled=True, cache=PDFCache(10 * 1024 * 1024, ""),
+                               scheduler=RenderScheduler(2))
+    renderer.active = renderer.peak = 0
+
+    async def render_frame(*args):
+        return b"frame"
+
+    async def render_section(template_name, name, data, page_start, ready_mode, options):
+        renderer.active += 1
+        renderer.peak = max(renderer.peak, renderer.active)
+        await asyncio.sleep(0.01)
+        renderer.active -= 1
+        return f"[{name}@{page_start}]".encode()
+
+    renderer._render_frame = render_frame
+    renderer._render_section = render_section
+    return renderer
+
+
+def render(renderer, data):
+    async def run():
+        render_info = {}
+        await renderer.scheduler.acquire()  # the request's own slot
+        try:
+            pdf_bytes = await renderer.render(TEMPLATE, data, "assets", {}, render_info=render_info)
+        finally:
+            renderer.scheduler.release()
+        return pdf_bytes, render_info
+
+    return asyncio.run(run())
+
+
+def report_data(**changes):
+    data = {"clientname": "A", "asset_allocation": {"equity": 60}, "investment_products": {"mutual_fund": {}},
+            "pms": {"funds": [1]}, "fixed_income_offering": {"bonds": [1]}, "private_equity": {"deals": [1]}}
+    data.update(changes)
+    return data
+
+
+def test_sections_render_within_the_scheduler_limit(renderer):
+    pdf_bytes, render_info = render(renderer, report_data())
+
+    assert pdf_bytes.startswith(b"frame[asset_allocation@3][investment_products@4]")
+    assert render_info == {"sections_reused": 0, "sections_rendered": 5}
+    assert renderer.peak == 2
+    assert 0 < renderer.scheduler.stats["extra_slots"] < 5
+    assert renderer.scheduler.inflight == 0
+
+
+def test_cached_sections_take_no_extra_slots(renderer):
+    render(renderer, report_data())
+    extra_slots = renderer.scheduler.stats["extra_slots"]
+
+    _, render_info = render(renderer, report_data(pms={"funds": [2]}))
+
+    assert render_info == {"sections_reused": 4, "sections_rendered": 1}
+    assert renderer.scheduler.stats["extra_slots"] == extra_slots
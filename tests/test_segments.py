@@ -0,0 +1,71 @@
+"""Segmented rendering: static page fragments rendered once and merged into reports."""
+import asyncio
+import types
+
+import pytest
+
+import segments
+from segments import StaticPageCache
+
+STATIC_PAGES = ("cover.png", "2.png", "11.png", "cover.png")
+
+
+class Generator:
+    def template_digest(self, template_name):
+        return "v1"
+
+    def render_html(self, template_name, data, static_page=None, timings=None):
+        if static_page is None:
+            return f"<img src='{data['name']}'>"
+        return "".join(static_page(name) for name in STATIC_PAGES)
+
+
+class Pool:
+    """Browser pool stub that records how many renders run at once."""
+
+    def __init__(self, fail=()):
+        self.fail = fail
+        self.active = self.peak = 0
+        self.rendered = []
+
+    async def render_pdf(self, html_content, ready_mode=None, timings=None, options=None):
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        await asyncio.sleep(0.01)
+        self.active -= 1
+        self.rendered.append(html_content)
+        return None if any(name in html_content for name in self.fail) else html_content.encode()
+
+
+@pytest.fixture(autouse=True)
+def merge(monkeypatch):
+    monkeypatch.setattr(segments, "merge_segments",
+                        lambda dynamic_pdf, fragments: dynamic_pdf + b"|" + b"|".join(fragments.values()))
+
+
+def static_pages(pool):
+    return StaticPageCache(Generator(), pool, types.SimpleNamespace(digest="a1"), mode="segmented")
+
+
+def test_fragments_render_one_at_a_time_and_once():
+    pool = Pool()
+    cache = static_pages(pool)
+
+    async def render_twice():
+        first = await cache.render("invest4edu_report.html", {}, "assets", {})
+        second = await cache.render("invest4edu_report.html", {}, "assets", {})
+        return first, second
+
+    first, second = asyncio.run(render_twice())
+    assert first == second
+    assert first.count(b"|") == 3
+    assert pool.peak == 1
+    # Three fragments and two reports
+    assert len(pool.rendered) == 5
+    assert cache.stats["fragments_rendered"] == 3
+
+
+def test_a_failed_fragment_fails_the_report_without_rendering_the_rest():
+    pool = Pool(fail=("2.png",))
+    assert asyncio.run(static_pages(pool).render("invest4edu_report.html", {}, "assets", {})) is None
+    assert pool.rendered == ["<img src='cover.png'>", "<img src='2.png'>"]
@@ -0,0 +1,38 @@
+"""Templates rendered to HTML: the readiness flag the browser waits for in the flag ready mode."""
+import json
+import os
+
+import pytest
+
+pytest.importorskip("jinja2")
+
+from browser_pdf_generator import BrowserPDFGenerator, TEMPLATE_MAP
+from segments import STATIC_PAGE_TEMPLATE
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+READY_FLAG = "window.__reportReady = true"
+
+
+@pytest.fixture(scope="module")
+def generator():
+    return BrowserPDFGenerator()
+
+
+@pytest.fixture
+def data():
+    with open(os.path.join(ROOT, "sample_data.json")) as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize("template", sorted(TEMPLATE_MAP.values()))
+def test_reports_set_the_ready_flag_once_after_fonts_and_images(generator, data, template):
+    html_content = generator.render_html(template, data, asset_url=lambda name: f"/{name}")
+    assert html_content.count(READY_FLAG) == 1
+    # The flag is set by the last script, after every image in the document
+    assert html_content.rindex("<img") < html_content.index(READY_FLAG)
+    assert "document.fonts.ready" in html_content
+
+
+def test_static_pages_set_the_ready_flag(generator):
+    html_content = generator.render_html(STATIC_PAGE_TEMPLATE, {"name": "cover"}, asset_url=lambda name: f"/{name}")
+    assert READY_FLAG in html_content
@@ -0,0 +1,47 @@
+"""Startup prewarming: prewarm data, retries and when the instance counts as prewarmed."""
+import asyncio
+import json
+
+from warmup import Warmup, load_prewarm_data
+
+
+def test_prewarm_data_drops_request_options(tmp_path):
+    path = tmp_path / "data.json"
+    path.write_text(json.dumps({"template": "investvalue", "engine": "lite", "render_options": {}, "blur_funds": 1,
+                                "pms": {"funds": []}}))
+    assert load_prewarm_data(str(path)) == {"pms": {"funds": []}, "clientname": "Prewarm", "blur_funds": True}
+    assert load_prewarm_data(str(tmp_path / "missing.json")) == {"clientname": "Prewarm", "blur_funds": False}
+
+
+def test_failed_templates_are_retried_until_every_template_prewarmed():
+    attempts = {"invest4edu": 0, "investvalue": 0}
+
+    async def render(template, data):
+        attempts[template] += 1
+        if template == "investvalue" and attempts[template] < 3:
+            raise RuntimeError("browser not ready")
+        return b"%PDF"
+
+    warmup = Warmup(enabled=True, retry_seconds=0)
+    asyncio.run(warmup.run(render, list(attempts), data={}))
+
+    assert warmup.done
+    assert attempts == {"invest4edu": 1, "investvalue": 3}
+    assert warmup.snapshot()["templates"]["investvalue"]["attempts"] == 3
+
+
+def test_without_retries_a_failed_template_keeps_the_instance_unready():
+    async def render(template, data):
+        return None
+
+    warmup = Warmup(enabled=True)
+    asyncio.run(warmup.run(render, ["invest4edu"], data={}, retry=False))
+
+    assert not warmup.done
+    assert warmup.templates["invest4edu"]["error"] == "render failed"
+
+
+def test_disabled_prewarming_is_done_at_once():
+    warmup = Warmup(enabled=False)
+    asyncio.run(warmup.run(None, ["invest4edu"]))
+    assert warmup.done and warmup.templates == {}
@@ -0,0 +1,90 @@
+import asyncio
+import json
+import os
+import time
+
+# Render one throwaway report per template at startup, so the first real
+# requests don't pay for page creation, font loading and the first layout
+PREWARM = os.environ.get("PDF_PREWARM", "true").lower() in ("1", "true", "yes")
+PREWARM_DATA = os.environ.get("PDF_PREWARM_DATA", "sample_data.json")
+PREWARM_TIMEOUT_SECONDS = float(os.environ.get("PDF_PREWARM_TIMEOUT_SECONDS", "60"))
+# Templates whose prewarm render failed are retried after this many seconds
+PREWARM_RETRY_SECONDS = float(os.environ.get("PDF_PREWARM_RETRY_SECONDS", "10"))
+# /readyz fails while this many renders wait for a slot (0 = the scheduler's max_inflight)
+READY_MAX_QUEUE_DEPTH = int(os.environ.get("PDF_READY_MAX_QUEUE_DEPTH", "0"))
+
+# Request options that are not report data
+_OPTION_FIELDS = ("template", "ready_mode", "optimize", "engine", "render_options")
+
+
+def load_prewarm_data(path=PREWARM_DATA):
+    """Report data for the prewarm renders; a minimal payload if the file can't be read."""
+    try:
+        with open(path, "rb") as f:
+            data = json.loads(f.read())
+    except (OSError, ValueError) as e:
+        print(f"Warning: prewarm data not loaded ({e}), using a minimal payload")
+        data = {}
+    if not isinstance(data, dict):
+        data = {}
+    for key in _OPTION_FIELDS:
+        data.pop(key, None)
+    data.setdefault("clientname", "Prewarm")
+    data["blur_funds"] = bool(data.get("blur_funds", False))
+    return data
+
+
+class Warmup:
+    """Startup prewarming of the render path, reported by /readyz."""
+
+    def __init__(self, enabled=PREWARM, timeout=PREWARM_TIMEOUT_SECONDS, retry_seconds=PREWARM_RETRY_SECONDS):
+        self.enabled = enabled
+        self.timeout = timeout
+        self.retry_seconds = retry_seconds
+        self.done = False
+        self.seconds = None
+        self.templates = {}
+
+    async def run(self, render, templates, data=None, retry=True):
+        """Render every template once with ``render(template, data)``.
+
+        Failed renders are logged and, with ``retry``, retried every
+        ``retry_seconds``. ``done`` is only set once every template rendered
+        successfully.
+        """
+        start = time.perf_counter()
+        if self.enabled:
+            data = load_prewarm_data() if data is None else data
+
+            async def render_one(name):
+                render_start = time.perf_counter()
+                try:
+                    error = None if await asyncio.wait_for(render(name, dict(data)), self.timeout) else "render failed"
+                except Exception as e:
+                    error = str(e) or type(e).__name__
+                attempts = self.templates.get(name, {}).get("attempts", 0) + 1
+                result = {"ok": error is None, "ms": round((time.perf_counter() - render_start) * 1000, 1),
+                          "attempts": attempts}
+                if error:
+                    print(f"Warning: prewarm render of {name} failed: {error}")
+                    result["error"] = error
+                self.templates[name] = result
+
+            pending = list(templates)
+            total = len(pending)
+            while True:
+                await asyncio.gather(*(render_one(name) for name in pending))
+                pending = [name for name in pending if not self.templates[name]["ok"]]
+                print(f"Prewarmed {total - len(pending)}/{total} templates in "
+                      f"{(time.perf_counter() - start) * 1000:.0f} ms")
+                if not pending or not retry:
+                    break
+                await asyncio.sleep(self.retry_seconds)
+            self.done = not pending
+        else:
+            self.done = True
+        self.seconds = round(time.perf_counter() - start, 3)
+
+    def snapshot(self):
+        """Whether every template prewarmed, how long it took and the result per template."""
+        return {"enabled": self.enabled, "done": self.done, "seconds": self.seconds, "templates": self.templates}